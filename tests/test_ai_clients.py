@@ -45,6 +45,111 @@ def test_llm_instance_creation():
         assert "API" in str(e) or "key" in str(e)
 
 
+def test_openrouter_ainvoke_batch():
+    """Test driver asincrono: ordine preservato ed errori isolati per richiesta"""
+    import asyncio
+    import json
+    import httpx
+    from ai_clients import ainvoke_batch
+    
+    def handler(request):
+        contenuto = json.loads(request.content)["messages"][0]["content"]
+        if contenuto == "errore":
+            return httpx.Response(500)
+        return httpx.Response(200, json={"choices": [{"message": {"content": contenuto.upper()}}]})
+    
+    client = OpenRouterLLM(model="test-model", api_key="test-key")
+    
+    async def esegui():
+        http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        OpenRouterLLM._async_clients[asyncio.get_running_loop()] = http
+        try:
+            return await ainvoke_batch(client, ["uno", "errore", "tre"], max_concorrenza=2)
+        finally:
+            await OpenRouterLLM.aclose()
+    
+    risposte = asyncio.run(esegui())
+    
+    assert risposte[0] == "UNO"
+    assert isinstance(risposte[1], Exception)
+    assert risposte[2] == "TRE"
+
+
+def test_openrouter_opzioni_nel_payload():
+    """Test: le opzioni di invoke (es. response_format) finiscono nel payload"""
+    client = OpenRouterLLM(model="test-model", api_key="test-key")
+    
+    _, data = client._prepara_richiesta("ciao", response_format={"type": "json_object"})
+    
+    assert data["response_format"] == {"type": "json_object"}
+    assert data["messages"] == [{"role": "user", "content": "ciao"}]
+
+
+def test_openrouter_stream(monkeypatch):
+    """Test: lo streaming SSE restituisce i frammenti di testo in ordine"""
+    class FakeStream:
+        status_code = 200
+        headers = {}
+        
+        def __enter__(self):
+            return self
+        
+        def __exit__(self, *args):
+            return False
+        
+        def raise_for_status(self):
+            pass
+        
+        def iter_lines(self, decode_unicode=True):
+            yield ': OPENROUTER PROCESSING'
+            yield 'data: {"choices": [{"delta": {"content": "Cia"}}]}'
+            yield ''
+            yield 'data: {"choices": [{"delta": {"content": "o"}}]}'
+            yield 'data: [DONE]'
+    
+    client = OpenRouterLLM(model="test-model", api_key="test-key")
+    monkeypatch.setattr(OpenRouterLLM._get_session(), 'post', lambda *args, **kwargs: FakeStream())
+    
+    assert list(client.stream("ciao")) == ["Cia", "o"]
+
+
+def test_context_length_registry():
+    """Test registro finestre di contesto"""
+    from ai_clients import get_context_length, DEFAULT_CONTEXT_LENGTH
+    
+    assert get_context_length('mixtral:8x7b', 'openrouter') == 32768
+    assert get_context_length('modello-sconosciuto') == DEFAULT_CONTEXT_LENGTH
+    # Per Ollama vale il limite num_ctx del server
+    assert get_context_length('mixtral:8x7b', 'ollama') <= 32768
+
+
+def test_calibrazione_ollama_ignora_prompt_in_cache(monkeypatch, tmp_path):
+    """Test: un prompt che condivide il prefisso con il precedente non alimenta la stima dei token di input"""
+    import ai_clients
+    from langchain_core.outputs import Generation, LLMResult
+    from token_calibration import TokenCalibrator
+    
+    calibratore = TokenCalibrator(str(tmp_path / "cal.json"))
+    monkeypatch.setattr(ai_clients, 'get_calibrator', lambda: calibratore)
+    callback = ai_clients.OllamaUsageCallback("modello")
+    prefisso = "ETICHETTE: " + "descrizione delle etichette " * 20
+    
+    def chiamata(run_id, prompt, token_prompt):
+        callback.on_llm_start({}, [prompt], run_id=run_id)
+        callback.on_llm_end(LLMResult(generations=[[Generation(
+            text="ok", generation_info={"prompt_eval_count": token_prompt, "eval_count": 1}
+        )]]), run_id=run_id)
+    
+    # Primo prompt: valutato per intero
+    chiamata(1, prefisso + "COMMENTI: primo batch", 150)
+    # Secondo: il prefisso arriva dalla KV-cache, ma il rapporto caratteri/token (≈7) passerebbe il filtro
+    chiamata(2, prefisso + "COMMENTI: secondo batch " * 3, 90)
+    
+    stato = calibratore._modelli["modello"]
+    assert stato["campioni"] == 3  # due risposte e il solo primo prompt
+    assert stato["token"] == 150 + 2
+
+
 def test_connection_validation():
     """Test validazione connessioni"""
     # Test con configurazione non valida
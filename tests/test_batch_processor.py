@@ -2,14 +2,22 @@
 Test per il modulo batch_processor.py
 """
 import pytest
+import json
 import pandas as pd
 import sys
 import os
+import time
+import threading
 
 # Aggiungi la directory utils al path per gli import
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
 
 from batch_processor import process_comments_batch, create_batch_prompt, parse_batch_response
+from batch_processor import etichetta_con_coefficiente_batch, crea_batch_per_budget, parse_batch_response_per_id
+from batch_processor import parse_batch_response_json, crea_schema_risposta_batch
+from batch_processor import parse_batch_response_compatta, stima_token_output_per_commento
+from batch_processor import create_batch_prompt_cache, benchmark_cache_prompt, opzioni_da_config
+from config_manager import AnalysisConfig
 
 
 class MockLLM:
@@ -21,6 +29,21 @@ class MockLLM:
         return self.response
 
 
+class EchoBatchLLM:
+    """Mock LLM che etichetta ogni commento del batch con il suo stesso testo"""
+    def __init__(self):
+        self.chiamate = 0
+    
+    def invoke(self, prompt):
+        import re
+        self.chiamate += 1
+        commenti = re.findall(r'COMMENTO_(\d+): "(.*)"', prompt)
+        return "\n".join(
+            f"=== COMMENTO_{n} ===\nPRINCIPALE: {testo} (coefficiente: 0.80)\nCONFIDENZA_GENERALE: 0.75"
+            for n, testo in commenti
+        )
+
+
 def test_create_batch_prompt():
     """Test creazione prompt per batch"""
     comments = ["Ottimo prodotto", "Servizio lento", "Buona qualità"]
@@ -153,5 +176,607 @@ def test_performance_comparison():
     assert batch_time < single_time
 
 
+def test_etichettatura_concorrente_mantiene_indici():
+    """Test modalità concorrente: i risultati devono finire agli indici corretti"""
+    df = pd.DataFrame({'commenti': [f"Tema{i}" if i % 4 else None for i in range(12)]})
+    etichette = {f"Tema{i}": {'descrizione': 'test'} for i in range(12)}
+    llm = EchoBatchLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', llm, 'ollama',
+        batch_size=2, max_workers=4
+    )
+    
+    for i in range(12):
+        atteso = f"Tema{i}" if i % 4 else "Vuota"
+        assert risultati["etichette_principali"][i] == atteso
+    assert llm.chiamate == 5
+
+
+def test_deduplicazione_commenti_identici():
+    """Test: i duplicati normalizzati vengono etichettati una sola volta"""
+    df = pd.DataFrame({'commenti': ["No", "no.", " NO ", "Nessuno", "Non saprei", "non saprei!"]})
+    etichette = {"No": {'descrizione': 'test'}}
+    llm = EchoBatchLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(df, etichette, 'commenti', 'test', llm, 'ollama', batch_size=1)
+    
+    assert llm.chiamate == 3
+    assert risultati["etichette_principali"][:3] == ["No", "No", "No"]
+    assert risultati["etichette_principali"][5] == "Non saprei"
+    assert risultati["statistiche_deduplica"]["chiamate_risparmiate"] == 3
+
+
+def test_deduplicazione_emoji_ed_emoticon():
+    """Test: emoji ed emoticon opposte non vengono unite, le chiavi vuote mai"""
+    from data_parsers import normalizza_commento, raggruppa_duplicati
+    
+    assert normalizza_commento("👍") != normalizza_commento("👎")
+    assert normalizza_commento(":)") != normalizza_commento(":(")
+    assert normalizza_commento("Bene 👍!") == normalizza_commento("bene 👍")
+    
+    rappresentanti, gruppi = raggruppa_duplicati({0: "👍", 1: "👎", 2: " 👍 ", 3: ":)", 4: ":(", 5: "-", 6: " ", 7: "  "})
+    
+    assert gruppi[0] == [0, 2]
+    assert gruppi[1] == [1]
+    assert gruppi[3] == [3] and gruppi[4] == [4]
+    assert gruppi[6] == [6] and gruppi[7] == [7]
+
+
+def test_budget_token_sulla_richiesta_inviata():
+    """Test: la parte fissa del budget è misurata sulla stessa richiesta inviata al modello"""
+    from batch_processor import _crea_richiesta_batch, _testo_richiesta, _invoca_batch
+    
+    class CatturaLLM:
+        def invoke(self, richiesta, **kwargs):
+            self.richiesta = richiesta
+            return ""
+    
+    llm = CatturaLLM()
+    _invoca_batch(["uno"], "- A: test", "test", llm, "openrouter", 0.3, prefisso_statico=True)
+    
+    assert llm.richiesta == _crea_richiesta_batch(["uno"], "- A: test", "test", "openrouter", 0.3, prefisso_statico=True)
+    fissa = _testo_richiesta(_crea_richiesta_batch([], "- A: test", "test", "openrouter", 0.3, prefisso_statico=True))
+    assert "Sei un analista esperto" in fissa
+    assert "- A: test" in fissa
+
+
+def test_process_comments_batch_deduplica():
+    """Test: process_comments_batch ridistribuisce i risultati ai duplicati"""
+    class ContaLLM(MockLLM):
+        chiamate = 0
+        def invoke(self, prompt):
+            self.chiamate += 1
+            return self.response
+    
+    llm = ContaLLM("Commento 1: Negativo\nCommento 2: Positivo")
+    
+    results = process_comments_batch(["No", "Ottimo", "no", "NO!"], "Classifica", llm, batch_size=2)
+    
+    assert llm.chiamate == 1
+    assert results == ["Negativo", "Positivo", "Negativo", "Negativo"]
+    
+    _, statistiche = process_comments_batch(["No", "Ottimo", "no", "NO!"], "Classifica", llm, batch_size=2,
+                                            con_statistiche=True)
+    assert statistiche == {"commenti_validi": 4, "commenti_unici": 2, "duplicati_collassati": 2,
+                           "chiamate_risparmiate": 1}
+
+
+def test_deduplicazione_chiamate_risparmiate_con_batch_a_token():
+    """Test: il risparmio della deduplica si misura con lo stesso raggruppamento dei batch inviati"""
+    testi = [f"{tema} " + "parola " * 400 for tema in ["Alfa", "Beta", "Gamma", "Delta"]]
+    df = pd.DataFrame({'commenti': testi + testi[:2]})
+    etichette = {"Alfa": {'descrizione': 'test'}}
+    llm = EchoBatchLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', llm, 'ollama', batch_size=5,
+        batch_per_token=True, max_token_input=1000, max_tentativi_riparazione=0
+    )
+    
+    assert llm.chiamate == 4
+    # Senza deduplica i 6 commenti sarebbero stati 6 batch, non ceil(6 / batch_size) = 2
+    assert risultati["statistiche_deduplica"]["chiamate_risparmiate"] == 2
+
+
+def test_batch_per_budget_token():
+    """Test: i batch rispettano il budget e raggruppano commenti di lunghezza simile"""
+    commenti = {i: "breve" for i in range(10)}
+    commenti.update({10 + i: "x" * 4000 for i in range(3)})
+    
+    batches = crea_batch_per_budget(
+        commenti, token_fissi=100, max_token_input=1150,
+        max_token_output=10000, token_output_per_commento=50
+    )
+    
+    assert sorted(idx for batch in batches for idx in batch) == list(range(13))
+    assert batches[0] == list(range(10))
+    assert all(len(batch) == 1 for batch in batches[1:])
+
+
+def test_batch_per_budget_limite_output():
+    """Test: il budget di output limita il numero di commenti per batch"""
+    commenti = {i: "breve" for i in range(10)}
+    
+    batches = crea_batch_per_budget(
+        commenti, token_fissi=100, max_token_input=100000,
+        max_token_output=200, token_output_per_commento=50
+    )
+    
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+
+
+def test_parse_per_id_commento_saltato_e_riordinato():
+    """Test: le sezioni vanno al commento indicato nell'intestazione, non alla posizione"""
+    risposta = """=== COMMENTO_3 ===
+PRINCIPALE: Terzo (coefficiente: 0.90)
+=== COMMENTO_1 ===
+PRINCIPALE: Primo (coefficiente: 0.80)
+=== COMMENTO_1 ===
+PRINCIPALE: Altro (coefficiente: 0.10)
+=== COMMENTO_7 ===
+PRINCIPALE: Fuori (coefficiente: 0.50)"""
+    
+    risultati, mancanti, duplicati = parse_batch_response_per_id(risposta, 4, 0.3)
+    
+    assert [r["principale"] for r in risultati] == ["Primo", "Incerto", "Terzo", "Incerto"]
+    assert risultati[2]["coeff_principale"] == 0.9
+    assert mancanti == [1, 3]
+    assert duplicati == [1]
+
+
+def test_sezioni_mancanti_riaccodate_subito():
+    """Test: solo i commenti senza sezione vengono rispediti, non l'intero batch"""
+    class SaltaSecondoLLM(EchoBatchLLM):
+        def __init__(self):
+            super().__init__()
+            self.prompt_ricevuti = []
+        
+        def invoke(self, prompt):
+            self.prompt_ricevuti.append(prompt)
+            risposta = super().invoke(prompt)
+            if self.chiamate == 1:
+                sezioni = risposta.split("\n=== ")
+                return "\n=== ".join(s for s in sezioni if not s.startswith("COMMENTO_2 "))
+            return risposta
+    
+    df = pd.DataFrame({'commenti': ["uno", "due", "tre"]})
+    llm = SaltaSecondoLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(df, {"uno": {'descrizione': 'test'}}, 'commenti', 'test', llm, 'ollama',
+                                                 batch_size=3)
+    
+    assert risultati["etichette_principali"] == ["uno", "due", "tre"]
+    assert llm.chiamate == 2
+    assert '"due"' in llm.prompt_ricevuti[1] and '"uno"' not in llm.prompt_ricevuti[1]
+
+
+class JsonBatchLLM:
+    """Mock LLM in modalità JSON: registra le opzioni ricevute e risponde secondo lo schema"""
+    def __init__(self, valido=True):
+        self.valido = valido
+        self.opzioni = []
+    
+    def invoke(self, prompt, **kwargs):
+        import re
+        import json
+        self.opzioni.append(kwargs)
+        if isinstance(prompt, list):
+            prompt = prompt[-1]["content"]
+        commenti = re.findall(r'COMMENTO_(\d+): "(.*)"', prompt)
+        if not self.valido:
+            return "\n".join(
+                f"=== COMMENTO_{n} ===\nPRINCIPALE: {testo} (coefficiente: 0.60)" for n, testo in commenti
+            )
+        return "```json\n" + json.dumps({"commenti": [
+            {"id": int(n), "principale": testo, "coefficiente": 0.9,
+             "coefficienti": {testo: 0.9, "Altro": 0.5, "Zero": 0.0}, "confidenza": 0.8}
+            for n, testo in reversed(commenti)
+        ]}) + "\n```"
+
+
+def test_parse_batch_response_json():
+    """Test: record tipizzati, secondarie derivate dai coefficienti, assegnazione per id"""
+    risposta = '''{"commenti": [
+        {"id": 2, "principale": "B", "coefficiente": 0.7, "coefficienti": {"A": 0.4, "B": 0.7, "C": 0.1}, "confidenza": 0.6},
+        {"id": 2, "principale": "C", "coefficiente": 0.9, "coefficienti": {}, "confidenza": 0.9}
+    ]}'''
+    
+    risultati, mancanti, duplicati = parse_batch_response_json(risposta, 2, 0.3)
+    
+    assert risultati[0]["principale"] == "Incerto"
+    assert risultati[1]["principale"] == "B"
+    assert risultati[1]["secondarie"] == "A (0.40)"
+    assert json.loads(risultati[1]["tutti_coefficienti"]) == {"A": 0.4, "B": 0.7, "C": 0.1}
+    assert mancanti == [0]
+    assert duplicati == [2]
+    
+    with pytest.raises(ValueError):
+        parse_batch_response_json("PRINCIPALE: A (coefficiente: 0.5)", 1, 0.3)
+
+
+def test_schema_risposta_batch():
+    """Test: lo schema limita la principale alle etichette note"""
+    schema = crea_schema_risposta_batch(["A", "B"])
+    elemento = schema["properties"]["commenti"]["items"]
+    
+    assert elemento["properties"]["principale"]["enum"] == ["A", "B", "Incerto"]
+    assert elemento["properties"]["coefficienti"]["required"] == ["A", "B"]
+
+
+def test_etichettatura_formato_json():
+    """Test: in modalità JSON Ollama riceve lo schema come format"""
+    df = pd.DataFrame({'commenti': ["uno", "due"]})
+    llm = JsonBatchLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(df, {"uno": {'descrizione': 'test'}}, 'commenti', 'test', llm, 'ollama',
+                                                 batch_size=2, formato_json=True)
+    
+    assert risultati["etichette_principali"] == ["uno", "due"]
+    assert risultati["etichette_secondarie"] == ["Altro (0.50)", "Altro (0.50)"]
+    assert llm.opzioni[0]["format"]["required"] == ["commenti"]
+
+
+def test_etichettatura_formato_json_ripiego_testuale():
+    """Test: se la risposta non è JSON si usa il parser testuale"""
+    df = pd.DataFrame({'commenti': ["uno", "due"]})
+    llm = JsonBatchLLM(valido=False)
+    
+    risultati = etichetta_con_coefficiente_batch(df, {"uno": {'descrizione': 'test'}}, 'commenti', 'test', llm,
+                                                 'openrouter', batch_size=2, formato_json=True)
+    
+    assert risultati["etichette_principali"] == ["uno", "due"]
+    assert llm.opzioni[0]["response_format"]["type"] == "json_schema"
+
+
+def test_parse_batch_response_compatta():
+    """Test: gli ID vengono espansi nei nomi e le etichette omesse valgono 0"""
+    risposta = """C2: E3=0.40 E1=0.85 | 0.70
+C1: E2=0.60
+C3: E9=0.50
+C2: E2=0.10"""
+    
+    risultati, mancanti, duplicati = parse_batch_response_compatta(risposta, 3, 0.3, ["Prezzo", "Qualità", "Servizio"])
+    
+    assert risultati[1]["principale"] == "Prezzo"
+    assert risultati[1]["secondarie"] == "Servizio (0.40)"
+    assert risultati[1]["confidenza_generale"] == 0.7
+    assert json.loads(risultati[1]["tutti_coefficienti"]) == {"Prezzo": 0.85, "Servizio": 0.4}
+    assert risultati[0]["principale"] == "Qualità"
+    assert risultati[0]["confidenza_generale"] == 0.6
+    # E9 non esiste: la riga non è utilizzabile
+    assert mancanti == [2]
+    assert duplicati == [2]
+
+
+def test_output_compatto_non_cresce_con_le_etichette():
+    """Test: la stima di output compatta dipende solo da top_k"""
+    assert stima_token_output_per_commento(5, top_k=3) == stima_token_output_per_commento(30, top_k=3)
+    assert stima_token_output_per_commento(30, top_k=3) < stima_token_output_per_commento(30)
+
+
+def test_etichettatura_protocollo_compatto():
+    """Test: il prompt usa gli ID e la risposta viene riportata ai nomi"""
+    class CompattoLLM:
+        def __init__(self):
+            self.prompt = None
+        
+        def invoke(self, prompt):
+            self.prompt = prompt
+            return "C1: E2=0.90 E1=0.20\nC2: E1=0.75 | 0.60"
+    
+    df = pd.DataFrame({'commenti': ["ottimo servizio", "caro"]})
+    etichette = {"Prezzo": {'descrizione': 'costi'}, "Servizio": {'descrizione': 'assistenza'}}
+    llm = CompattoLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(df, etichette, 'commenti', 'test', llm, 'ollama',
+                                                 batch_size=2, protocollo_compatto=True, top_k=2)
+    
+    assert "E1: Prezzo - costi" in llm.prompt
+    assert "TUTTI_COEFFICIENTI" not in llm.prompt
+    assert risultati["etichette_principali"] == ["Servizio", "Prezzo"]
+    assert risultati["coefficienti_principali"] == [0.9, 0.75]
+
+
+def test_prompt_cache_prefisso_identico():
+    """Test: il prefisso statico non dipende dai commenti del batch"""
+    etichette = "- Prezzo: costi\n- Servizio: assistenza"
+    
+    prefisso_a, variabile_a = create_batch_prompt_cache(["uno", "due"], etichette, 0.3)
+    prefisso_b, variabile_b = create_batch_prompt_cache(["tre", "quattro", "cinque"], etichette, 0.3)
+    
+    assert prefisso_a == prefisso_b
+    assert "Prezzo" in prefisso_a and "TUTTI_COEFFICIENTI" in prefisso_a
+    assert variabile_b.startswith("COMMENTI DA ANALIZZARE (3):")
+    assert 'COMMENTO_3: "cinque"' in variabile_b
+
+
+def test_prompt_cache_openrouter_messaggio_sistema():
+    """Test: con OpenRouter il prefisso statico va nel messaggio di sistema"""
+    class RegistraLLM(EchoBatchLLM):
+        def __init__(self):
+            super().__init__()
+            self.richieste = []
+        
+        def invoke(self, messages):
+            self.richieste.append(messages)
+            return super().invoke(messages[-1]["content"])
+    
+    df = pd.DataFrame({'commenti': ["uno", "due", "tre"]})
+    llm = RegistraLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(df, {"uno": {'descrizione': 'test'}}, 'commenti', 'test', llm,
+                                                 'openrouter', batch_size=2)
+    
+    assert risultati["etichette_principali"] == ["uno", "due", "tre"]
+    sistemi = [richiesta[0]["content"] for richiesta in llm.richieste]
+    assert sistemi[0] == sistemi[1]
+    assert "ETICHETTE DISPONIBILI" in sistemi[0]
+    assert "ETICHETTE DISPONIBILI" not in llm.richieste[0][1]["content"]
+
+
+def test_benchmark_cache_prompt():
+    """Test: il benchmark misura il primo frammento dei due batch con lo stesso prefisso"""
+    import time
+    
+    class StreamLLM:
+        def __init__(self):
+            self.prefissi = []
+        
+        def stream(self, prompt):
+            prefisso = prompt.split("COMMENTI DA ANALIZZARE")[0]
+            # Il secondo batch con lo stesso prefisso risponde prima
+            time.sleep(0.01 if prefisso in self.prefissi else 0.1)
+            self.prefissi.append(prefisso)
+            yield "=== COMMENTO_1 ==="
+    
+    risultato = benchmark_cache_prompt(StreamLLM(), 'ollama', ["a", "b", "c", "d"], {"X": {'descrizione': 'x'}},
+                                       batch_size=2)
+    
+    assert risultato["ttft_caldo"] < risultato["ttft_freddo"]
+    assert risultato["riduzione_ttft_percentuale"] > 0
+
+
+def test_riparazione_solo_commenti_falliti():
+    """Test: vengono rispediti solo i commenti non parsati o in errore"""
+    class InaffidabileLLM(EchoBatchLLM):
+        """Omette l'ultima sezione del primo batch e fallisce il secondo batch una volta"""
+        def __init__(self):
+            super().__init__()
+            self.prompt_ricevuti = []
+        
+        def invoke(self, prompt):
+            self.prompt_ricevuti.append(prompt)
+            risposta = super().invoke(prompt)
+            if self.chiamate == 1:
+                return risposta.rsplit("=== COMMENTO_", 1)[0]
+            if self.chiamate == 2:
+                raise Exception("timeout")
+            return risposta
+    
+    df = pd.DataFrame({'commenti': ["A1", "A2", "A3", "B1", "B2", "B3"]})
+    etichette = {"A1": {'descrizione': 'test'}}
+    llm = InaffidabileLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(df, etichette, 'commenti', 'test', llm, 'ollama', batch_size=3)
+    
+    assert risultati["etichette_principali"] == ["A1", "A2", "A3", "B1", "B2", "B3"]
+    rispediti = "".join(llm.prompt_ricevuti[2:])
+    assert '"A3"' in rispediti and '"B1"' in rispediti
+    assert '"A1"' not in rispediti and '"A2"' not in rispediti
+    # A3 viene riaccodato subito, il batch B nel passaggio di riparazione
+    assert risultati["statistiche_parsing"]["commenti_riaccodati"] == 1
+    assert risultati["statistiche_riparazione"] == {"commenti_riparati": 3, "commenti_non_riparati": 0}
+
+
+def test_riparazione_limite_tentativi():
+    """Test: dopo il numero massimo di passaggi i commenti restano in errore"""
+    class SempreErroreLLM:
+        chiamate = 0
+        def invoke(self, prompt):
+            self.chiamate += 1
+            raise Exception("server non disponibile")
+    
+    df = pd.DataFrame({'commenti': ["a", "b", "c", "d"]})
+    llm = SempreErroreLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(
+        df, {"x": {'descrizione': 'test'}}, 'commenti', 'test', llm, 'ollama',
+        batch_size=4, max_tentativi_riparazione=2
+    )
+    
+    assert risultati["etichette_principali"] == ["Errore_Batch"] * 4
+    # 1 batch da 4, poi 2 batch da 2, poi 4 batch da 1
+    assert llm.chiamate == 7
+    assert risultati["statistiche_riparazione"]["commenti_non_riparati"] == 4
+
+
+def test_hedging_batch_lento_su_secondo_client():
+    """Un batch oltre il p95 viene duplicato su llm_hedge e la sua risposta vince"""
+    
+    class LentoSuUnCommento(EchoBatchLLM):
+        def invoke(self, prompt):
+            if '"Lento"' in prompt.split("COMMENTI DA ANALIZZARE")[-1]:
+                time.sleep(1.0)
+            return super().invoke(prompt)
+    
+    testi = [f"Tema{i}" for i in range(15)] + ["Lento"]
+    df = pd.DataFrame({'commenti': testi})
+    etichette = {testo: {'descrizione': 'test'} for testo in testi}
+    llm, llm_hedge = LentoSuUnCommento(), EchoBatchLLM()
+    
+    inizio = time.monotonic()
+    risultati = etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', llm, 'ollama', batch_size=1,
+        hedging=True, budget_hedge=0.5, llm_hedge=llm_hedge
+    )
+    
+    assert time.monotonic() - inizio < 0.9
+    assert risultati["etichette_principali"][15] == "Lento"
+    assert llm_hedge.chiamate == 1
+    assert risultati["statistiche_hedging"]["vinti_dal_duplicato"] == 1
+
+
+def test_hedging_con_cache_non_attende_la_primaria(tmp_path):
+    """Con la cache attiva il duplicato non si accoda alla richiesta identica in volo"""
+    from llm_cache import CachedLLM, LLMResponseCache
+    
+    class LentaLaPrimaVolta(EchoBatchLLM):
+        def __init__(self):
+            super().__init__()
+            self.visti = set()
+            self.lock = threading.Lock()
+        
+        def invoke(self, prompt):
+            commenti = prompt.split("COMMENTI DA ANALIZZARE")[-1]
+            with self.lock:
+                prima_volta = '"Lento"' in commenti and "Lento" not in self.visti
+                if prima_volta:
+                    self.visti.add("Lento")
+            if prima_volta:
+                time.sleep(1.0)
+            return super().invoke(prompt)
+    
+    testi = [f"Tema{i}" for i in range(15)] + ["Lento"]
+    df = pd.DataFrame({'commenti': testi})
+    etichette = {testo: {'descrizione': 'test'} for testo in testi}
+    # Secondo endpoint con la stessa cache: il duplicato ha la stessa chiave della primaria
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    llm = CachedLLM(LentaLaPrimaVolta(), 'ollama', cache)
+    llm_hedge = CachedLLM(EchoBatchLLM(), 'ollama', cache)
+    
+    inizio = time.monotonic()
+    risultati = etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', llm, 'ollama', batch_size=1, hedging=True, budget_hedge=0.5,
+        llm_hedge=llm_hedge
+    )
+    
+    assert time.monotonic() - inizio < 0.9
+    assert risultati["etichette_principali"][15] == "Lento"
+    assert risultati["statistiche_hedging"]["vinti_dal_duplicato"] == 1
+
+
+def test_hedging_disattivato_con_un_solo_endpoint(caplog):
+    """Senza llm_hedge né un pool il duplicato finirebbe sullo stesso server: niente hedging"""
+    
+    class LentoSuUnCommento(EchoBatchLLM):
+        def invoke(self, prompt):
+            if '"Lento"' in prompt.split("COMMENTI DA ANALIZZARE")[-1]:
+                time.sleep(0.3)
+            return super().invoke(prompt)
+    
+    testi = [f"Tema{i}" for i in range(15)] + ["Lento"]
+    df = pd.DataFrame({'commenti': testi})
+    etichette = {testo: {'descrizione': 'test'} for testo in testi}
+    llm = LentoSuUnCommento()
+    
+    risultati = etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', llm, 'ollama', batch_size=1, hedging=True, budget_hedge=0.5
+    )
+    
+    assert llm.chiamate == 16
+    assert "statistiche_hedging" not in risultati
+    assert "Hedging disattivato" in caplog.text
+    assert risultati["etichette_principali"][15] == "Lento"
+
+
+def test_opzioni_da_config():
+    """Test: i parametri batch di AnalysisConfig arrivano all'etichettatura"""
+    config = AnalysisConfig(batch_size=2, deduplica_commenti=False, protocollo_compatto=True, top_k_coefficienti=4,
+                            max_tentativi_riparazione=0, preclassificazione_embedding=True,
+                            similarita_minima_embedding=0.7)
+    opzioni = opzioni_da_config(config)
+    
+    assert opzioni["batch_size"] == 2
+    assert opzioni["deduplica"] is False
+    assert opzioni["protocollo_compatto"] is True and opzioni["top_k"] == 4
+    assert opzioni["preclassificatore"].similarita_minima == 0.7
+    assert "llm_leggero" not in opzioni
+    assert opzioni_da_config({"batch_size": 3, "campo_sconosciuto": 1})["batch_size"] == 3
+    
+    # Senza preclassificatore e con il formato testuale che EchoBatchLLM sa produrre
+    opzioni = dict(opzioni, preclassificatore=None, protocollo_compatto=False)
+    df = pd.DataFrame({'commenti': ["No", "no", "Forse"]})
+    etichette = {"No": {'descrizione': 'test'}, "Forse": {'descrizione': 'test'}}
+    llm = EchoBatchLLM()
+    risultati = etichetta_con_coefficiente_batch(df, etichette, 'commenti', 'test', llm, 'ollama', **opzioni)
+    assert llm.chiamate == 2
+    assert risultati["statistiche_deduplica"]["commenti_unici"] == 3
+    
+    with pytest.raises(ValueError):
+        opzioni_da_config(AnalysisConfig(similarita_minima_embedding=1.5))
+
+
+class LeggeroLLM:
+    """Mock del modello leggero: sicuro sui temi pari, incerto sui dispari, nessuna risposta per 'Oscuro'"""
+    def __init__(self):
+        self.chiamate = 0
+    
+    def invoke(self, prompt):
+        import re
+        self.chiamate += 1
+        sezioni = []
+        for n, testo in re.findall(r'COMMENTO_(\d+): "(.*)"', prompt):
+            if testo == "Oscuro":
+                continue
+            coefficiente = 0.9 if int(testo[-1]) % 2 == 0 else 0.3
+            sezioni.append(f"=== COMMENTO_{n} ===\nPRINCIPALE: {testo} (coefficiente: {coefficiente:.2f})\n"
+                           f"CONFIDENZA_GENERALE: 0.80")
+        return "\n".join(sezioni)
+
+
+def test_cascata_solo_righe_incerte_al_modello_grande():
+    """Il modello leggero etichetta tutto; al grande passano solo le righe sotto soglia o non parsate"""
+    
+    testi = ["Tema0", "Tema1", None, "Tema2", "Tema3", "Oscuro"]
+    df = pd.DataFrame({'commenti': testi})
+    etichette = {t: {'descrizione': 'test'} for t in testi if t}
+    leggero, grande = LeggeroLLM(), EchoBatchLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', grande, 'ollama', batch_size=5,
+        max_tentativi_riparazione=0, llm_leggero=leggero, soglia_escalation=0.6
+    )
+    
+    assert risultati["etichette_principali"] == ["Tema0", "Tema1", "Vuota", "Tema2", "Tema3", "Oscuro"]
+    assert risultati["coefficienti_principali"][0] == 0.9
+    assert risultati["coefficienti_principali"][1] == 0.8
+    assert risultati["statistiche_cascata"]["righe_modello_leggero"] == 2
+    assert risultati["statistiche_cascata"]["righe_modello_grande"] == 3
+    assert grande.chiamate == 1
+
+
+def test_cascata_ripresa_da_checkpoint(tmp_path):
+    """Il journal registra entrambi i livelli: alla ripresa il leggero non viene richiamato"""
+    from checkpoint import CheckpointJournal
+    
+    class GrandeGuasto:
+        def invoke(self, prompt):
+            raise RuntimeError("endpoint non raggiungibile")
+    
+    testi = ["Tema0", "Tema1", "Tema2", "Tema3"]
+    df = pd.DataFrame({'commenti': testi})
+    etichette = {t: {'descrizione': 'test'} for t in testi}
+    path = str(tmp_path / "checkpoint.jsonl")
+    opzioni = dict(batch_size=2, max_tentativi_riparazione=0, soglia_escalation=0.6)
+    
+    etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', GrandeGuasto(), 'ollama',
+        llm_leggero=LeggeroLLM(), checkpoint=CheckpointJournal(path, "fp"), **opzioni
+    )
+    
+    leggero, grande = LeggeroLLM(), EchoBatchLLM()
+    risultati = etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', grande, 'ollama',
+        llm_leggero=leggero, checkpoint=CheckpointJournal(path, "fp"), **opzioni
+    )
+    
+    assert leggero.chiamate == 0
+    assert grande.chiamate == 1
+    assert risultati["etichette_principali"] == testi
+    assert risultati["coefficienti_principali"] == [0.9, 0.8, 0.9, 0.8]
+    assert {r["livello"] for r in CheckpointJournal(path, "fp").carica().values()} == {"leggero", "grande"}
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -0,0 +1,74 @@
+"""
+Test per il modulo checkpoint.py
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from checkpoint import CheckpointJournal, calcola_fingerprint
+from batch_processor import etichetta_con_coefficiente_batch
+from test_batch_processor import EchoBatchLLM
+
+
+class CrashLLM:
+    """Mock LLM che fallisce dopo un certo numero di chiamate"""
+    def __init__(self, chiamate_ok):
+        self.eco = EchoBatchLLM()
+        self.chiamate_ok = chiamate_ok
+    
+    def invoke(self, prompt):
+        if self.eco.chiamate >= self.chiamate_ok:
+            raise Exception("Kernel morto")
+        return self.eco.invoke(prompt)
+
+
+def test_fingerprint_dipende_da_etichette_e_modello():
+    """Test: cambiare etichette o modello cambia l'impronta"""
+    etichette = {"A": {"descrizione": "a"}}
+    base = calcola_fingerprint(None, "col", etichette, "m1")
+    
+    assert base == calcola_fingerprint(None, "col", etichette, "m1")
+    assert base != calcola_fingerprint(None, "col", etichette, "m2")
+    assert base != calcola_fingerprint(None, "col", {"B": {"descrizione": "b"}}, "m1")
+
+
+def test_ripresa_dopo_interruzione(tmp_path):
+    """Test: una seconda esecuzione invia solo le righe mancanti"""
+    df = pd.DataFrame({'commenti': [f"Tema{i}" for i in range(6)]})
+    etichette = {f"Tema{i}": {'descrizione': 'test'} for i in range(6)}
+    fingerprint = calcola_fingerprint(None, 'commenti', etichette, 'test')
+    
+    # Prima esecuzione: si interrompe dopo 2 batch su 3
+    journal = CheckpointJournal.apri(str(tmp_path / "run1"), fingerprint)
+    primo = etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', CrashLLM(2), 'ollama', batch_size=2, checkpoint=journal
+    )
+    assert primo["etichette_principali"][4:] == ["Errore_Batch", "Errore_Batch"]
+    
+    # Seconda esecuzione in una nuova cartella: ritrova il journal precedente
+    journal = CheckpointJournal.apri(str(tmp_path / "run2"), fingerprint)
+    llm = EchoBatchLLM()
+    secondo = etichetta_con_coefficiente_batch(
+        df, etichette, 'commenti', 'test', llm, 'ollama', batch_size=2, checkpoint=journal
+    )
+    
+    assert llm.chiamate == 1
+    assert secondo["etichette_principali"] == [f"Tema{i}" for i in range(6)]
+
+
+def test_riga_troncata_ignorata(tmp_path):
+    """Test: una riga scritta a metà durante un crash non blocca la ripresa"""
+    journal = CheckpointJournal(str(tmp_path / "journal.jsonl"), "fp")
+    journal.registra_batch([0], [{"principale": "A"}])
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write('{"fingerprint": "fp", "indici": [1')
+    
+    assert journal.carica() == {0: {"principale": "A"}}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,124 @@
+"""
+Test per il modulo embeddings.py
+"""
+import pytest
+import json
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from embeddings import EmbeddingCache, OllamaEmbedder, PreClassificatoreEmbedding
+from batch_processor import etichetta_con_coefficiente_batch
+
+
+# Vettore per parola chiave: i testi che le contengono finiscono sul relativo asse
+_ASSI = ["prezzo", "consegna", "qualità"]
+
+
+class KeywordEmbeddings:
+    """Mock di OllamaEmbeddings: un asse per parola chiave, conta i testi incorporati"""
+    def __init__(self):
+        self.testi = []
+    
+    def embed_documents(self, testi):
+        self.testi.extend(testi)
+        vettori = []
+        for testo in testi:
+            vettore = [float(testo.lower().count(chiave)) for chiave in _ASSI] + [0.2]
+            vettori.append(vettore)
+        return vettori
+
+
+ETICHETTE = {
+    "Prezzo": {'descrizione': 'commenti sul prezzo', 'esempi': '"prezzo alto", "prezzo giusto"'},
+    "Consegna": {'descrizione': 'tempi di consegna', 'esempi': '"consegna lenta"'},
+    "Qualità": {'descrizione': 'qualità del prodotto', 'esempi': '"ottima qualità"'}
+}
+
+
+def _embedder(tmp_path, client=None):
+    return OllamaEmbedder(model="mock-embed", cache=EmbeddingCache(str(tmp_path / "emb.sqlite")),
+                          client=client or KeywordEmbeddings())
+
+
+def test_cache_embedding_su_disco(tmp_path):
+    """I testi già incorporati non vengono ricalcolati, anche da una nuova istanza"""
+    client = KeywordEmbeddings()
+    embedder = _embedder(tmp_path, client)
+    
+    prima = embedder.embed(["prezzo alto", "consegna lenta", "prezzo alto"])
+    assert client.testi == ["prezzo alto", "consegna lenta"]
+    assert np.allclose(np.linalg.norm(prima, axis=1), 1.0)
+    
+    nuovo_client = KeywordEmbeddings()
+    dopo = _embedder(tmp_path, nuovo_client).embed(["consegna lenta", "prezzo alto"])
+    assert nuovo_client.testi == []
+    assert np.allclose(dopo, prima[[1, 0]])
+
+
+def test_classifica_netti_e_ambigui(tmp_path):
+    """Solo i commenti con margine netto vengono assegnati"""
+    preclassificatore = PreClassificatoreEmbedding(_embedder(tmp_path), similarita_minima=0.6, margine_minimo=0.1)
+    
+    assegnati, ambigui = preclassificatore.classifica({
+        0: "Il prezzo è troppo alto",
+        1: "Consegna in ritardo di una settimana",
+        2: "Prezzo e consegna pessimi",
+        3: "Non so"
+    }, ETICHETTE)
+    
+    assert assegnati[0]["principale"] == "Prezzo"
+    assert assegnati[1]["principale"] == "Consegna"
+    assert assegnati[0]["coeff_principale"] >= 0.6
+    assert sorted(ambigui) == [2, 3]
+
+
+def test_coefficienti_scalati_per_commento(tmp_path):
+    """I coefficienti sono un softmax sulle etichette, non le similarità coseno grezze"""
+    
+    class AsseComuneEmbeddings(KeywordEmbeddings):
+        """Asse comune più pesante: similarità grezze ≈0.41 anche con le etichette estranee"""
+        def embed_documents(self, testi):
+            return [vettore[:-1] + [1.0] for vettore in super().embed_documents(testi)]
+    
+    preclassificatore = PreClassificatoreEmbedding(_embedder(tmp_path, AsseComuneEmbeddings()))
+    
+    assegnati, _ = preclassificatore.classifica({0: "Il prezzo è troppo alto"}, ETICHETTE)
+    coefficienti = json.loads(assegnati[0]["tutti_coefficienti"])
+    
+    assert abs(sum(coefficienti.values()) - 1.0) < 0.02
+    assert coefficienti["Prezzo"] == max(coefficienti.values())
+    assert assegnati[0]["confidenza_generale"] == coefficienti["Prezzo"]
+    # Con le similarità grezze Consegna e Qualità sarebbero finite tra le secondarie (soglia 0.3)
+    assert assegnati[0]["secondarie"] == ""
+
+
+def test_etichettatura_con_preclassificatore(tmp_path):
+    """Al modello generativo arrivano solo i commenti ambigui"""
+    
+    class RegistraLLM:
+        def __init__(self):
+            self.prompt = []
+        
+        def invoke(self, prompt):
+            self.prompt.append(prompt)
+            return "=== COMMENTO_1 ===\nPRINCIPALE: Prezzo (coefficiente: 0.70)\nCONFIDENZA_GENERALE: 0.70"
+    
+    df = pd.DataFrame({'commenti': ["Prezzo alto", "Prezzo e consegna pessimi"]})
+    llm = RegistraLLM()
+    
+    risultati = etichetta_con_coefficiente_batch(
+        df, ETICHETTE, 'commenti', 'test', llm, 'ollama', batch_size=5,
+        preclassificatore=PreClassificatoreEmbedding(_embedder(tmp_path))
+    )
+    
+    assert len(llm.prompt) == 1
+    assert "Prezzo alto" not in llm.prompt[0].split("COMMENTI DA ANALIZZARE")[-1]
+    assert risultati["etichette_principali"] == ["Prezzo", "Prezzo"]
+    assert risultati["statistiche_preclassificazione"] == {"commenti_assegnati": 1, "commenti_ambigui": 1,
+                                                          "chiamate_risparmiate": 0}
+    assert risultati["statistiche_deduplica"]["chiamate_risparmiate"] == 0
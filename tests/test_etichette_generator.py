@@ -0,0 +1,204 @@
+"""
+Test per il modulo etichette_generator.py
+"""
+import pytest
+import re
+import sys
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from etichette_generator import (vettorizza_tfidf, kmeans, campiona_rappresentanti,
+                                 genera_etichette_da_campione, genera_etichette_map_reduce,
+                                 genera_etichette_con_archivio)
+from label_store import LabelStore
+from llm_cache import LLMResponseCache
+
+
+COMMENTI = (
+    [f"Il prezzo del corso è troppo alto, costo {i}" for i in range(30)]
+    + [f"La piattaforma online si blocca spesso, errore {i}" for i in range(20)]
+    + [f"Docente molto preparato e disponibile {i}" for i in range(5)]
+)
+
+
+class EtichetteLLM:
+    """Mock LLM che restituisce etichette nel formato ETICHETTA/DESCRIZIONE/ESEMPI"""
+    def __init__(self):
+        self.model = "test-model"
+        self.prompt = None
+    
+    def invoke(self, prompt):
+        self.prompt = prompt
+        return ("ETICHETTA: Prezzo\nDESCRIZIONE: Costo del corso\nESEMPI: prezzo alto\n---\n"
+                "ETICHETTA: Piattaforma\nDESCRIZIONE: Problemi tecnici\nESEMPI: si blocca\n---")
+
+
+def test_kmeans_separa_i_temi():
+    """Commenti sullo stesso tema finiscono nello stesso cluster"""
+    vettori = vettorizza_tfidf(COMMENTI)
+    assegnazioni, centroidi = kmeans(vettori, 3)
+    
+    assert np.allclose(np.linalg.norm(vettori, axis=1), 1.0)
+    assert len(set(assegnazioni[:30])) == 1
+    assert len(set(assegnazioni[30:50])) == 1
+    assert len(set(assegnazioni[50:])) == 1
+    assert len(set(assegnazioni)) == 3
+
+
+def test_campione_rispetta_budget_e_copre_cluster_piccoli():
+    """Il campione resta nel budget e include anche il cluster minoritario"""
+    vettori = vettorizza_tfidf(COMMENTI)
+    assegnazioni, centroidi = kmeans(vettori, 3)
+    
+    campione = campiona_rappresentanti(COMMENTI, assegnazioni, vettori, centroidi, max_token=100)
+    
+    assert len(campione) == 3
+    assert sum(len(c) // 4 + 2 for cs in campione.values() for c in cs) <= 100
+
+
+def test_genera_etichette_da_campione():
+    """Il prompt contiene solo il campione e la risposta viene letta da parse_etichette_dinamiche"""
+    df = pd.DataFrame({'commenti': COMMENTI + [None, COMMENTI[0]]})
+    llm = EtichetteLLM()
+    
+    risultato = genera_etichette_da_campione(df, 'commenti', 'Analizza il feedback', 'feedback', llm, 'ollama',
+                                             num_cluster=3, max_token_campione=120)
+    
+    assert list(risultato["etichette_dinamiche"]) == ["Prezzo", "Piattaforma"]
+    assert risultato["statistiche_colonna"]["totale_commenti"] == 56
+    assert risultato["statistiche_campionamento"]["cluster"] == 3
+    assert risultato["statistiche_campionamento"]["commenti_campione"] < 55
+    assert "31 commenti" in llm.prompt
+    assert "ETICHETTA: [nome_breve]" in llm.prompt
+
+
+class MapReduceLLM:
+    """Mock LLM: nella fase map propone un'etichetta per tema trovato, nel reduce restituisce le candidate"""
+    def __init__(self):
+        self.model = "test-model"
+        self.temperature = 0.0
+        self.prompt_map = 0
+        self.prompt_reduce = 0
+    
+    def invoke(self, prompt):
+        if "ETICHETTE CANDIDATE:" in prompt:
+            self.prompt_reduce += 1
+            nomi = re.findall(r"^- (\w+) \(in", prompt, re.MULTILINE)
+            return "\n".join(f"ETICHETTA: {nome}\nDESCRIZIONE: tema {nome}\nESEMPI: {nome.lower()}\n---" for nome in nomi)
+        self.prompt_map += 1
+        blocco = prompt.split("COMMENTI DEL BLOCCO:")[1]
+        temi = [tema for tema in ("prezzo", "piattaforma", "docente") if tema in blocco.lower()]
+        return "\n".join(f"ETICHETTA: {tema.capitalize()}\nDESCRIZIONE: commenti su {tema}\nESEMPI: {tema}\n---"
+                         for tema in temi)
+
+
+def test_map_reduce_unisce_candidate_dei_blocchi(tmp_path):
+    """Ogni blocco propone candidate, il reduce le deduplica nel set finale"""
+    df = pd.DataFrame({'commenti': COMMENTI})
+    llm = MapReduceLLM()
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    
+    risultato = genera_etichette_map_reduce(df, 'commenti', 'Analizza', 'feedback', llm, 'ollama',
+                                            max_etichette=5, max_token_chunk=60, max_workers=3, cache=cache)
+    
+    statistiche = risultato["statistiche_map_reduce"]
+    assert statistiche["blocchi"] > 3
+    assert llm.prompt_map == statistiche["blocchi"]
+    assert statistiche["etichette_candidate"] == 3
+    assert set(risultato["etichette_dinamiche"]) == {"Prezzo", "Piattaforma", "Docente"}
+
+
+def test_map_reduce_riprende_dalla_cache(tmp_path):
+    """Una seconda esecuzione riusa le risposte dei blocchi già elaborati"""
+    df = pd.DataFrame({'commenti': COMMENTI})
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    genera_etichette_map_reduce(df, 'commenti', 'Analizza', 'feedback', MapReduceLLM(), 'ollama',
+                                max_token_chunk=60, cache=cache)
+    
+    llm = MapReduceLLM()
+    risultato = genera_etichette_map_reduce(df, 'commenti', 'Analizza', 'feedback', llm, 'ollama',
+                                            max_token_chunk=60, cache=cache)
+    
+    assert llm.prompt_map == 0 and llm.prompt_reduce == 0
+    assert risultato["statistiche_map_reduce"]["chiamate_eseguite"] == 0
+
+
+def test_campione_colonna_di_soli_spazi():
+    """Una colonna di stringhe vuote dà lo stesso errore di una colonna vuota, senza arrivare al k-means"""
+    df = pd.DataFrame({'commenti': ["", "   ", "\t"]})
+    
+    with pytest.raises(ValueError, match="Nessun commento valido"):
+        genera_etichette_da_campione(df, 'commenti', 'Analizza', 'feedback', EtichetteLLM(), 'ollama')
+
+
+def test_prompt_campione_senza_dominio_fisso():
+    """Il prompt di campionamento prende il contesto solo dal template"""
+    df = pd.DataFrame({'commenti': COMMENTI})
+    llm = EtichetteLLM()
+    
+    genera_etichette_da_campione(df, 'commenti', 'Recensioni di un hotel', 'feedback', llm, 'ollama')
+    
+    assert "scolastico" not in llm.prompt
+    assert "Recensioni di un hotel" in llm.prompt
+
+
+def test_archivio_riusa_e_warm_start(tmp_path):
+    """Stessi dati: etichette dall'archivio senza LLM; pochi commenti nuovi: solo quelli al modello"""
+    store = LabelStore(str(tmp_path / "etichette"))
+    df = pd.DataFrame({'commenti': COMMENTI})
+    llm = EtichetteLLM()
+    
+    prima = genera_etichette_con_archivio(df, 'commenti', 'Analizza', 'feedback', llm, 'ollama', store=store)
+    assert prima["origine_etichette"] == "generate"
+    
+    llm.prompt = None
+    inizio = time.monotonic()
+    ricaricata = genera_etichette_con_archivio(df.sample(frac=1, random_state=0), 'commenti', 'Analizza', 'feedback',
+                                               llm, 'ollama', store=store)
+    assert time.monotonic() - inizio < 0.5
+    assert ricaricata["origine_etichette"] == "archivio"
+    assert ricaricata["etichette_dinamiche"] == prima["etichette_dinamiche"]
+    assert llm.prompt is None
+    
+    cresciuto = pd.DataFrame({'commenti': COMMENTI + ["Aule troppo fredde d'inverno"]})
+    warm = genera_etichette_con_archivio(cresciuto, 'commenti', 'Analizza', 'feedback', llm, 'ollama', store=store)
+    assert warm["origine_etichette"] == "warm_start"
+    assert "COMMENTI NUOVI:\n- Aule troppo fredde d'inverno\n" in llm.prompt
+    assert "prezzo del corso" not in llm.prompt
+    assert list(warm["etichette_dinamiche"])[:2] == ["Prezzo", "Piattaforma"]
+    
+    # Prompt di analisi diverso: nessun riuso
+    assert store.cerca(COMMENTI, 'Altro prompt', 'feedback') is None
+
+
+def test_warm_start_esamina_tutti_i_commenti_nuovi(tmp_path):
+    """Se i commenti nuovi non entrano in un solo blocco vanno al modello in più chiamate"""
+    
+    class RegistraLLM(EtichetteLLM):
+        def __init__(self):
+            super().__init__()
+            self.tutti = []
+        
+        def invoke(self, prompt):
+            self.tutti.append(prompt)
+            return super().invoke(prompt)
+    
+    store = LabelStore(str(tmp_path / "etichette"))
+    llm = RegistraLLM()
+    genera_etichette_con_archivio(pd.DataFrame({'commenti': COMMENTI}), 'commenti', 'Analizza', 'feedback',
+                                  llm, 'ollama', store=store)
+    
+    nuovi = ["Aule troppo fredde d'inverno", "Mensa con poca scelta", "Orari delle lezioni scomodi"]
+    llm.tutti = []
+    warm = genera_etichette_con_archivio(pd.DataFrame({'commenti': COMMENTI + nuovi}), 'commenti', 'Analizza',
+                                         'feedback', llm, 'ollama', store=store, max_token_chunk=12)
+    
+    assert warm["origine_etichette"] == "warm_start"
+    assert len(llm.tutti) == 3
+    for commento in nuovi:
+        assert any(f"- {commento}\n" in prompt for prompt in llm.tutti)
@@ -0,0 +1,92 @@
+"""
+Test per il modulo hedging.py
+"""
+import pytest
+import sys
+import os
+import time
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+import hedging
+from hedging import HedgeController
+
+
+def _controller(latenza=0.01, **kwargs):
+    """Controller già riscaldato con latenze uniformi"""
+    controller = HedgeController(**kwargs)
+    for _ in range(hedging._MIN_CAMPIONI):
+        controller._registra(latenza)
+    return controller
+
+
+def test_nessun_duplicato_senza_campioni():
+    """Finché le latenze sono poche la chiamata parte da sola"""
+    controller = HedgeController(budget=1.0)
+    chiamate = []
+    
+    assert controller.soglia() is None
+    assert controller.esegui(lambda: "primaria", lambda: chiamate.append(1)) == "primaria"
+    assert chiamate == []
+
+
+def test_duplicato_vince_sulla_chiamata_lenta():
+    """Oltre il percentile parte il duplicato e vince la prima risposta valida"""
+    controller = _controller(budget=1.0)
+    
+    def lenta():
+        time.sleep(0.5)
+        return "primaria"
+    
+    inizio = time.monotonic()
+    assert controller.esegui(lenta, lambda: "duplicato") == "duplicato"
+    assert time.monotonic() - inizio < 0.4
+    assert controller.stats()["duplicati"] == 1
+    assert controller.stats()["vinti_dal_duplicato"] == 1
+    controller.chiudi()
+
+
+def test_budget_limita_i_duplicati():
+    """Oltre il budget la chiamata lenta viene solo attesa"""
+    controller = _controller(budget=0.0)
+    chiamate = []
+    
+    def lenta():
+        time.sleep(0.05)
+        return "primaria"
+    
+    assert controller.esegui(lenta, lambda: chiamate.append(1)) == "primaria"
+    assert chiamate == []
+    assert controller.duplicati == 0
+    controller.chiudi()
+
+
+def test_risposta_non_valida_non_vince():
+    """Un duplicato non valido viene scartato e si attende la primaria"""
+    controller = _controller(budget=1.0)
+    
+    def lenta():
+        time.sleep(0.1)
+        return "primaria"
+    
+    risultato = controller.esegui(lenta, lambda: "errore", valida=lambda r: r != "errore")
+    assert risultato == "primaria"
+    assert controller.vinti_dal_duplicato == 0
+    controller.chiudi()
+
+
+def test_errore_della_primaria_recuperato_dal_duplicato():
+    """Se la primaria fallisce dopo la soglia vale la risposta del duplicato"""
+    controller = _controller(budget=1.0)
+    
+    def lenta_con_errore():
+        time.sleep(0.1)
+        raise ConnectionError("server sovraccarico")
+    
+    def duplicato():
+        time.sleep(0.15)
+        return "duplicato"
+    
+    assert controller.esegui(lenta_con_errore, duplicato) == "duplicato"
+    controller.chiudi()
@@ -0,0 +1,98 @@
+"""
+Test per il modulo llm_cache.py
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from llm_cache import CachedLLM, LLMResponseCache, calcola_chiave_cache
+
+
+class CountingLLM:
+    """Mock LLM che conta le chiamate reali"""
+    def __init__(self, ritardo=0.0):
+        self.model = "test-model"
+        self.temperature = 0.7
+        self.chiamate = 0
+        self.ritardo = ritardo
+    
+    def invoke(self, prompt):
+        self.chiamate += 1
+        time.sleep(self.ritardo)
+        return f"risposta a {prompt}"
+
+
+def test_cache_hit_e_miss(tmp_path):
+    """Test: lo stesso prompt viene inviato al modello una sola volta"""
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    llm = CachedLLM(CountingLLM(), 'ollama', cache)
+    
+    assert llm.invoke("ciao") == "risposta a ciao"
+    assert llm.invoke("ciao") == "risposta a ciao"
+    assert llm.invoke("altro") == "risposta a altro"
+    
+    assert llm.llm.chiamate == 2
+    stats = llm.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+
+def test_chiave_dipende_da_modello_e_temperatura():
+    """Test: modello e temperatura diversi producono chiavi diverse"""
+    base = calcola_chiave_cache('ollama', 'a', 0.7, "prompt")
+    assert base == calcola_chiave_cache('ollama', 'a', 0.7, "prompt")
+    assert base != calcola_chiave_cache('ollama', 'b', 0.7, "prompt")
+    assert base != calcola_chiave_cache('ollama', 'a', 0.1, "prompt")
+    assert base != calcola_chiave_cache('openrouter', 'a', 0.7, "prompt")
+
+
+def test_eviction_lru(tmp_path):
+    """Test: superato il limite vengono rimosse le voci meno usate"""
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=250, compress=False)
+    
+    cache.set("a", "x" * 100)
+    cache.set("b", "y" * 100)
+    cache.get("a")  # "a" diventa la più recente
+    cache.set("c", "z" * 100)
+    
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_compressione_trasparente(tmp_path):
+    """Test: le risposte compresse vengono rilette identiche"""
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"), compress=True)
+    testo = "PRINCIPALE: Positivo (coefficiente: 0.90)\n" * 50
+    
+    cache.set("k", testo)
+    
+    assert cache.get("k") == testo
+    assert cache.stats()["dimensione_bytes"] < len(testo)
+
+
+def test_single_flight(tmp_path):
+    """Test: richieste concorrenti identiche producono una sola chiamata"""
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    llm = CachedLLM(CountingLLM(ritardo=0.2), 'ollama', cache)
+    
+    risposte = []
+    threads = [threading.Thread(target=lambda: risposte.append(llm.invoke("stesso"))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert llm.llm.chiamate == 1
+    assert risposte == ["risposta a stesso"] * 5
+    assert cache.stats()["coalesced"] == 4
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
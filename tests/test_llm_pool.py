@@ -0,0 +1,167 @@
+"""
+Test per il modulo llm_pool.py
+"""
+import pytest
+import sys
+import os
+import time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from llm_pool import EndpointState, LLMPool, _adatta_richiesta, carica_endpoints
+from transport import CircuitBreaker, CircuitOpenError, TransportPolicy
+
+
+class EndpointLLM:
+    """Mock del client di un endpoint con latenza e circuit breaker propri"""
+    def __init__(self, latenza=0.0, errore=None):
+        self.latenza = latenza
+        self.errore = errore
+        self.circuito = CircuitBreaker("mock", soglia=1, reset_secondi=60)
+        self.chiamate = []
+        self.in_volo = 0
+        self.picco = 0
+        self._lock = threading.Lock()
+    
+    def invoke(self, prompt, **kwargs):
+        with self._lock:
+            self.chiamate.append((prompt, kwargs))
+            self.in_volo += 1
+            self.picco = max(self.picco, self.in_volo)
+        try:
+            time.sleep(self.latenza)
+            if self.errore:
+                self.circuito.registra_errore()
+                raise self.errore
+            return "ok"
+        finally:
+            with self._lock:
+                self.in_volo -= 1
+
+
+def _endpoint(nome, client, max_concurrency=1, provider='ollama'):
+    return EndpointState({'provider': provider, 'base_url': nome, 'model': 'm', 'max_concurrency': max_concurrency},
+                         client)
+
+
+def test_rispetta_max_concurrency():
+    """Nessun endpoint riceve più richieste contemporanee della sua max_concurrency"""
+    a, b = EndpointLLM(latenza=0.02), EndpointLLM(latenza=0.02)
+    pool = LLMPool([_endpoint('a', a, 2), _endpoint('b', b, 1)])
+    
+    assert pool.capacita_totale == 3
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        assert list(executor.map(lambda i: pool.invoke(f"p{i}"), range(12))) == ["ok"] * 12
+    
+    assert a.picco <= 2 and b.picco <= 1
+    assert len(a.chiamate) + len(b.chiamate) == 12
+
+
+def test_preferisce_endpoint_piu_veloce():
+    """A parità di carico vince l'endpoint con il throughput misurato più alto"""
+    lento, veloce = EndpointLLM(), EndpointLLM()
+    pool = LLMPool([_endpoint('lento', lento), _endpoint('veloce', veloce)])
+    pool.endpoints[0].latenza_media = 2.0
+    pool.endpoints[1].latenza_media = 0.5
+    
+    for _ in range(3):
+        pool.invoke("p")
+    
+    assert len(veloce.chiamate) == 3
+    assert lento.chiamate == []
+
+
+def test_failover_ed_esclusione_endpoint_guasto():
+    """Un errore transitorio passa la richiesta a un altro endpoint; il guasto esce dalla rotazione"""
+    guasto = EndpointLLM(errore=requests.exceptions.ConnectionError("rifiutata"))
+    sano = EndpointLLM()
+    pool = LLMPool([_endpoint('guasto', guasto), _endpoint('sano', sano)])
+    pool.endpoints[0].latenza_media = 0.1
+    pool.endpoints[1].latenza_media = 1.0
+    
+    assert pool.invoke("p") == "ok"
+    assert len(guasto.chiamate) == 1
+    
+    # Circuito aperto: le chiamate successive non lo toccano più
+    pool.invoke("p")
+    assert len(guasto.chiamate) == 1
+    assert pool.stats()[0]["disponibile"] is False
+    assert pool.stats()[0]["errori"] == 1
+
+
+def test_errore_non_ritentabile_e_nessun_endpoint():
+    """Gli errori permanenti non fanno failover; senza endpoint disponibili si solleva CircuitOpenError"""
+    errore = Exception("400 Bad Request")
+    errore.status_code = 400
+    client = EndpointLLM(errore=errore)
+    altro = EndpointLLM()
+    pool = LLMPool([_endpoint('a', client), _endpoint('b', altro)])
+    pool.endpoints[1].latenza_media = 5.0
+    pool.endpoints[0].latenza_media = 0.1
+    
+    with pytest.raises(Exception, match="400"):
+        pool.invoke("p")
+    assert altro.chiamate == []
+    
+    altro.circuito.registra_errore()
+    with pytest.raises(CircuitOpenError):
+        pool.invoke("p")
+
+
+def test_giri_con_backoff_su_pool_piccolo():
+    """Con un solo endpoint un errore transitorio isolato viene ritentato dopo il backoff"""
+    class IntermittenteLLM(EndpointLLM):
+        def __init__(self, fallimenti):
+            super().__init__()
+            self.circuito = CircuitBreaker("mock-intermittente", soglia=5, reset_secondi=60)
+            self.fallimenti = fallimenti
+        
+        def invoke(self, prompt, **kwargs):
+            self.chiamate.append((prompt, kwargs))
+            if len(self.chiamate) <= self.fallimenti:
+                raise requests.exceptions.ConnectionError("503")
+            return "ok"
+    
+    policy = TransportPolicy(max_retries=2, backoff_base=0.01, backoff_max=0.02)
+    client = IntermittenteLLM(fallimenti=2)
+    pool = LLMPool([_endpoint('unico', client)], policy)
+    
+    assert pool.invoke("p") == "ok"
+    assert len(client.chiamate) == 3
+    assert pool.giri_ripetuti == 2
+    
+    client = IntermittenteLLM(fallimenti=10)
+    pool = LLMPool([_endpoint('unico', client)], policy)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        pool.invoke("p")
+    assert len(client.chiamate) == 3
+
+
+def test_adatta_richiesta_tra_provider():
+    """Messaggi chat e schema JSON vengono tradotti per il provider dell'endpoint"""
+    messaggi = [{"role": "system", "content": "sistema"}, {"role": "user", "content": "domanda"}]
+    schema = {"type": "object"}
+    
+    prompt, opzioni = _adatta_richiesta('ollama', messaggi, {
+        "response_format": {"type": "json_schema", "json_schema": {"schema": schema}}
+    })
+    assert prompt == "sistema\n\ndomanda"
+    assert opzioni == {"format": schema}
+    
+    prompt, opzioni = _adatta_richiesta('openrouter', "testo", {"format": schema})
+    assert prompt == "testo"
+    assert opzioni["response_format"]["json_schema"]["schema"] == schema
+
+
+def test_carica_endpoints(monkeypatch):
+    """Gli endpoint arrivano dalla configurazione o da LLM_ENDPOINTS"""
+    monkeypatch.delenv('LLM_ENDPOINTS', raising=False)
+    assert carica_endpoints({}) == []
+    
+    monkeypatch.setenv('LLM_ENDPOINTS', '[{"provider": "ollama", "base_url": "http://gpu1:11434", "model": "m"}]')
+    assert carica_endpoints({})[0]["base_url"] == "http://gpu1:11434"
+    assert carica_endpoints({'endpoints': []}) == []
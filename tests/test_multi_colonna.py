@@ -0,0 +1,135 @@
+"""
+Test per il modulo multi_colonna.py
+"""
+import pytest
+import sys
+import os
+import re
+import time
+import threading
+import pandas as pd
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from multi_colonna import SchedulerCondiviso, analizza_colonne, salva_report_multi_colonna, nome_breve
+from multi_colonna import suffissi_colonne
+
+
+class ConcorrenzaLLM:
+    """Mock LLM che genera etichette, etichetta i batch e misura le chiamate contemporanee"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_volo = 0
+        self.massimo = 0
+        self.chiamate = 0
+    
+    def invoke(self, prompt):
+        with self.lock:
+            self.in_volo += 1
+            self.chiamate += 1
+            self.massimo = max(self.massimo, self.in_volo)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_volo -= 1
+        
+        if "COMMENTI DA ANALIZZARE" not in prompt:
+            return ("ETICHETTA: Positivo\nDESCRIZIONE: Giudizio positivo\nESEMPI: bene\n---\n"
+                    "ETICHETTA: Negativo\nDESCRIZIONE: Giudizio negativo\nESEMPI: male\n---")
+        commenti = re.findall(r'COMMENTO_(\d+): "(.*)"', prompt)
+        return "\n".join(
+            f"=== COMMENTO_{n} ===\nPRINCIPALE: {'Positivo' if 'bene' in testo else 'Negativo'} (coefficiente: 0.90)\n"
+            f"CONFIDENZA_GENERALE: 0.85"
+            for n, testo in commenti
+        )
+
+
+def test_scheduler_limita_chiamate_in_volo():
+    """Le chiamate di più colonne non superano la capacità condivisa"""
+    llm = ConcorrenzaLLM()
+    scheduler = SchedulerCondiviso(llm, capacita=2)
+    client_a, client_b = scheduler.client("a"), scheduler.client("b")
+    
+    thread = [threading.Thread(target=client.invoke, args=("x",)) for client in [client_a, client_b] * 4]
+    for t in thread:
+        t.start()
+    for t in thread:
+        t.join()
+    
+    assert llm.massimo <= 2
+    assert scheduler.stats()["chiamate"] == {"a": 4, "b": 4}
+
+
+def test_analizza_colonne_report_combinato(tmp_path):
+    """Un job su due colonne etichetta entrambe e scrive un solo report"""
+    df = pd.DataFrame({
+        'Cosa ti è piaciuto?': [f"bene {i}" for i in range(8)],
+        'Cosa miglioreresti?': [f"male {i}" if i % 2 else None for i in range(8)]
+    })
+    llm = ConcorrenzaLLM()
+    
+    risultati = analizza_colonne(df, {'Cosa ti è piaciuto?': 'generico', 'Cosa miglioreresti?': 'feedback_studenti'},
+                                 llm, 'ollama', capacita=3, batch_size=2)
+    
+    assert llm.massimo <= 3
+    assert risultati["statistiche_scheduler"]["in_volo_massimo"] > 1
+    assert set(risultati["statistiche_scheduler"]["chiamate"]) == {'Cosa ti è piaciuto?', 'Cosa miglioreresti?'}
+    assert risultati["colonne"]['Cosa ti è piaciuto?']["risultati"]["etichette_principali"] == ["Positivo"] * 8
+    
+    path = salva_report_multi_colonna(df, risultati, str(tmp_path))
+    fogli = pd.read_excel(path, sheet_name=None)
+    
+    assert set(fogli) == {'Risultati', 'Colonne', 'Etichette_1', 'Etichette_2'}
+    suffisso = nome_breve('Cosa miglioreresti?')
+    assert list(fogli['Risultati'][f'Etichetta_Principale_{suffisso}'][:2]) == ["Vuota", "Negativo"]
+    assert list(fogli['Colonne']['Template']) == ['generico', 'feedback_studenti']
+
+
+def test_suffissi_univoci_con_prefisso_comune(tmp_path):
+    """Due domande lunghe con lo stesso inizio non si sovrascrivono nel report"""
+    prima = "In che modo utilizzi l'intelligenza artificiale per individualizzare la didattica?"
+    seconda = "In che modo utilizzi l'intelligenza artificiale per personalizzare la valutazione?"
+    assert nome_breve(prima) == nome_breve(seconda)
+    
+    suffissi = suffissi_colonne([prima, seconda, 'Cosa miglioreresti?'])
+    assert len(set(suffissi.values())) == 3
+    assert suffissi['Cosa miglioreresti?'] == nome_breve('Cosa miglioreresti?')
+    
+    df = pd.DataFrame({prima: ["bene"] * 4, seconda: ["male"] * 4})
+    risultati = analizza_colonne(df, {prima: 'generico', seconda: 'generico'}, ConcorrenzaLLM(), 'ollama',
+                                 batch_size=2)
+    fogli = pd.read_excel(salva_report_multi_colonna(df, risultati, str(tmp_path)), sheet_name=None)
+    
+    assert list(fogli['Risultati'][f'Etichetta_Principale_{suffissi[prima]}']) == ["Positivo"] * 4
+    assert list(fogli['Risultati'][f'Etichetta_Principale_{suffissi[seconda]}']) == ["Negativo"] * 4
+    assert list(fogli['Colonne']['Suffisso']) == [suffissi[prima], suffissi[seconda]]
+
+
+def test_colonna_fallita_non_ferma_le_altre(tmp_path):
+    """Una colonna senza etichette viene segnalata; le altre finiscono e il report si salva"""
+    from etichette_generator import genera_etichette_da_campione
+    
+    def genera(df, colonna, *args, **kwargs):
+        if colonna == 'Vuota':
+            return {"etichette_dinamiche": {}}
+        return genera_etichette_da_campione(df, colonna, *args, **kwargs)
+    
+    df = pd.DataFrame({'Cosa ti è piaciuto?': [f"bene {i}" for i in range(4)], 'Vuota': ["x"] * 4})
+    risultati = analizza_colonne(df, {'Cosa ti è piaciuto?': 'generico', 'Vuota': 'generico'},
+                                 ConcorrenzaLLM(), 'ollama', genera=genera, batch_size=2)
+    
+    assert risultati["colonne"]['Cosa ti è piaciuto?']["risultati"]["etichette_principali"] == ["Positivo"] * 4
+    assert "Nessuna etichetta" in risultati["colonne"]['Vuota']["errore"]
+    assert risultati["statistiche_scheduler"]["colonne_fallite"] == ['Vuota']
+    
+    fogli = pd.read_excel(salva_report_multi_colonna(df, risultati, str(tmp_path)), sheet_name=None)
+    assert set(fogli) == {'Risultati', 'Colonne', 'Etichette_1'}
+    assert f"Etichetta_Principale_{nome_breve('Cosa ti è piaciuto?')}" in fogli['Risultati']
+    assert not any(colonna.endswith('_Vuota') for colonna in fogli['Risultati'])
+    assert "Nessuna etichetta" in fogli['Colonne']['Errore'][1]
+
+
+def test_colonna_mancante():
+    """Le colonne inesistenti vengono segnalate prima di chiamare il modello"""
+    with pytest.raises(ValueError):
+        analizza_colonne(pd.DataFrame({'a': ["x"]}), {'b': 'generico'}, ConcorrenzaLLM(), 'ollama')
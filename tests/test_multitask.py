@@ -0,0 +1,85 @@
+"""
+Test per il modulo multitask.py
+"""
+import sys
+import os
+import re
+import pandas as pd
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from multitask import (create_batch_prompt_multitask, parse_batch_response_multitask, etichetta_multitask_batch,
+                       aggiungi_colonne_multitask)
+
+
+ETICHETTE_PER_TASK = {
+    "feedback_studenti": {"Contenuti": {"descrizione": "Qualità dei contenuti"},
+                          "Organizzazione": {"descrizione": "Orari e logistica"}},
+    "sentiment": {"Positivo": {"descrizione": "Giudizio positivo"},
+                  "Negativo": {"descrizione": "Giudizio negativo"}}
+}
+
+
+class MultiTaskLLM:
+    """Mock LLM che risponde con un blocco per task; può omettere il sentiment al primo passaggio"""
+    def __init__(self, ometti_sentiment=None):
+        self.prompts = []
+        self.ometti_sentiment = ometti_sentiment
+    
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        blocchi = []
+        for n, testo in re.findall(r'COMMENTO_(\d+): "(.*)"', prompt):
+            tema = "Organizzazione" if "orari" in testo else "Contenuti"
+            tono = "Negativo" if "male" in testo else "Positivo"
+            blocco = (f"=== COMMENTO_{n} ===\n--- TASK: feedback_studenti ---\n"
+                      f"PRINCIPALE: {tema} (coefficiente: 0.80)\nCONFIDENZA_GENERALE: 0.80\n")
+            if testo != self.ometti_sentiment:
+                blocco += f"--- TASK: sentiment ---\nPRINCIPALE: {tono} (coefficiente: 0.90)\nCONFIDENZA_GENERALE: 0.90\n"
+            blocchi.append(blocco)
+        self.ometti_sentiment = None
+        return "\n".join(blocchi)
+
+
+def test_prompt_commenti_una_volta():
+    """Il prompt contiene i dizionari di tutti i task e ogni commento una sola volta"""
+    prompt = create_batch_prompt_multitask(["lezioni chiare"], ETICHETTE_PER_TASK, 0.3)
+    
+    assert prompt.count('"lezioni chiare"') == 1
+    assert "TASK feedback_studenti:" in prompt and "TASK sentiment:" in prompt
+    assert "--- TASK: sentiment ---" in prompt
+
+
+def test_parse_blocchi_per_task():
+    """Ogni blocco va al task indicato; un blocco mancante lascia il commento da riparare"""
+    risposta = ("=== COMMENTO_1 ===\n--- TASK: sentiment ---\nPRINCIPALE: Positivo (coefficiente: 0.90)\n"
+                "--- TASK: Feedback_Studenti ---\nPRINCIPALE: Contenuti (coefficiente: 0.70)\n"
+                "=== COMMENTO_2 ===\n--- TASK: feedback_studenti ---\nPRINCIPALE: Organizzazione (coefficiente: 0.60)\n")
+    
+    risultati, da_riparare = parse_batch_response_multitask(risposta, 2, list(ETICHETTE_PER_TASK))
+    
+    assert risultati["sentiment"][0]["principale"] == "Positivo"
+    assert risultati["feedback_studenti"][0]["coeff_principale"] == 0.70
+    assert risultati["feedback_studenti"][1]["principale"] == "Organizzazione"
+    assert risultati["sentiment"][1]["principale"] == "Incerto"
+    assert da_riparare == [1]
+
+
+def test_etichettatura_multitask_e_colonne():
+    """Una chiamata per batch per tutti i task, riparazione dei blocchi mancanti e colonne per task"""
+    df = pd.DataFrame({'commenti': ["lezioni chiare", "orari male", None, "Lezioni chiare", "orari ok"]})
+    llm = MultiTaskLLM(ometti_sentiment="orari ok")
+    
+    risultati = etichetta_multitask_batch(df, ETICHETTE_PER_TASK, 'commenti', llm, 'ollama', batch_size=5)
+    
+    assert len(llm.prompts) == 2
+    assert risultati["statistiche_multitask"]["commenti_unici"] == 3
+    
+    df_risultati = aggiungi_colonne_multitask(df, risultati)
+    assert list(df_risultati['Etichetta_Principale_feedback_studenti']) == [
+        "Contenuti", "Organizzazione", "Vuota", "Contenuti", "Organizzazione"
+    ]
+    assert list(df_risultati['Etichetta_Principale_sentiment']) == [
+        "Positivo", "Negativo", "Vuota", "Positivo", "Positivo"
+    ]
@@ -0,0 +1,142 @@
+"""
+Test per il modulo rate_limiter.py
+"""
+import pytest
+import sys
+import os
+import time
+import asyncio
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from rate_limiter import RateLimiter, RateLimitedLLM, RateLimitError, TokenBucket
+from ai_clients import OpenRouterLLM
+
+
+class EchoLLM:
+    """Mock LLM che restituisce il prompt"""
+    def __init__(self):
+        self.model = "test-model"
+        self.chiamate = 0
+    
+    def invoke(self, prompt):
+        self.chiamate += 1
+        return prompt
+    
+    async def ainvoke(self, prompt):
+        self.chiamate += 1
+        return prompt
+
+
+class FakeResponse:
+    """Risposta HTTP minima per simulare OpenRouter"""
+    def __init__(self, status_code, headers=None, contenuto="ok"):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._contenuto = contenuto
+    
+    def raise_for_status(self):
+        pass
+    
+    def json(self):
+        return {"choices": [{"message": {"content": self._contenuto}}]}
+
+
+def test_token_bucket_attesa():
+    """Test: il secchio calcola l'attesa in base alla ricarica"""
+    secchio = TokenBucket(capacita=2, ricarica_al_secondo=10)
+    adesso = time.monotonic()
+    
+    assert secchio.attesa(2, adesso) == 0.0
+    secchio.consuma(2)
+    assert secchio.attesa(1, adesso) == pytest.approx(0.1, abs=0.01)
+
+
+def test_limite_richieste_al_secondo():
+    """Test: oltre il burst le richieste vengono distanziate"""
+    limitatore = RateLimiter(richieste_al_secondo=20)
+    
+    inizio = time.monotonic()
+    for _ in range(25):
+        limitatore.acquisisci()
+    durata = time.monotonic() - inizio
+    
+    # 20 di burst, le altre 5 a 20/s
+    assert 0.2 <= durata < 1.0
+
+
+def test_limite_token_al_minuto():
+    """Test: le richieste grandi attendono la ricarica del secchio token"""
+    limitatore = RateLimiter(richieste_al_secondo=100, token_al_minuto=6000)
+    
+    limitatore.acquisisci(6000)
+    inizio = time.monotonic()
+    limitatore.acquisisci(20)  # 100 token/s → 0.2s
+    assert time.monotonic() - inizio >= 0.15
+
+
+def test_retry_after_sospende_le_richieste():
+    """Test: l'header Retry-After blocca le richieste successive"""
+    limitatore = RateLimiter(richieste_al_secondo=100)
+    
+    assert limitatore.aggiorna_da_headers({'Retry-After': '0.3'}) == 0.3
+    inizio = time.monotonic()
+    limitatore.acquisisci()
+    assert time.monotonic() - inizio >= 0.25
+
+
+def test_quota_esaurita_fino_al_reset():
+    """Test: X-RateLimit-Remaining a 0 sospende fino a X-RateLimit-Reset (ms)"""
+    limitatore = RateLimiter(richieste_al_secondo=100)
+    reset_ms = int((time.time() + 0.3) * 1000)
+    
+    limitatore.aggiorna_da_headers({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(reset_ms)})
+    inizio = time.monotonic()
+    limitatore.acquisisci()
+    assert time.monotonic() - inizio >= 0.2
+
+
+def test_429_riduce_e_successi_ripristinano_il_ritmo():
+    """Test: il ritmo si dimezza a ogni 429 e risale con le risposte riuscite"""
+    limitatore = RateLimiter(richieste_al_secondo=4)
+    
+    limitatore.segnala_429(retry_after=0)
+    assert limitatore.ritmo == 2
+    assert limitatore.stats()["risposte_429"] == 1
+    
+    for _ in range(100):
+        limitatore.segnala_successo()
+    assert limitatore.ritmo == 4
+
+
+def test_rate_limited_llm():
+    """Test: il wrapper inoltra le chiamate sync e async"""
+    llm = RateLimitedLLM(EchoLLM(), RateLimiter(richieste_al_secondo=100))
+    
+    assert llm.invoke("ciao") == "ciao"
+    assert asyncio.run(llm.ainvoke("async")) == "async"
+    assert llm.model == "test-model"
+    assert llm.llm.chiamate == 2
+
+
+def test_openrouter_429(monkeypatch):
+    """Test: un 429 di OpenRouter solleva RateLimitError e rallenta il limitatore"""
+    limitatore = RateLimiter(richieste_al_secondo=10)
+    llm = OpenRouterLLM("test-model", "chiave", rate_limiter=limitatore)
+    
+    risposte = iter([FakeResponse(429, {'Retry-After': '0.2'}), FakeResponse(200)])
+    monkeypatch.setattr(OpenRouterLLM._get_session(), 'post', lambda *args, **kwargs: next(risposte))
+    
+    with pytest.raises(RateLimitError) as errore:
+        llm.invoke("ciao")
+    assert errore.value.retry_after == 0.2
+    assert limitatore.ritmo == 5
+    
+    inizio = time.monotonic()
+    assert llm.invoke("ciao") == "ok"
+    assert time.monotonic() - inizio >= 0.15
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
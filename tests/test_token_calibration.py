@@ -0,0 +1,59 @@
+"""
+Test per il modulo token_calibration.py
+"""
+import pytest
+import sys
+import os
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from token_calibration import TokenCalibrator, MIN_CAMPIONI_REGRESSIONE
+
+
+def test_nessun_dato_nessuna_stima(tmp_path):
+    """Test: senza campioni il calibratore lascia il posto all'euristica"""
+    calibratore = TokenCalibrator(str(tmp_path / "cal.json"))
+    
+    assert calibratore.stima("modello", "testo qualsiasi") is None
+
+
+def test_rapporto_caratteri_per_token(tmp_path):
+    """Test: con pochi campioni si usa il rapporto medio caratteri/token"""
+    calibratore = TokenCalibrator(str(tmp_path / "cal.json"))
+    for _ in range(3):
+        calibratore.registra("modello", "x" * 300, 100)
+    
+    assert calibratore.caratteri_per_token("modello") == 3.0
+    assert calibratore.stima("modello", "x" * 30) == 10
+
+
+def test_regressione_pesa_caratteri_non_ascii(tmp_path):
+    """Test: la regressione impara che accenti ed emoji costano più token"""
+    calibratore = TokenCalibrator(str(tmp_path / "cal.json"))
+    # 1 token ogni 4 caratteri ASCII, 1 token per ogni carattere accentato
+    for ascii_n in range(1, 6):
+        for accentati in range(0, MIN_CAMPIONI_REGRESSIONE, 4):
+            parole = " ".join(["aaa"] * ascii_n * 10)
+            calibratore.registra("modello", parole + "è" * accentati, len(parole) // 4 + accentati)
+    
+    parole = " ".join(["aaa"] * 30)
+    assert calibratore.stima("modello", parole) == pytest.approx(len(parole) // 4, abs=3)
+    assert calibratore.stima("modello", parole + "è" * 40) == pytest.approx(len(parole) // 4 + 40, abs=3)
+
+
+def test_persistenza_tra_sessioni(tmp_path):
+    """Test: la calibrazione salvata viene ricaricata da una nuova istanza"""
+    path = str(tmp_path / "cal.json")
+    calibratore = TokenCalibrator(path)
+    for _ in range(5):
+        calibratore.registra("modello", "y" * 50, 10)
+    calibratore.salva()
+    
+    nuovo = TokenCalibrator(path)
+    
+    assert nuovo.caratteri_per_token("modello") == 5.0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,201 @@
+"""
+Test per il modulo transport.py
+"""
+import pytest
+import sys
+import os
+import time
+import asyncio
+import requests
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from transport import (CircuitBreaker, CircuitOpenError, DeadlineExceededError,
+                       ResilientLLM, TransportPolicy, e_ritentabile)
+from config_manager import AnalysisConfig
+from rate_limiter import RateLimitError
+
+
+class FlakyLLM:
+    """Mock LLM che fallisce le prime N chiamate"""
+    def __init__(self, fallimenti, errore=None):
+        self.model = "test-model"
+        self.fallimenti = fallimenti
+        self.errore = errore or requests.exceptions.ConnectionError("connessione rifiutata")
+        self.chiamate = 0
+    
+    def invoke(self, prompt):
+        self.chiamate += 1
+        if self.chiamate <= self.fallimenti:
+            raise self.errore
+        return "ok"
+    
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+
+def _policy(**kwargs):
+    parametri = {'backoff_base': 0.01, 'backoff_max': 0.05}
+    parametri.update(kwargs)
+    return TransportPolicy(**parametri)
+
+
+def _errore_http(status_code):
+    risposta = requests.Response()
+    risposta.status_code = status_code
+    return requests.exceptions.HTTPError(f"{status_code}", response=risposta)
+
+
+def test_policy_da_analysis_config():
+    """Test: i parametri avanzati di AnalysisConfig arrivano alla policy"""
+    config = AnalysisConfig(timeout_seconds=12, max_retries=5, backoff_base_seconds=0.5, pause_between_requests=3.0,
+                            run_deadline_seconds=600)
+    policy = TransportPolicy.from_config(config)
+    
+    assert policy.timeout_seconds == 12
+    assert policy.max_retries == 5
+    assert policy.backoff_base == 0.5
+    assert policy.run_deadline_seconds == 600
+    assert TransportPolicy.from_config({}).max_retries == AnalysisConfig().max_retries
+
+
+def test_backoff_con_jitter():
+    """Test: l'attesa cresce col tentativo, resta sotto il massimo e rispetta Retry-After"""
+    policy = TransportPolicy(backoff_base=1.0, backoff_max=4.0)
+    
+    attese = [policy.attesa_backoff(5) for _ in range(50)]
+    assert all(0 <= a <= 4.0 for a in attese)
+    assert len(set(attese)) > 1
+    assert policy.attesa_backoff(0, retry_after=3.0) >= 3.0
+
+
+def test_errori_ritentabili():
+    """Test: 5xx, 429 e timeout si ritentano, gli altri 4xx no"""
+    assert e_ritentabile(requests.exceptions.Timeout())
+    assert e_ritentabile(RateLimitError("429", 1.0))
+    assert e_ritentabile(_errore_http(503))
+    assert not e_ritentabile(_errore_http(401))
+    
+    # Errore HTTP rilanciato come Exception generica dal client
+    try:
+        try:
+            raise _errore_http(404)
+        except requests.exceptions.HTTPError as e:
+            raise Exception("Errore nella chiamata OpenRouter") from e
+    except Exception as avvolto:
+        assert not e_ritentabile(avvolto)
+
+
+def test_retry_fino_al_successo():
+    """Test: gli errori transitori vengono ritentati"""
+    llm = ResilientLLM(FlakyLLM(fallimenti=2), _policy(max_retries=3), endpoint="test-retry")
+    
+    assert llm.invoke("ciao") == "ok"
+    assert llm.llm.chiamate == 3
+    assert llm.stats()["tentativi_ripetuti"] == 2
+
+
+def test_errore_non_ritentabile_non_ripete():
+    """Test: un 401 fallisce subito senza altri tentativi"""
+    llm = ResilientLLM(FlakyLLM(fallimenti=5, errore=_errore_http(401)), _policy(), endpoint="test-401")
+    
+    with pytest.raises(requests.exceptions.HTTPError):
+        llm.invoke("ciao")
+    assert llm.llm.chiamate == 1
+
+
+def test_circuit_breaker_fallisce_subito():
+    """Test: dopo N errori consecutivi l'endpoint viene rifiutato senza chiamarlo"""
+    llm = ResilientLLM(FlakyLLM(fallimenti=100), _policy(max_retries=1, soglia_circuito=2), endpoint="test-circuito")
+    
+    with pytest.raises(requests.exceptions.ConnectionError):
+        llm.invoke("a")
+    assert llm.circuito.stato == 'aperto'
+    
+    chiamate = llm.llm.chiamate
+    with pytest.raises(CircuitOpenError):
+        llm.invoke("b")
+    assert llm.llm.chiamate == chiamate
+
+
+def test_errori_del_chiamante_non_aprono_il_circuito():
+    """Test: 400 e 401 sono errori della richiesta, non dell'endpoint: il circuito resta chiuso"""
+    llm = ResilientLLM(FlakyLLM(fallimenti=100, errore=_errore_http(400)), _policy(soglia_circuito=2),
+                       endpoint="test-4xx")
+    
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.HTTPError):
+            llm.invoke("ciao")
+    
+    assert llm.circuito.stato == 'chiuso'
+    assert llm.circuito.errori_consecutivi == 0
+    assert llm.llm.chiamate == 3
+
+
+def test_circuit_breaker_semi_aperto():
+    """Test: dopo il reset una chiamata di prova riuscita richiude il circuito"""
+    circuito = CircuitBreaker("test-semi-aperto", soglia=1, reset_secondi=0.1)
+    circuito.registra_errore()
+    assert circuito.stato == 'aperto'
+    
+    time.sleep(0.15)
+    circuito.consenti()
+    with pytest.raises(CircuitOpenError):
+        circuito.consenti()  # una sola prova alla volta
+    
+    circuito.registra_successo()
+    assert circuito.stato == 'chiuso'
+
+
+def test_scadenza_esecuzione():
+    """Test: superata la durata massima le chiamate falliscono subito"""
+    llm = ResilientLLM(FlakyLLM(fallimenti=0), _policy(run_deadline_seconds=0.1), endpoint="test-scadenza")
+    
+    llm.avvia_run()
+    assert llm.invoke("a") == "ok"
+    time.sleep(0.15)
+    with pytest.raises(DeadlineExceededError):
+        llm.invoke("b")
+    
+    llm.avvia_run()
+    assert llm.invoke("c") == "ok"
+
+
+def test_ainvoke_con_retry():
+    """Test: anche il percorso asincrono ritenta gli errori transitori"""
+    llm = ResilientLLM(FlakyLLM(fallimenti=1), _policy(), endpoint="test-async")
+    
+    assert asyncio.run(llm.ainvoke("ciao")) == "ok"
+    assert llm.llm.chiamate == 2
+
+
+def test_stream_con_retry():
+    """Test: lo streaming ritenta gli errori prima del primo pezzo, non dopo"""
+    class StreamLLM:
+        def __init__(self, fallimenti, errore_dopo_pezzo=False):
+            self.fallimenti = fallimenti
+            self.errore_dopo_pezzo = errore_dopo_pezzo
+            self.chiamate = 0
+        
+        def stream(self, prompt):
+            self.chiamate += 1
+            if self.chiamate <= self.fallimenti:
+                if self.errore_dopo_pezzo:
+                    yield "parziale"
+                raise requests.exceptions.ConnectionError("connessione interrotta")
+            yield "o"
+            yield "k"
+    
+    llm = ResilientLLM(StreamLLM(fallimenti=2), _policy(max_retries=3), endpoint="test-stream")
+    assert "".join(llm.stream("ciao")) == "ok"
+    assert llm.llm.chiamate == 3
+    
+    llm = ResilientLLM(StreamLLM(fallimenti=1, errore_dopo_pezzo=True), _policy(max_retries=3), endpoint="test-stream-pezzo")
+    with pytest.raises(requests.exceptions.ConnectionError):
+        list(llm.stream("ciao"))
+    assert llm.llm.chiamate == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,135 @@
+"""
+Test per il modulo watcher.py
+"""
+import sys
+import os
+import re
+import pandas as pd
+
+# Aggiungi la directory utils al path per gli import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from watcher import CartellaOsservata
+
+
+class EchoBatchLLM:
+    """Mock LLM che etichetta ogni commento con il suo testo e conta i commenti ricevuti"""
+    def __init__(self):
+        self.commenti = []
+    
+    def invoke(self, prompt):
+        commenti = re.findall(r'COMMENTO_(\d+): "(.*)"', prompt)
+        self.commenti.extend(testo for _, testo in commenti)
+        return "\n".join(
+            f"=== COMMENTO_{n} ===\nPRINCIPALE: {testo} (coefficiente: 0.80)\nCONFIDENZA_GENERALE: 0.75"
+            for n, testo in commenti
+        )
+
+
+def _watcher(tmp_path, llm, debounce=0.0, **opzioni):
+    etichette = {t: {'descrizione': 'test'} for t in ["A", "B", "C"]}
+    return CartellaOsservata(str(tmp_path / "dati"), etichette, 'commenti', 'test', llm, 'ollama',
+                             str(tmp_path / "output"), debounce_secondi=debounce, batch_size=5, **opzioni)
+
+
+class GuastoLLM(EchoBatchLLM):
+    """Mock LLM che fallisce finché guasto è True"""
+    def __init__(self):
+        super().__init__()
+        self.guasto = True
+    
+    def invoke(self, prompt):
+        if self.guasto:
+            raise ConnectionError("endpoint non raggiungibile")
+        return super().invoke(prompt)
+
+
+def test_solo_righe_nuove_nel_report_continuo(tmp_path):
+    """Un export che cresce manda al modello solo le righe nuove e il report continuo si allunga"""
+    (tmp_path / "dati").mkdir()
+    export = tmp_path / "dati" / "risposte.xlsx"
+    pd.DataFrame({'commenti': ["A", "B"]}).to_excel(export, index=False)
+    
+    llm = EchoBatchLLM()
+    watcher = _watcher(tmp_path, llm)
+    
+    # Prima vista: il file è in attesa del debounce
+    assert watcher.scansiona() == 0
+    assert watcher.scansiona() == 2
+    
+    pd.DataFrame({'commenti': ["A", "B", None, "C", "C"]}).to_excel(export, index=False)
+    watcher.scansiona()
+    assert watcher.scansiona() == 1
+    assert llm.commenti == ["A", "B", "C"]
+    
+    report = pd.read_excel(watcher.report_path)
+    assert list(report['Etichetta_Principale']) == ["A", "B", "C"]
+    assert set(report['File_Origine']) == {"risposte.xlsx"}
+    
+    # Un nuovo watcher riparte dallo stato salvato senza rileggere il file
+    riavviato = _watcher(tmp_path, llm)
+    riavviato.scansiona()
+    assert riavviato.scansiona() == 0
+    assert riavviato.stats()["file_elaborati"] == 0
+
+
+def test_righe_fallite_sostituite_alla_scansione_successiva(tmp_path):
+    """Le righe in errore tornano al modello e prendono il posto di quelle fallite nel report"""
+    (tmp_path / "dati").mkdir()
+    pd.DataFrame({'commenti': ["A", "B"]}).to_excel(tmp_path / "dati" / "risposte.xlsx", index=False)
+    
+    llm = GuastoLLM()
+    watcher = _watcher(tmp_path, llm, attesa_tentativi_secondi=0.0)
+    watcher.scansiona()
+    assert watcher.scansiona() == 2
+    assert len(pd.read_excel(watcher.report_path)) == 2
+    assert watcher.stats()["righe_etichettate"] == 0
+    assert watcher.stats()["file_elaborati"] == 0
+    
+    llm.guasto = False
+    assert watcher.scansiona() == 2
+    assert watcher.scansiona() == 0
+    
+    report = pd.read_excel(watcher.report_path)
+    assert list(report['Etichetta_Principale']) == ["A", "B"]
+    assert watcher.stats()["righe_etichettate"] == 2
+    assert watcher.stats()["file_elaborati"] == 1
+
+
+def test_righe_fallite_attesa_e_abbandono(tmp_path):
+    """Tra un tentativo e l'altro si attende; dopo max_tentativi la riga non torna più al modello"""
+    (tmp_path / "dati").mkdir()
+    pd.DataFrame({'commenti': ["A"]}).to_excel(tmp_path / "dati" / "risposte.xlsx", index=False)
+    
+    llm = GuastoLLM()
+    watcher = _watcher(tmp_path, llm, max_tentativi=2, attesa_tentativi_secondi=60.0)
+    watcher.scansiona()
+    assert watcher.scansiona() == 1
+    # Attesa in corso: il file viene riletto ma la riga non va al modello
+    assert watcher.scansiona() == 0
+    
+    # I tentativi sopravvivono al riavvio; scaduta l'attesa parte il secondo e ultimo tentativo
+    riavviato = _watcher(tmp_path, llm, max_tentativi=2, attesa_tentativi_secondi=60.0)
+    for tentativo in riavviato._tentativi.values():
+        tentativo[1] = 0.0
+    riavviato.scansiona()
+    assert riavviato.scansiona() == 1
+    assert riavviato.stats()["righe_abbandonate"] == 1
+    assert riavviato.stats()["file_elaborati"] == 1
+    
+    llm.guasto = False
+    assert riavviato.scansiona() == 0
+    assert llm.commenti == []
+
+
+def test_debounce_file_in_scrittura(tmp_path):
+    """Un file che non è rimasto fermo per il debounce non viene letto"""
+    (tmp_path / "dati").mkdir()
+    pd.DataFrame({'commenti': ["A"]}).to_excel(tmp_path / "dati" / "risposte.xlsx", index=False)
+    (tmp_path / "dati" / "~$risposte.xlsx").write_bytes(b"lock")
+    
+    watcher = _watcher(tmp_path, EchoBatchLLM(), debounce=60.0)
+    watcher.scansiona()
+    
+    assert watcher.scansiona() == 0
+    assert watcher.stats()["file_in_attesa"] == 1
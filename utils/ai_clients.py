@@ -4,34 +4,109 @@ Gestione client AI per Ollama e OpenRouter
 """
 
 import os
+import asyncio
+import threading
+import weakref
 import requests
+import requests.adapters
+import httpx
 import json
 from langchain_ollama import OllamaLLM
-from typing import Union, Dict, List, Any
+from collections import deque
+from langchain_core.callbacks import BaseCallbackHandler
+from typing import Union, Dict, List, Any, Iterator, Tuple
 from dotenv import load_dotenv
 
+try:
+    from .llm_cache import CachedLLM, get_cache
+    from .token_calibration import get_calibrator
+    from .rate_limiter import RateLimitedLLM, RateLimiter, RateLimitError, get_rate_limiter
+    from .transport import ResilientLLM, TransportPolicy
+except ImportError:
+    from llm_cache import CachedLLM, get_cache
+    from token_calibration import get_calibrator
+    from rate_limiter import RateLimitedLLM, RateLimiter, RateLimitError, get_rate_limiter
+    from transport import ResilientLLM, TransportPolicy
+
 # Forza caricamento file .env
 load_dotenv(override=True)
 
 
+try:
+    import h2  # noqa: F401 - abilita HTTP/2 in httpx
+    HTTP2_DISPONIBILE = True
+except ImportError:
+    HTTP2_DISPONIBILE = False
+
+
+# Prompt recenti confrontati per il riuso della KV-cache di Ollama e caratteri
+# di prefisso comune (poche parole) sotto cui il riuso è trascurabile
+_PROMPT_RECENTI = 16
+_PREFISSO_TRASCURABILE = 32
+
+
 class OpenRouterLLM:
     """Wrapper personalizzato per OpenRouter senza dipendere da OpenAI"""
     
-    def __init__(self, model: str, api_key: str, temperature: float = 0.7):
+    # Connessioni condivise tra tutte le istanze (keep-alive, niente handshake per batch)
+    _session = None
+    _session_lock = threading.Lock()
+    _async_clients = weakref.WeakKeyDictionary()
+    
+    def __init__(self, model: str, api_key: str, temperature: float = 0.7, max_connections: int = 10,
+                 rate_limiter: RateLimiter = None, timeout: float = 30.0):
         self.model = model
         self.api_key = api_key
         self.temperature = temperature
+        self.max_connections = max_connections
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
         self.base_url = "https://openrouter.ai/api/v1/chat/completions"
     
-    def invoke(self, messages: Union[str, List[Dict[str, str]]]) -> str:
-        """Invoca il modello OpenRouter con i messaggi forniti"""
+    @classmethod
+    def _get_session(cls) -> requests.Session:
+        """Sessione sincrona condivisa con pool di connessioni persistenti"""
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                cls._session = session
+            return cls._session
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Client asincrono condiviso (uno per event loop) con keep-alive e HTTP/2"""
+        loop = asyncio.get_running_loop()
+        client = OpenRouterLLM._async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=HTTP2_DISPONIBILE,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60.0
+                )
+            )
+            OpenRouterLLM._async_clients[loop] = client
+        return client
+    
+    @classmethod
+    async def aclose(cls) -> None:
+        """Chiude il client asincrono associato all'event loop corrente"""
+        client = cls._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+    
+    def _prepara_richiesta(self, messages: Union[str, List[Dict[str, str]]], **opzioni) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """Costruisce header e payload della richiesta chat (opzioni extra, es. response_format, nel payload)"""
         
         # Se messages è una stringa, convertila in formato chat
         if isinstance(messages, str):
             formatted_messages = [{"role": "user", "content": messages}]
         else:
             formatted_messages = messages
-            
+        
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "HTTP-Referer": "http://localhost:8888",
@@ -44,21 +119,190 @@ class OpenRouterLLM:
             "messages": formatted_messages,
             "temperature": self.temperature
         }
+        data.update(opzioni)
+        
+        return headers, data
+    
+    def _registra_utilizzo(self, messages: List[Dict[str, str]], contenuto: str, usage: Dict[str, Any] = None) -> None:
+        """Alimenta la calibrazione dei token con il blocco usage della risposta"""
+        
+        if not usage:
+            return
+        
+        calibratore = get_calibrator()
+        calibratore.registra(self.model, "\n".join(m.get('content', '') for m in messages), usage.get('prompt_tokens'))
+        calibratore.registra(self.model, contenuto or '', usage.get('completion_tokens'))
+    
+    def _token_stimati(self, data: Dict[str, Any]) -> int:
+        """Token di input stimati per il secchio token/minuto del rate limiter"""
+        return estimate_tokens("\n".join(m.get('content', '') for m in data["messages"]), self.model)
+    
+    def _controlla_rate_limit(self, status_code: int, headers: Any) -> None:
+        """Aggiorna il rate limiter con gli header della risposta e solleva RateLimitError sui 429"""
+        
+        retry_after = self.rate_limiter.aggiorna_da_headers(headers) if self.rate_limiter else None
+        
+        if status_code == 429:
+            if self.rate_limiter:
+                self.rate_limiter.segnala_429(retry_after)
+            raise RateLimitError(f"OpenRouter: rate limit superato per {self.model}", retry_after)
+        
+        if self.rate_limiter and status_code < 400:
+            self.rate_limiter.segnala_successo()
+    
+    def invoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        """Invoca il modello OpenRouter con i messaggi forniti"""
+        
+        headers, data = self._prepara_richiesta(messages, **kwargs)
+        if self.rate_limiter:
+            self.rate_limiter.acquisisci(self._token_stimati(data))
         
         try:
-            response = requests.post(self.base_url, headers=headers, json=data)
+            response = self._get_session().post(self.base_url, headers=headers, json=data, timeout=self.timeout)
+            self._controlla_rate_limit(response.status_code, response.headers)
             response.raise_for_status()
             
             result = response.json()
-            return result['choices'][0]['message']['content']
-            
+            contenuto = result['choices'][0]['message']['content']
+            self._registra_utilizzo(data["messages"], contenuto, result.get('usage'))
+            return contenuto
+        
         except requests.exceptions.RequestException as e:
-            raise Exception(f"Errore nella chiamata OpenRouter: {e}")
+            raise Exception(f"Errore nella chiamata OpenRouter: {e}") from e
         except KeyError as e:
-            raise Exception(f"Formato risposta OpenRouter non valido: {e}")
+            raise Exception(f"Formato risposta OpenRouter non valido: {e}") from e
+    
+    def stream(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> Iterator[str]:
+        """Invoca il modello in streaming (SSE) restituendo i frammenti di testo man mano che arrivano"""
+        
+        headers, data = self._prepara_richiesta(messages, stream=True, **kwargs)
+        if self.rate_limiter:
+            self.rate_limiter.acquisisci(self._token_stimati(data))
+        
+        try:
+            with self._get_session().post(self.base_url, headers=headers, json=data,
+                                          timeout=self.timeout, stream=True) as response:
+                self._controlla_rate_limit(response.status_code, response.headers)
+                response.raise_for_status()
+                
+                for riga in response.iter_lines(decode_unicode=True):
+                    if not riga or not riga.startswith('data:'):
+                        continue
+                    payload = riga[len('data:'):].strip()
+                    if payload == '[DONE]':
+                        break
+                    frammento = json.loads(payload)['choices'][0].get('delta', {}).get('content')
+                    if frammento:
+                        yield frammento
+        
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Errore nella chiamata OpenRouter: {e}") from e
+        except (KeyError, IndexError) as e:
+            raise Exception(f"Formato risposta OpenRouter non valido: {e}") from e
+    
+    async def ainvoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        """Versione asincrona di invoke sul client HTTP condiviso"""
+        
+        headers, data = self._prepara_richiesta(messages, **kwargs)
+        if self.rate_limiter:
+            await self.rate_limiter.aacquisisci(self._token_stimati(data))
+        
+        try:
+            response = await self._get_async_client().post(self.base_url, headers=headers, json=data, timeout=self.timeout)
+            self._controlla_rate_limit(response.status_code, response.headers)
+            response.raise_for_status()
+            
+            result = response.json()
+            contenuto = result['choices'][0]['message']['content']
+            self._registra_utilizzo(data["messages"], contenuto, result.get('usage'))
+            return contenuto
+        
+        except httpx.HTTPError as e:
+            raise Exception(f"Errore nella chiamata OpenRouter: {e}") from e
+        except KeyError as e:
+            raise Exception(f"Formato risposta OpenRouter non valido: {e}") from e
 
 
-def create_llm(provider: str, model: str, temperature: float = 0.7) -> Union[OllamaLLM, OpenRouterLLM]:
+async def ainvoke_batch(llm: Any,
+                        lista_messaggi: List[Union[str, List[Dict[str, str]]]],
+                        max_concorrenza: int = 8) -> List[Union[str, Exception]]:
+    """
+    Invia molte richieste in parallelo limitando quelle contemporaneamente in volo
+    
+    Args:
+        llm: Client con metodo ainvoke (OpenRouterLLM o OllamaLLM)
+        lista_messaggi: Prompt o liste di messaggi chat, uno per richiesta
+        max_concorrenza: Numero massimo di richieste in volo
+    
+    Returns:
+        Lista delle risposte nello stesso ordine dell'input; le richieste
+        fallite sono restituite come eccezione invece di interrompere il lotto
+    """
+    
+    semaforo = asyncio.Semaphore(max_concorrenza)
+    
+    async def invia(messaggi):
+        async with semaforo:
+            return await llm.ainvoke(messaggi)
+    
+    return await asyncio.gather(*(invia(m) for m in lista_messaggi), return_exceptions=True)
+
+
+class OllamaUsageCallback(BaseCallbackHandler):
+    """
+    Callback LangChain che alimenta la calibrazione con prompt_eval_count/eval_count di Ollama
+    
+    prompt_eval_count esclude i token serviti dalla KV-cache: un prompt che
+    condivide l'inizio con uno dei precedenti (es. il prefisso statico dei
+    batch) verrebbe contato solo in parte e abbasserebbe le stime. Per il
+    prompt si registrano quindi solo i campioni senza prefisso in comune con
+    i prompt recenti; eval_count vale sempre.
+    """
+    
+    def __init__(self, model: str):
+        self.model = model
+        self._prompt_in_corso: Dict[Any, Tuple[str, bool]] = {}
+        self._prompt_recenti: deque = deque(maxlen=_PROMPT_RECENTI)
+        self._lock = threading.Lock()
+    
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: Any = None, **kwargs: Any) -> None:
+        prompt = "\n".join(prompts)
+        with self._lock:
+            riuso_possibile = any(
+                len(os.path.commonprefix([prompt, precedente])) > _PREFISSO_TRASCURABILE
+                for precedente in self._prompt_recenti
+            )
+            self._prompt_recenti.append(prompt)
+            self._prompt_in_corso[run_id] = (prompt, riuso_possibile)
+    
+    def on_llm_end(self, response: Any, *, run_id: Any = None, **kwargs: Any) -> None:
+        with self._lock:
+            prompt, riuso_possibile = self._prompt_in_corso.pop(run_id, (None, True))
+        calibratore = get_calibrator()
+        
+        for generazioni in response.generations:
+            for generazione in generazioni:
+                info = generazione.generation_info or {}
+                calibratore.registra(self.model, generazione.text, info.get('eval_count'))
+                
+                # La cache può venire anche da un'esecuzione precedente: campioni con
+                # meno di un token ogni 8 caratteri restano comunque esclusi
+                token_prompt = info.get('prompt_eval_count')
+                if prompt and token_prompt and not riuso_possibile and len(prompt) / token_prompt <= 8:
+                    calibratore.registra(self.model, prompt, token_prompt)
+    
+    def on_llm_error(self, error: BaseException, *, run_id: Any = None, **kwargs: Any) -> None:
+        with self._lock:
+            self._prompt_in_corso.pop(run_id, None)
+
+
+def create_llm(provider: str,
+               model: str,
+               temperature: float = 0.7,
+               cache: Union[bool, str] = False,
+               rate_limits: Dict[str, Any] = None,
+               policy: TransportPolicy = None,
+               base_url: str = None) -> Union[ResilientLLM, CachedLLM]:
     """
     Factory function per creare il client LLM appropriato
     
@@ -66,33 +310,67 @@ def create_llm(provider: str, model: str, temperature: float = 0.7) -> Union[Oll
         provider: 'ollama' o 'openrouter'
         model: Nome del modello da utilizzare
         temperature: Temperatura per la generazione
+        cache: True per la cache su disco di default, oppure percorso del database
+        rate_limits: Limiti del provider {'richieste_al_secondo', 'token_al_minuto'}
+                     (default: .env o DEFAULT_RATE_LIMITS)
+        policy: Timeout, retry, circuit breaker e scadenza dell'esecuzione
+                (default: TransportPolicy())
+        base_url: URL del server (default: OLLAMA_BASE_URL per Ollama, API pubblica per OpenRouter)
     
     Returns:
         Istanza del client LLM appropriato
     """
     
+    policy = policy or TransportPolicy()
+    
     if provider.lower() == 'ollama':
         # Usa l'URL personalizzato dal file .env se presente
-        base_url = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
-        return OllamaLLM(
+        base_url = base_url or os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
+        # Ogni server Ollama ha la propria capacità: un limitatore per server
+        rate_limiter = get_rate_limiter(provider, chiave=f"ollama:{base_url}", **(rate_limits or {}))
+        num_ctx = os.getenv('OLLAMA_NUM_CTX')
+        llm = OllamaLLM(
             model=model,
             temperature=temperature,
-            base_url=base_url
+            base_url=base_url,
+            num_ctx=int(num_ctx) if num_ctx else None,
+            callbacks=[OllamaUsageCallback(model)],
+            client_kwargs={'timeout': policy.timeout_seconds},
+            # Modello (e KV-cache del prefisso comune) residente tra un batch e l'altro
+            keep_alive=os.getenv('OLLAMA_KEEP_ALIVE', '30m')
         )
+        llm = RateLimitedLLM(llm, rate_limiter, lambda testo: estimate_tokens(testo, model))
+        endpoint = f"ollama:{base_url}"
     
     elif provider.lower() == 'openrouter':
         api_key = os.getenv('OPENROUTER_API_KEY')
         if not api_key:
             raise ValueError("OPENROUTER_API_KEY non trovata nelle variabili d'ambiente")
         
-        return OpenRouterLLM(
+        # La quota OpenRouter è per account: un solo limitatore condiviso
+        rate_limiter = get_rate_limiter(provider, **(rate_limits or {}))
+        llm = OpenRouterLLM(
             model=model,
             api_key=api_key,
-            temperature=temperature
+            temperature=temperature,
+            rate_limiter=rate_limiter,
+            timeout=policy.timeout_seconds
         )
+        if base_url:
+            llm.base_url = base_url
+        endpoint = f"openrouter:{llm.base_url}"
     
     else:
         raise ValueError(f"Provider {provider} non supportato. Usa 'ollama' o 'openrouter'")
+    
+    # Retry e circuit breaker sotto la cache: le risposte in cache non toccano la rete
+    llm = ResilientLLM(llm, policy, endpoint)
+    
+    if cache:
+        # Stesso prompt, modello e temperatura → risposta riletta da disco
+        llm = CachedLLM(llm, provider.lower(), get_cache(cache if isinstance(cache, str) else None))
+    
+    return llm
 
 
 def test_connection(provider: str, model: str = None) -> tuple[bool, str]:
@@ -185,21 +463,85 @@ def get_available_models(provider: str) -> List[str]:
         return []
 
 
-def estimate_tokens(text: str) -> int:
+def estimate_tokens(text: str, model: str = None) -> int:
     """
-    Stima approssimativa del numero di token in un testo
+    Stima il numero di token in un testo
+    
+    Se per il modello esistono conteggi reali dai provider (usage di OpenRouter,
+    prompt_eval_count/eval_count di Ollama) usa la stima calibrata, altrimenti
+    l'euristica di ~4 caratteri per token.
     
     Args:
         text: Testo da analizzare
+        model: Nome del modello (opzionale, abilita la stima calibrata)
     
     Returns:
         Numero stimato di token
     """
     
+    if model:
+        stima = get_calibrator().stima(model, text)
+        if stima is not None:
+            return stima
+    
     # Stima approssimativa: ~4 caratteri per token
     return len(text) // 4
 
 
+# Finestra di contesto (token) dei modelli più usati; per Ollama vale anche num_ctx
+MODEL_CONTEXT_LENGTHS = {
+    # Ollama
+    'mixtral': 32768,
+    'mixtral:8x7b': 32768,
+    'llama3.2': 131072,
+    'llama3.2:1b': 131072,
+    'llama3.2:3b': 131072,
+    'qwen2.5': 32768,
+    'qwen2.5:7b': 32768,
+    'qwen3:32b': 40960,
+    'deepseek-r1': 131072,
+    'phi3': 4096,
+    'phi4:14b': 16384,
+    'codellama': 16384,
+    # OpenRouter
+    'nvidia/llama-3.1-nemotron-ultra-253b-v1': 131072,
+    'meta-llama/llama-3.2-3b-instruct:free': 131072,
+    'meta-llama/llama-3.2-1b-instruct:free': 131072,
+    'meta-llama/llama-3.1-8b-instruct:free': 131072,
+    'deepseek/deepseek-r1-distill-qwen-14b': 65536,
+    'mistralai/mistral-small-3': 32768,
+    'mistralai/mistral-7b-instruct:free': 32768,
+    'google/gemma-2-9b-it:free': 8192,
+}
+
+DEFAULT_CONTEXT_LENGTH = 8192
+
+# Contesto usato da Ollama se OLLAMA_NUM_CTX non è impostato
+DEFAULT_OLLAMA_NUM_CTX = 4096
+
+
+def get_context_length(model: str, provider: str = None) -> int:
+    """
+    Restituisce la finestra di contesto effettiva di un modello
+    
+    Args:
+        model: Nome del modello
+        provider: 'ollama' o 'openrouter' (opzionale)
+    
+    Returns:
+        Numero massimo di token (input + output) per chiamata
+    """
+    
+    model = model or ''
+    lunghezza = MODEL_CONTEXT_LENGTHS.get(model) or MODEL_CONTEXT_LENGTHS.get(model.split(':')[0], DEFAULT_CONTEXT_LENGTH)
+    
+    # Ollama tronca silenziosamente il prompt oltre num_ctx, indipendentemente dal modello
+    if (provider or '').lower() == 'ollama':
+        lunghezza = min(lunghezza, int(os.getenv('OLLAMA_NUM_CTX', DEFAULT_OLLAMA_NUM_CTX)))
+    
+    return lunghezza
+
+
 def validate_model_config(provider: str, model: str) -> tuple[bool, str]:
     """
     Valida la configurazione del modello
@@ -253,20 +595,38 @@ def test_all_providers() -> Dict[str, bool]:
     return status
 
 
-def create_llm_instance(config: Dict[str, Any]) -> Union[OllamaLLM, OpenRouterLLM]:
+def create_llm_instance(config: Dict[str, Any]) -> Any:
     """
     Crea un'istanza LLM basata sulla configurazione
     
     Args:
         config: Configurazione con chiavi 'provider', 'model', 'temperature'
+                e opzionalmente 'cache' (True o percorso del database)
+                e 'rate_limits' (vedi create_llm); i parametri avanzati di
+                AnalysisConfig (timeout_seconds, max_retries, backoff_base_seconds,
+                run_deadline_seconds) definiscono la TransportPolicy;
+                'endpoints' (o la variabile LLM_ENDPOINTS) attiva il pool
+                di endpoint (vedi llm_pool)
     
     Returns:
         Istanza del client LLM
     """
     
+    try:
+        from .llm_pool import carica_endpoints, create_llm_pool
+    except ImportError:
+        from llm_pool import carica_endpoints, create_llm_pool
+    
+    endpoints = carica_endpoints(config)
+    if endpoints:
+        return create_llm_pool(endpoints, config.get('temperature', 0.7), policy=TransportPolicy.from_config(config),
+                               rate_limits=config.get('rate_limits'),
+                               cache=config.get('cache', os.getenv('LLM_CACHE', 'false').lower() == 'true'))
+    
     provider = config.get('provider', 'ollama')
     model = config.get('model')
     temperature = config.get('temperature', 0.7)
+    cache = config.get('cache', os.getenv('LLM_CACHE', 'false').lower() == 'true')
     
     # Usa modelli di default se non specificati
     if not model:
@@ -275,4 +635,5 @@ def create_llm_instance(config: Dict[str, Any]) -> Union[OllamaLLM, OpenRouterLL
         elif provider == 'openrouter':
             model = os.getenv('OPENROUTER_MODEL', 'meta-llama/llama-3.2-3b-instruct:free')
     
-    return create_llm(provider, model, temperature)
+    return create_llm(provider, model, temperature, cache=cache, rate_limits=config.get('rate_limits'),
+                      policy=TransportPolicy.from_config(config))
@@ -3,11 +3,33 @@
 Modulo ottimizzato per l'etichettatura batch di commenti con AI
 """
 
+import json
 import time
+import uuid
 import logging
 import pandas as pd
 import re
-from typing import Dict, List, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Any, Tuple, Union
+
+try:
+    from .ai_clients import estimate_tokens, get_context_length
+    from .data_parsers import raggruppa_duplicati
+    from .checkpoint import CheckpointJournal
+    from .hedging import HedgeController
+    from .llm_cache import senza_coalescenza
+    from .config_manager import AnalysisConfig
+except ImportError:
+    from ai_clients import estimate_tokens, get_context_length
+    from data_parsers import raggruppa_duplicati
+    from checkpoint import CheckpointJournal
+    from hedging import HedgeController
+    from llm_cache import senza_coalescenza
+    from config_manager import AnalysisConfig
+
+
+# In modalità a budget di token: oltre questo numero la numerazione COMMENTO_n diventa fragile
+MAX_COMMENTI_PER_BATCH_TOKEN = 40
 
 
 def etichetta_con_coefficiente_batch(df: pd.DataFrame, 
@@ -19,7 +41,27 @@ def etichetta_con_coefficiente_batch(df: pd.DataFrame,
                                    soglia_confidenza: float = 0.3,
                                    batch_size: int = 5,
                                    fase_label=None,
-                                   progress_bar=None) -> Dict[str, List]:
+                                   progress_bar=None,
+                                   max_workers: int = 1,
+                                   deduplica: bool = True,
+                                   checkpoint: CheckpointJournal = None,
+                                   batch_per_token: bool = False,
+                                   max_token_input: int = None,
+                                   max_token_output: int = None,
+                                   max_tentativi_riparazione: int = 2,
+                                   formato_json: bool = False,
+                                   protocollo_compatto: bool = False,
+                                   top_k: int = 3,
+                                   prefisso_statico: bool = True,
+                                   hedging: bool = False,
+                                   percentile_hedge: float = 0.95,
+                                   budget_hedge: float = 0.05,
+                                   llm_hedge: Any = None,
+                                   ai_provider_hedge: str = None,
+                                   llm_leggero: Any = None,
+                                   ai_provider_leggero: str = None,
+                                   soglia_escalation: float = 0.6,
+                                   preclassificatore: Any = None) -> Dict[str, List]:
     """
     Etichetta ogni cella con coefficienti di corrispondenza per tutte le etichette
     VERSIONE OTTIMIZZATA: Raggruppa più commenti per ridurre le chiamate API
@@ -35,11 +77,57 @@ def etichetta_con_coefficiente_batch(df: pd.DataFrame,
         batch_size: Numero di commenti da processare insieme (1-20)
         fase_label: Widget per mostrare la fase corrente (opzionale)
         progress_bar: Widget progress bar (opzionale)
+        max_workers: Numero di batch mantenuti in esecuzione contemporaneamente (1 = sequenziale)
+        deduplica: Etichetta una sola volta i commenti identici dopo la normalizzazione
+        checkpoint: Journal su cui registrare ogni batch completato; le righe
+                    già presenti nel journal non vengono inviate di nuovo (opzionale)
+        batch_per_token: Riempie ogni batch fino al budget di token del modello
+                         invece di usare un numero fisso di commenti
+        max_token_input: Budget di token in input per batch (default: dal contesto del modello)
+        max_token_output: Budget di token in output per batch (default: dal contesto del modello)
+        max_tentativi_riparazione: Passaggi in cui i soli commenti rimasti "Incerto" non parsati
+                                   o "Errore_Batch" vengono rispediti in batch più piccoli (0 = nessuno)
+        formato_json: Risposta in JSON vincolato da schema (format di Ollama,
+                      response_format di OpenRouter) con ripiego sul parser testuale
+        protocollo_compatto: Etichette con ID numerici nel prompt e risposta con i soli
+                             top_k coefficienti non nulli per commento (output
+                             indipendente dal numero di etichette)
+        top_k: Coefficienti restituiti per commento nel protocollo compatto
+        prefisso_statico: Etichette e istruzioni in un prefisso identico per tutti i batch
+                          (riuso della KV-cache di Ollama e del prefix caching dei provider)
+        hedging: I batch più lenti del percentile_hedge della latenza osservata vengono
+                 duplicati su llm_hedge (o di nuovo su llm se è un pool con più endpoint, che
+                 sceglie un altro endpoint); vince la prima risposta valida. Con un solo
+                 endpoint e senza llm_hedge l'hedging viene disattivato
+        percentile_hedge: Percentile della latenza oltre cui duplicare (es. 0.95 = p95)
+        budget_hedge: Frazione massima di batch duplicati (es. 0.05 = 5%)
+        llm_hedge: Client per i duplicati (opzionale, default: llm)
+        ai_provider_hedge: Provider di llm_hedge (default: ai_provider)
+        llm_leggero: Modello piccolo e veloce (es. llama3.2:1b) che etichetta tutto per primo;
+                     a llm passano solo le righe incerte (modalità a cascata, opzionale)
+        ai_provider_leggero: Provider di llm_leggero (default: ai_provider)
+        soglia_escalation: Coefficiente principale o confidenza generale sotto cui una
+                           riga etichettata da llm_leggero passa a llm
+        preclassificatore: PreClassificatoreEmbedding (vedi embeddings) che assegna senza LLM
+                           i commenti netti; solo gli ambigui vanno al modello (opzionale)
     
     Returns:
         Dict contenente tutti i risultati dell'etichettatura
     """
     
+    if llm_leggero is not None:
+        return etichetta_a_cascata(
+            df, etichette_dinamiche, colonna_riferimento, tipo_analisi, llm_leggero, llm, ai_provider,
+            ai_provider_leggero=ai_provider_leggero, soglia_escalation=soglia_escalation, checkpoint=checkpoint,
+            soglia_confidenza=soglia_confidenza, batch_size=batch_size, fase_label=fase_label,
+            progress_bar=progress_bar, max_workers=max_workers, deduplica=deduplica,
+            batch_per_token=batch_per_token, max_token_input=max_token_input, max_token_output=max_token_output,
+            max_tentativi_riparazione=max_tentativi_riparazione, formato_json=formato_json,
+            protocollo_compatto=protocollo_compatto, top_k=top_k, prefisso_statico=prefisso_statico,
+            hedging=hedging, percentile_hedge=percentile_hedge, budget_hedge=budget_hedge,
+            llm_hedge=llm_hedge, ai_provider_hedge=ai_provider_hedge, preclassificatore=preclassificatore
+        )
+    
     logging.info(f"Inizio etichettatura BATCH ottimizzata (batch_size: {batch_size}, soglia: {soglia_confidenza})")
     print(f"🚀 MODALITÀ BATCH ATTIVA: {batch_size} commenti per chiamata API")
     print(f"⚡ Velocizzazione stimata: {batch_size}x rispetto alla modalità singola")
@@ -58,6 +146,14 @@ def etichetta_con_coefficiente_batch(df: pd.DataFrame,
         for nome, info in etichette_dinamiche.items()
     ])
     
+    if protocollo_compatto and formato_json:
+        logging.warning("Protocollo compatto e formato JSON insieme: si usa il formato JSON")
+        protocollo_compatto = False
+    
+    # Nel protocollo compatto ogni etichetta è indicata dal suo ID (E1, E2, ...)
+    if protocollo_compatto:
+        lista_etichette = crea_lista_etichette_con_id(etichette_dinamiche)
+    
     # Inizializza tutti i risultati con None per mantenere l'ordine
     total_rows = len(df)
     for _ in range(total_rows):
@@ -78,119 +174,766 @@ def etichetta_con_coefficiente_batch(df: pd.DataFrame,
     
     # Processa i commenti validi in batch
     valid_indices = df[df[colonna_riferimento].notna()].index.tolist()
+    indici_pendenti = valid_indices
     
-    for batch_start in range(0, len(valid_indices), batch_size):
-        batch_end = min(batch_start + batch_size, len(valid_indices))
-        batch_indices = valid_indices[batch_start:batch_end]
-        batch_commenti = [df.loc[idx, colonna_riferimento] for idx in batch_indices]
+    # La durata massima dell'esecuzione (TransportPolicy) parte da qui
+    if hasattr(llm, 'avvia_run'):
+        llm.avvia_run()
+    
+    # Ripresa da checkpoint: le righe già completate non vengono rispedite
+    if checkpoint is not None:
+        gia_completati = checkpoint.carica()
+        ripresi = [idx for idx in valid_indices if idx in gia_completati]
+        for idx in ripresi:
+            _assegna_risultato(risultati, idx, gia_completati[idx])
         
-        # Calcola progresso dettagliato
-        batch_progress = batch_end
-        percentuale = int((batch_progress / len(valid_indices)) * 100)
+        if ripresi:
+            print(f"🧷 Ripresa da checkpoint: {len(ripresi)} commenti già etichettati")
+            indici_pendenti = [idx for idx in valid_indices if idx not in gia_completati]
+    
+    # Raggruppa i duplicati esatti: si etichetta un solo rappresentante per gruppo
+    if deduplica:
+        rappresentanti, gruppi = raggruppa_duplicati({idx: df.loc[idx, colonna_riferimento] for idx in indici_pendenti})
+        indici_da_etichettare = list(rappresentanti.keys())
+    else:
+        gruppi = {idx: [idx] for idx in indici_pendenti}
+        indici_da_etichettare = indici_pendenti
+    
+    numero_unici = len(indici_da_etichettare)
+    
+    def crea_batches(indici: List[int]) -> List[List[int]]:
+        # Stesso raggruppamento per le chiamate reali e per quelle di confronto delle statistiche
+        if not batch_per_token:
+            return [indici[i:i + batch_size] for i in range(0, len(indici), batch_size)]
+        modello = getattr(llm, 'model', None)
+        budget_input, budget_output = calcola_budget_token(modello, ai_provider)
+        return crea_batch_per_budget(
+            {idx: str(df.loc[idx, colonna_riferimento]) for idx in indici},
+            # Parte fissa misurata sulla richiesta effettivamente inviata (formato, prefisso statico, messaggi)
+            token_fissi=estimate_tokens(_testo_richiesta(_crea_richiesta_batch(
+                [], lista_etichette, tipo_analisi, ai_provider, soglia_confidenza, formato_json,
+                top_k if protocollo_compatto else 0, prefisso_statico
+            )), modello) + 50,
+            max_token_input=max_token_input or budget_input,
+            max_token_output=max_token_output or budget_output,
+            token_output_per_commento=stima_token_output_per_commento(
+                len(etichette_dinamiche), top_k if protocollo_compatto else None
+            ),
+            model=modello
+        )
+    
+    # Chiamate prima della pre-classificazione, con e senza deduplicazione: ogni risparmio si conta a parte
+    batches = crea_batches(indici_da_etichettare)
+    chiamate_dedup = len(batches)
+    chiamate_senza_dedup = len(crea_batches(indici_pendenti)) if numero_unici < len(indici_pendenti) else chiamate_dedup
+    
+    # Pre-classificazione con embedding: i commenti netti non passano dal modello generativo
+    statistiche_preclassificazione = None
+    if preclassificatore is not None:
+        assegnati, indici_da_etichettare = preclassificatore.classifica(
+            {idx: str(df.loc[idx, colonna_riferimento]) for idx in indici_da_etichettare},
+            etichette_dinamiche, soglia_confidenza
+        )
+        righe_assegnate = [riga for idx, risultato in assegnati.items() for riga in gruppi[idx]]
+        for idx, risultato in assegnati.items():
+            for riga in gruppi[idx]:
+                _assegna_risultato(risultati, riga, risultato)
+        if checkpoint is not None and righe_assegnate:
+            checkpoint.registra_batch(righe_assegnate, [_leggi_risultato(risultati, riga) for riga in righe_assegnate])
         
-        # Aggiorna gli indicatori di progresso se disponibili
-        if fase_label:
-            fase_label.value = f"<b>🏷️ FASE 2: Etichettatura BATCH {percentuale}% {batch_progress}/{len(valid_indices)}</b>"
+        batches = crea_batches(indici_da_etichettare)
+        statistiche_preclassificazione = {
+            "commenti_assegnati": len(assegnati),
+            "commenti_ambigui": len(indici_da_etichettare),
+            "chiamate_risparmiate": chiamate_dedup - len(batches)
+        }
+        print(f"🧭 Pre-classificazione embedding: {len(assegnati)} commenti assegnati senza LLM, "
+              f"{len(indici_da_etichettare)} ambigui al modello")
+    
+    if batch_per_token:
+        print(f"📐 Batch a budget di token: {len(batches)} batch, "
+              f"{len(indici_da_etichettare) / max(len(batches), 1):.1f} commenti per batch in media")
+    
+    if numero_unici < len(indici_pendenti):
+        print(f"🧹 Deduplicazione: {len(indici_pendenti)} commenti → {numero_unici} unici "
+              f"({chiamate_senza_dedup - chiamate_dedup} chiamate API risparmiate)")
+    
+    # Con un pool di endpoint (vedi llm_pool) si sfrutta tutta la capacità configurata
+    max_workers = max(max_workers, getattr(llm, 'capacita_totale', 1))
+    max_workers = max(1, min(max_workers, len(batches) or 1))
+    
+    if max_workers > 1:
+        print(f"🧵 MODALITÀ CONCORRENTE: {max_workers} batch in parallelo")
+    
+    # Un duplicato sullo stesso server contende GPU, quota e rate limit alla primaria: serve un altro endpoint
+    if hedging and llm_hedge is None and len(getattr(llm, 'endpoints', None) or []) < 2:
+        logging.warning("Hedging disattivato: serve llm_hedge o un pool con almeno due endpoint")
+        hedging = False
+    hedge = HedgeController(percentile_hedge, budget_hedge, max_thread=2 * max_workers + 2) if hedging else None
+    
+    def esegui_batch(batch_indices: List[int]) -> Tuple[List[Dict[str, Any]], List[int]]:
+        # Il ritmo delle chiamate è regolato dal rate limiter del client (vedi create_llm)
+        batch_commenti = [df.loc[idx, colonna_riferimento] for idx in batch_indices]
         
-        if progress_bar:
-            progress_fase2 = 40 + int((batch_progress / len(valid_indices)) * 40)
-            progress_bar.value = progress_fase2
+        def invoca(client: Any, provider: str) -> Tuple[List[Dict[str, Any]], List[int]]:
+            return _invoca_batch(batch_commenti, lista_etichette, tipo_analisi, client, provider, soglia_confidenza,
+                                 nomi_etichette=list(etichette_dinamiche.keys()), formato_json=formato_json,
+                                 top_k=top_k if protocollo_compatto else 0, prefisso_statico=prefisso_statico)
         
-        logging.info(f"Processando batch {batch_start//batch_size + 1}: commenti {batch_start+1}-{batch_end} ({percentuale}%)")
-        print(f"   ⚡ Batch {batch_start//batch_size + 1}: Analizzando {len(batch_commenti)} commenti insieme...")
+        def invoca_duplicato() -> Tuple[List[Dict[str, Any]], List[int]]:
+            # Stessa chiave di cache della primaria: senza coalescenza il duplicato ne attenderebbe la risposta
+            with senza_coalescenza():
+                return invoca(llm_hedge or llm, ai_provider_hedge or ai_provider)
         
-        # Crea prompt per il batch
-        prompt_batch = create_batch_prompt(batch_commenti, lista_etichette, soglia_confidenza)
+        if hedge is None:
+            return invoca(llm, ai_provider)
+        return hedge.esegui(
+            lambda: invoca(llm, ai_provider),
+            invoca_duplicato,
+            valida=lambda esito: not all(_da_riparare(r) for r in esito[0])
+        )
+    
+    def assegna(idx: int, risultato: Dict[str, Any] = None) -> None:
+        # Il risultato del rappresentante vale per tutte le righe duplicate
+        for riga in gruppi[idx]:
+            _assegna_risultato(risultati, riga, risultato)
+    
+    statistiche_parsing = {"commenti_riaccodati": 0}
+    
+    def esegui_round(batches_round: List[List[int]], riparazione: bool = False) -> None:
+        completati = 0
+        totale = sum(len(b) for b in batches_round)
+        workers = max(1, min(max_workers, len(batches_round)))
         
-        try:
-            # Invoca il modello AI
-            if ai_provider.lower() == 'ollama':
-                risposta = llm.invoke(prompt_batch)
-            else:
-                messages = [
-                    {"role": "system", "content": f"Sei un analista esperto che calcola coefficienti di corrispondenza per {tipo_analisi}. Analizza sempre TUTTI i commenti forniti."},
-                    {"role": "user", "content": prompt_batch}
-                ]
-                risposta = llm.invoke(messages)
-            
-            # Parsing della risposta batch
-            risultati_batch = parse_batch_response(str(risposta), len(batch_commenti), soglia_confidenza)
-            
-            # Assegna i risultati agli indici corretti
-            for i, idx in enumerate(batch_indices):
-                if i < len(risultati_batch):
-                    risultato = risultati_batch[i]
-                    risultati["etichette_principali"][idx] = risultato["principale"]
-                    risultati["coefficienti_principali"][idx] = risultato["coeff_principale"]
-                    risultati["etichette_secondarie"][idx] = risultato["secondarie"]
-                    risultati["coefficienti_completi"][idx] = risultato["tutti_coefficienti"]
-                    risultati["confidenza_media"][idx] = risultato["confidenza_generale"]
-                else:
-                    # Fallback in caso di errore di parsing
-                    risultati["etichette_principali"][idx] = "Errore_Batch"
-                    risultati["coefficienti_principali"][idx] = 0.0
-                    risultati["etichette_secondarie"][idx] = ""
-                    risultati["coefficienti_completi"][idx] = "{}"
-                    risultati["confidenza_media"][idx] = 0.0
-            
-            print(f"   ✅ Batch completato: {len(batch_commenti)} commenti processati")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # numero batch, indici, già riaccodato (i commenti mancanti si riaccodano una volta sola)
+            futures = {
+                executor.submit(esegui_batch, batch_indices): (numero, batch_indices, False)
+                for numero, batch_indices in enumerate(batches_round, 1)
+            }
+            numero_successivo = len(batches_round) + 1
             
-            # Mostra alcuni risultati del batch
-            for i, idx in enumerate(batch_indices[:3]):  # Mostra primi 3 risultati
-                if i < len(risultati_batch):
-                    risultato = risultati_batch[i]
-                    print(f"      📝 Riga {idx+1}: {risultato['principale']} ({risultato['coeff_principale']:.2f})")
-            
-        except Exception as e:
-            logging.error(f"Errore nel batch {batch_start//batch_size + 1}: {e}")
-            print(f"   ❌ Errore nel batch: {e}")
-            
-            # Assegna valori di errore a tutto il batch
-            for idx in batch_indices:
-                risultati["etichette_principali"][idx] = "Errore_Batch"
-                risultati["coefficienti_principali"][idx] = 0.0
-                risultati["etichette_secondarie"][idx] = ""
-                risultati["coefficienti_completi"][idx] = "{}"
-                risultati["confidenza_media"][idx] = 0.0
+            # I risultati vengono raccolti nel thread chiamante: i widget si aggiornano solo da qui
+            while futures:
+                future = next(as_completed(futures))
+                numero_batch, batch_indices, riaccodato = futures.pop(future)
+                
+                try:
+                    risultati_batch, mancanti = future.result()
+                except Exception as e:
+                    risultati_batch, mancanti, errore = None, [], e
+                
+                # I commenti senza sezione nella risposta ripartono subito in un nuovo batch
+                if mancanti and not riaccodato:
+                    posizioni_mancanti = set(mancanti)
+                    indici_mancanti = [batch_indices[i] for i in mancanti]
+                    statistiche_parsing["commenti_riaccodati"] += len(indici_mancanti)
+                    futures[executor.submit(esegui_batch, indici_mancanti)] = (numero_successivo, indici_mancanti, True)
+                    numero_successivo += 1
+                    batch_indices = [idx for i, idx in enumerate(batch_indices) if i not in posizioni_mancanti]
+                    risultati_batch = [r for i, r in enumerate(risultati_batch) if i not in posizioni_mancanti]
+                
+                if not batch_indices:
+                    continue
+                completati += len(batch_indices)
+                
+                # Calcola progresso dettagliato
+                percentuale = int((completati / totale) * 100)
+                
+                # Aggiorna gli indicatori di progresso se disponibili (solo nel primo passaggio)
+                if fase_label and not riparazione:
+                    fase_label.value = f"<b>🏷️ FASE 2: Etichettatura BATCH {percentuale}% {completati}/{totale}</b>"
+                
+                if progress_bar and not riparazione:
+                    progress_fase2 = 40 + int((completati / totale) * 40)
+                    progress_bar.value = progress_fase2
+                
+                if risultati_batch is None:
+                    logging.error(f"Errore nel batch {numero_batch}: {errore}")
+                    print(f"   ❌ Errore nel batch {numero_batch}: {errore}")
+                    
+                    # Assegna valori di errore a tutto il batch
+                    for idx in batch_indices:
+                        assegna(idx, None)
+                    continue
+                
+                logging.info(f"Batch {numero_batch} completato: {len(batch_indices)} commenti ({percentuale}%)")
+                
+                # Assegna i risultati agli indici corretti
+                for i, idx in enumerate(batch_indices):
+                    # Fallback "Errore_Batch" in caso di errore di parsing
+                    assegna(idx, risultati_batch[i] if i < len(risultati_batch) else None)
+                
+                # Nel journal solo le righe riuscite: quelle da riparare vanno rispedite alla ripresa
+                if checkpoint is not None:
+                    righe = [
+                        riga for idx in batch_indices for riga in gruppi[idx]
+                        if not _da_riparare(_leggi_risultato(risultati, riga))
+                    ]
+                    checkpoint.registra_batch(righe, [_leggi_risultato(risultati, riga) for riga in righe])
+                
+                if riparazione:
+                    continue
+                
+                print(f"   ✅ Batch {numero_batch} completato: {len(batch_indices)} commenti processati")
+                
+                # Mostra alcuni risultati del batch
+                for i, idx in enumerate(batch_indices[:3]):  # Mostra primi 3 risultati
+                    if i < len(risultati_batch):
+                        risultato = risultati_batch[i]
+                        print(f"      📝 Riga {idx+1}: {risultato['principale']} ({risultato['coeff_principale']:.2f})")
+    
+    esegui_round(batches)
+    
+    # Passaggi di riparazione: solo i commenti non parsati o in errore, in batch più piccoli
+    dimensione_riparazione = max(1, len(indici_da_etichettare) // max(len(batches), 1))
+    commenti_riparati = 0
+    da_riparare = []
+    for tentativo in range(1, max_tentativi_riparazione + 1):
+        da_riparare = [idx for idx in indici_da_etichettare if _da_riparare(_leggi_risultato(risultati, idx))]
+        if not da_riparare:
+            break
+        
+        dimensione_riparazione = max(1, dimensione_riparazione // 2)
+        print(f"🔧 Riparazione {tentativo}/{max_tentativi_riparazione}: "
+              f"{len(da_riparare)} commenti rispediti in batch da {dimensione_riparazione}")
         
-        # Pausa più breve tra batch (invece di pausa per ogni commento)
-        time.sleep(0.5)
+        esegui_round(
+            [da_riparare[i:i + dimensione_riparazione] for i in range(0, len(da_riparare), dimensione_riparazione)],
+            riparazione=True
+        )
+        
+        ancora_da_riparare = [idx for idx in da_riparare if _da_riparare(_leggi_risultato(risultati, idx))]
+        commenti_riparati += len(da_riparare) - len(ancora_da_riparare)
+        da_riparare = ancora_da_riparare
+    
+    if da_riparare:
+        print(f"⚠️ {len(da_riparare)} commenti non etichettati dopo {max_tentativi_riparazione} passaggi di riparazione")
     
     # Calcola statistiche finali
-    coefficienti_validi = [c for c in risultati["coefficienti_principali"] if c and c > 0]
-    risultati["statistiche_confidenza"] = {
+    risultati["statistiche_confidenza"] = _statistiche_confidenza(risultati["coefficienti_principali"])
+    
+    risultati["statistiche_deduplica"] = {
+        "commenti_validi": len(indici_pendenti),
+        "commenti_unici": numero_unici,
+        "duplicati_collassati": len(indici_pendenti) - numero_unici,
+        "chiamate_risparmiate": chiamate_senza_dedup - chiamate_dedup
+    }
+    
+    risultati["statistiche_parsing"] = statistiche_parsing
+    
+    if statistiche_preclassificazione is not None:
+        risultati["statistiche_preclassificazione"] = statistiche_preclassificazione
+    
+    risultati["statistiche_riparazione"] = {
+        "commenti_riparati": commenti_riparati,
+        "commenti_non_riparati": len(da_riparare)
+    }
+    
+    if hedge is not None:
+        risultati["statistiche_hedging"] = hedge.stats()
+        hedge.chiudi()
+        print(f"🪁 Hedging: {hedge.duplicati} batch duplicati, {hedge.vinti_dal_duplicato} vinti dal duplicato")
+    
+    print(f"\n🎉 ETICHETTATURA BATCH COMPLETATA!")
+    print(f"⚡ Velocizzazione ottenuta: ~{batch_size}x rispetto alla modalità singola")
+    print(f"🔢 Batch processati: {len(batches)}")
+    print(f"📊 Commenti validi: {len(valid_indices)}/{len(df)}")
+    
+    logging.info("Etichettatura batch con coefficienti completata")
+    return risultati
+
+
+def _statistiche_confidenza(coefficienti: List[float]) -> Dict[str, Any]:
+    """Distribuzione dei coefficienti principali per fascia di confidenza"""
+    
+    coefficienti_validi = [c for c in coefficienti if c and c > 0]
+    return {
         "media_coefficienti": sum(coefficienti_validi) / len(coefficienti_validi) if coefficienti_validi else 0,
         "alta_confidenza": len([c for c in coefficienti_validi if c >= 0.7]),
         "media_confidenza": len([c for c in coefficienti_validi if 0.4 <= c < 0.7]),
         "bassa_confidenza": len([c for c in coefficienti_validi if 0.1 <= c < 0.4]),
         "molto_bassa": len([c for c in coefficienti_validi if c < 0.1])
     }
+
+
+def da_escalare(risultato: Dict[str, Any], soglia_escalation: float) -> bool:
+    """True se la risposta del modello leggero non basta: non parsata o sotto soglia"""
     
-    print(f"\n🎉 ETICHETTATURA BATCH COMPLETATA!")
-    print(f"⚡ Velocizzazione ottenuta: ~{batch_size}x rispetto alla modalità singola")
-    print(f"🔢 Batch processati: {(len(valid_indices) + batch_size - 1) // batch_size}")
-    print(f"📊 Commenti validi: {len(valid_indices)}/{len(df)}")
+    if risultato["principale"] == "Vuota":
+        return False
+    return (_da_riparare(risultato)
+            or (risultato["coeff_principale"] or 0.0) < soglia_escalation
+            or (risultato["confidenza_generale"] or 0.0) < soglia_escalation)
+
+
+class _JournalLivello:
+    """
+    Journal di un livello della cascata: marca ogni risultato con il livello
+    e riporta gli indici del sotto-DataFrame a quelli originali
+    
+    La ripresa la gestisce etichetta_a_cascata: per l'etichettatura batch il
+    journal risulta vuoto.
+    """
+    
+    def __init__(self, checkpoint: CheckpointJournal, livello: str, indici_originali: List[Any] = None):
+        self.checkpoint = checkpoint
+        self.livello = livello
+        self.indici_originali = indici_originali
+    
+    def carica(self) -> Dict[int, Dict[str, Any]]:
+        return {}
+    
+    def registra_batch(self, indici: List[int], risultati: List[Dict[str, Any]]) -> None:
+        if self.indici_originali is not None:
+            indici = [self.indici_originali[i] for i in indici]
+        self.checkpoint.registra_batch(indici, [dict(r, livello=self.livello) for r in risultati])
+
+
+def etichetta_a_cascata(df: pd.DataFrame,
+                        etichette_dinamiche: Dict[str, Dict],
+                        colonna_riferimento: str,
+                        tipo_analisi: str,
+                        llm_leggero: Any,
+                        llm: Any,
+                        ai_provider: str,
+                        ai_provider_leggero: str = None,
+                        soglia_escalation: float = 0.6,
+                        checkpoint: CheckpointJournal = None,
+                        **opzioni) -> Dict[str, List]:
+    """
+    Etichettatura a cascata: prima il modello leggero, poi il grande sulle sole righe incerte
+    
+    Le righe con coefficiente principale o confidenza generale sotto
+    soglia_escalation, o non parsate, vengono rietichettate da llm. Se il
+    modello grande fallisce su una riga resta la risposta del leggero.
+    
+    Args:
+        df, etichette_dinamiche, colonna_riferimento, tipo_analisi: Come in etichetta_con_coefficiente_batch
+        llm_leggero: Modello piccolo e veloce per il primo passaggio
+        llm: Modello grande per le righe incerte
+        ai_provider: Provider di llm
+        ai_provider_leggero: Provider di llm_leggero (default: ai_provider)
+        soglia_escalation: Soglia sotto cui una riga passa al modello grande
+        checkpoint: Journal dell'etichettatura; ogni batch di entrambi i livelli
+                    viene registrato appena completato, con il livello che lo ha
+                    prodotto. Alla ripresa le righe del leggero sotto soglia
+                    vanno direttamente al modello grande.
+        **opzioni: Altri parametri di etichetta_con_coefficiente_batch
+    
+    Returns:
+        Risultati come etichetta_con_coefficiente_batch, più "statistiche_cascata".
+        secondi_risparmiati_max è un limite superiore: il ritmo del modello grande
+        è misurato sulle sole righe escalate, le più difficili.
+    """
+    
+    # Il modello grande riceve solo righe già scartate dal primo livello (pre-classificazione compresa)
+    opzioni_grande = {k: v for k, v in opzioni.items() if k not in ('fase_label', 'progress_bar', 'preclassificatore')}
+    df_lavoro = df
+    
+    # Ripresa da checkpoint: le righe definitive non vanno a nessuno dei due modelli,
+    # quelle del leggero sotto soglia solo al grande
+    gia_completati = checkpoint.carica() if checkpoint is not None else {}
+    definitivi, leggeri_da_escalare = {}, {}
+    for idx in df.index:
+        if idx not in gia_completati:
+            continue
+        risultato = gia_completati[idx]
+        if risultato.get("livello") == "leggero" and da_escalare(risultato, soglia_escalation):
+            leggeri_da_escalare[idx] = risultato
+        else:
+            definitivi[idx] = risultato
+    
+    ripresi = list(definitivi) + list(leggeri_da_escalare)
+    if ripresi:
+        df_lavoro = df.copy()
+        df_lavoro.loc[ripresi, colonna_riferimento] = None
+        print(f"🧷 Ripresa da checkpoint: {len(definitivi)} commenti già etichettati, "
+              f"{len(leggeri_da_escalare)} già passati dal modello leggero")
+    
+    print(f"🪜 CASCATA: modello leggero {getattr(llm_leggero, 'model', '')} → modello grande "
+          f"{getattr(llm, 'model', '')} sotto {soglia_escalation:.2f}")
+    
+    inizio = time.monotonic()
+    risultati = etichetta_con_coefficiente_batch(
+        df_lavoro, etichette_dinamiche, colonna_riferimento, tipo_analisi, llm_leggero,
+        ai_provider_leggero or ai_provider,
+        checkpoint=_JournalLivello(checkpoint, "leggero") if checkpoint is not None else None, **opzioni
+    )
+    secondi_leggero = time.monotonic() - inizio
+    
+    for idx, risultato in leggeri_da_escalare.items():
+        _assegna_risultato(risultati, idx, risultato)
+    
+    righe_validi = [idx for idx in df_lavoro.index if pd.notna(df_lavoro.loc[idx, colonna_riferimento])]
+    righe_escalate = [idx for idx in righe_validi if da_escalare(_leggi_risultato(risultati, idx), soglia_escalation)]
+    righe_validi += list(leggeri_da_escalare)
+    righe_escalate += list(leggeri_da_escalare)
+    
+    secondi_grande = 0.0
+    if righe_escalate:
+        print(f"🪜 {len(righe_escalate)}/{len(righe_validi)} righe passano al modello grande")
+        df_escalate = df.loc[righe_escalate].reset_index(drop=True)
+        inizio = time.monotonic()
+        risultati_grande = etichetta_con_coefficiente_batch(
+            df_escalate, etichette_dinamiche, colonna_riferimento, tipo_analisi, llm, ai_provider,
+            checkpoint=_JournalLivello(checkpoint, "grande", righe_escalate) if checkpoint is not None else None,
+            **opzioni_grande
+        )
+        secondi_grande = time.monotonic() - inizio
+        
+        for posizione, idx in enumerate(righe_escalate):
+            risultato = _leggi_risultato(risultati_grande, posizione)
+            if not _da_riparare(risultato):
+                _assegna_risultato(risultati, idx, risultato)
+    
+    for idx, risultato in definitivi.items():
+        _assegna_risultato(risultati, idx, risultato)
+    
+    risultati["statistiche_confidenza"] = _statistiche_confidenza(risultati["coefficienti_principali"])
+    
+    # Limite superiore: il ritmo del grande, misurato sulle righe più difficili, applicato a tutte
+    secondi_max_solo_grande = secondi_grande / len(righe_escalate) * len(righe_validi) if righe_escalate else None
+    risultati["statistiche_cascata"] = {
+        "righe_modello_leggero": len(righe_validi) - len(righe_escalate),
+        "righe_modello_grande": len(righe_escalate),
+        "secondi_modello_leggero": round(secondi_leggero, 2),
+        "secondi_modello_grande": round(secondi_grande, 2),
+        "secondi_risparmiati_max": (
+            round(secondi_max_solo_grande - secondi_leggero - secondi_grande, 2)
+            if secondi_max_solo_grande is not None else None
+        )
+    }
+    
+    statistiche = risultati["statistiche_cascata"]
+    print(f"🪜 Cascata: {statistiche['righe_modello_leggero']} righe dal modello leggero, "
+          f"{statistiche['righe_modello_grande']} dal modello grande")
+    if statistiche["secondi_risparmiati_max"] is not None:
+        print(f"⏱️ Tempo risparmiato: al massimo {statistiche['secondi_risparmiati_max']:.1f}s "
+              f"(ritmo del modello grande misurato sulle righe più difficili)")
     
-    logging.info("Etichettatura batch con coefficienti completata")
     return risultati
 
 
-def create_batch_prompt(batch_commenti: List[str], lista_etichette: str, soglia_confidenza: float) -> str:
-    """Crea il prompt per l'analisi batch di più commenti"""
+def opzioni_da_config(config: Union[AnalysisConfig, Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Parametri di etichetta_con_coefficiente_batch dai parametri batch di AnalysisConfig
     
-    prompt_batch = f"""Analizza questi {len(batch_commenti)} commenti e calcola quanto ognuno si adatta a OGNI etichetta (coefficiente 0.0-1.0).
+    Con modello_leggero viene creato il client della cascata (stesso provider
+    e stessa TransportPolicy); con preclassificazione_embedding il
+    PreClassificatoreEmbedding sugli embedding di Ollama.
+    
+    Args:
+        config: AnalysisConfig o dizionario con gli stessi campi (default: AnalysisConfig())
+    
+    Returns:
+        Dizionario da passare come **opzioni a etichetta_con_coefficiente_batch
+    
+    Example:
+        etichetta_con_coefficiente_batch(df, etichette, colonna, tipo, llm, config.ai_provider,
+                                         **opzioni_da_config(config))
+    """
+    
+    if config is None:
+        config = AnalysisConfig()
+    elif not isinstance(config, AnalysisConfig):
+        config = AnalysisConfig.from_dict({k: v for k, v in config.items() if k in AnalysisConfig.__dataclass_fields__})
+    
+    valida, messaggio = config.validate()
+    if not valida:
+        raise ValueError(f"❌ Configurazione non valida: {messaggio}")
+    
+    opzioni = {
+        "soglia_confidenza": config.soglia_confidenza,
+        "batch_size": config.batch_size,
+        "max_workers": config.max_workers,
+        "deduplica": config.deduplica_commenti,
+        "batch_per_token": config.batch_per_token,
+        "max_tentativi_riparazione": config.max_tentativi_riparazione,
+        "formato_json": config.formato_json,
+        "protocollo_compatto": config.protocollo_compatto,
+        "top_k": config.top_k_coefficienti,
+        "prefisso_statico": config.prefisso_statico,
+        "hedging": config.hedging,
+        "percentile_hedge": config.percentile_hedge,
+        "budget_hedge": config.budget_hedge,
+        "soglia_escalation": config.soglia_escalation
+    }
+    
+    if config.modello_leggero:
+        try:
+            from .ai_clients import create_llm
+            from .transport import TransportPolicy
+        except ImportError:
+            from ai_clients import create_llm
+            from transport import TransportPolicy
+        opzioni["llm_leggero"] = create_llm(config.ai_provider, config.modello_leggero, config.temperature,
+                                           policy=TransportPolicy.from_config(config))
+    
+    if config.preclassificazione_embedding:
+        try:
+            from .embeddings import OllamaEmbedder, PreClassificatoreEmbedding
+        except ImportError:
+            from embeddings import OllamaEmbedder, PreClassificatoreEmbedding
+        opzioni["preclassificatore"] = PreClassificatoreEmbedding(
+            OllamaEmbedder(), config.similarita_minima_embedding, config.margine_minimo_embedding
+        )
+    
+    return opzioni
 
-ETICHETTE DISPONIBILI:
-{lista_etichette}
 
-COMMENTI DA ANALIZZARE:
-"""
+def stima_token_output_per_commento(num_etichette: int, top_k: int = None) -> int:
+    """Token di risposta attesi per commento (formato completo o, con top_k, protocollo compatto)"""
+    
+    # Compatto: "C12: E3=0.85 E7=0.40 | 0.80" → ~6 token fissi + ~5 per coefficiente
+    if top_k:
+        return 6 + 5 * top_k
+    
+    # ~40 token fissi (intestazione, principale, secondarie, confidenza) + ~8 per coefficiente
+    return 40 + 8 * num_etichette
+
+
+def calcola_budget_token(model: str, provider: str, quota_output: float = 0.25) -> Tuple[int, int]:
+    """
+    Calcola i budget di token per batch a partire dal contesto del modello
+    
+    Args:
+        model: Nome del modello
+        provider: 'ollama' o 'openrouter'
+        quota_output: Frazione del contesto riservata alla risposta
+    
+    Returns:
+        (max_token_input, max_token_output)
+    """
+    
+    contesto = get_context_length(model, provider)
+    max_output = min(4096, int(contesto * quota_output))
+    
+    # Margine del 10% perché la stima dei token è approssimativa
+    max_input = int((contesto - max_output) * 0.9)
+    
+    return max_input, max_output
+
+
+def crea_batch_per_budget(commenti: Dict[Any, str],
+                          token_fissi: int,
+                          max_token_input: int,
+                          max_token_output: int,
+                          token_output_per_commento: int,
+                          max_commenti: int = MAX_COMMENTI_PER_BATCH_TOKEN,
+                          ordina_per_lunghezza: bool = True,
+                          model: str = None) -> List[List[Any]]:
+    """
+    Raggruppa i commenti in batch che rispettano i budget di token
+    
+    Args:
+        commenti: Dizionario indice → testo del commento
+        token_fissi: Token del prompt esclusi i commenti (etichette, istruzioni)
+        max_token_input: Budget di token in input per batch
+        max_token_output: Budget di token in output per batch
+        token_output_per_commento: Token di risposta attesi per ogni commento
+        max_commenti: Numero massimo di commenti per batch
+        ordina_per_lunghezza: Raggruppa commenti di lunghezza simile per
+                              mantenere uniforme la latenza dei batch
+        model: Modello di destinazione, per la stima calibrata dei token
+    
+    Returns:
+        Lista di batch, ognuno come lista di indici
+    """
+    
+    indici = list(commenti.keys())
+    token_commento = {idx: estimate_tokens(str(commenti[idx]), model) + 6 for idx in indici}
+    
+    if ordina_per_lunghezza:
+        indici.sort(key=lambda idx: token_commento[idx])
+    
+    budget_commenti = max_token_input - token_fissi
+    max_per_output = max(1, max_token_output // max(token_output_per_commento, 1))
+    limite_commenti = max(1, min(max_commenti, max_per_output))
+    
+    batches = []
+    corrente = []
+    token_correnti = 0
+    
+    for idx in indici:
+        if corrente and (token_correnti + token_commento[idx] > budget_commenti or len(corrente) >= limite_commenti):
+            batches.append(corrente)
+            corrente = []
+            token_correnti = 0
+        
+        if token_commento[idx] > budget_commenti:
+            logging.warning(f"Commento {idx} ({token_commento[idx]} token) supera da solo il budget di input ({budget_commenti})")
+        
+        corrente.append(idx)
+        token_correnti += token_commento[idx]
     
-    for i, commento in enumerate(batch_commenti, 1):
-        prompt_batch += f"COMMENTO_{i}: \"{commento}\"\n"
+    if corrente:
+        batches.append(corrente)
+    
+    return batches
+
+
+def _invoca_batch(batch_commenti: List[str],
+                  lista_etichette: str,
+                  tipo_analisi: str,
+                  llm: Any,
+                  ai_provider: str,
+                  soglia_confidenza: float,
+                  nomi_etichette: List[str] = None,
+                  formato_json: bool = False,
+                  top_k: int = 0,
+                  prefisso_statico: bool = False) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """
+    Invia un singolo batch al modello e restituisce i risultati parsati e le posizioni senza sezione
+    
+    top_k > 0 attiva il protocollo compatto (lista_etichette deve contenere gli ID E1, E2, ...);
+    prefisso_statico usa create_batch_prompt_cache (prefisso identico in tutti i batch)
+    """
+    
+    richiesta = _crea_richiesta_batch(batch_commenti, lista_etichette, tipo_analisi, ai_provider,
+                                      soglia_confidenza, formato_json, top_k, prefisso_statico)
+    
+    # Invoca il modello AI (in modalità JSON la generazione è vincolata allo schema)
+    if formato_json:
+        schema = crea_schema_risposta_batch(nomi_etichette or [])
+        if ai_provider.lower() == 'ollama':
+            opzioni = {"format": schema}
+        else:
+            opzioni = {
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {"name": "etichettatura_batch", "strict": True, "schema": schema}
+                }
+            }
+    else:
+        opzioni = {}
+    risposta = llm.invoke(richiesta, **opzioni)
+    
+    if formato_json:
+        try:
+            risultati, mancanti, _ = parse_batch_response_json(str(risposta), len(batch_commenti), soglia_confidenza)
+            return risultati, mancanti
+        except ValueError as e:
+            logging.warning(f"Risposta JSON non valida ({e}), uso il parser testuale")
+    
+    if top_k:
+        risultati, mancanti, _ = parse_batch_response_compatta(
+            str(risposta), len(batch_commenti), soglia_confidenza, nomi_etichette or []
+        )
+        return risultati, mancanti
+    
+    # Parsing della risposta batch: ogni sezione va al commento indicato nell'intestazione
+    risultati, mancanti, _ = parse_batch_response_per_id(str(risposta), len(batch_commenti), soglia_confidenza)
+    return risultati, mancanti
+
+
+def _crea_richiesta_batch(batch_commenti: List[str],
+                          lista_etichette: str,
+                          tipo_analisi: str,
+                          ai_provider: str,
+                          soglia_confidenza: float,
+                          formato_json: bool = False,
+                          top_k: int = 0,
+                          prefisso_statico: bool = False) -> Union[str, List[Dict[str, str]]]:
+    """Richiesta completa di un batch, esattamente come viene inviata (vedi _invoca_batch)"""
+    
+    prefisso = None
+    if prefisso_statico:
+        formato = 'json' if formato_json else 'compatto' if top_k else 'testo'
+        prefisso, prompt_batch = create_batch_prompt_cache(
+            batch_commenti, lista_etichette, soglia_confidenza, formato, top_k or 3
+        )
+    elif formato_json:
+        prompt_batch = create_batch_prompt_json(batch_commenti, lista_etichette, soglia_confidenza)
+    elif top_k:
+        prompt_batch = create_batch_prompt_compatto(batch_commenti, lista_etichette, top_k)
+    else:
+        prompt_batch = create_batch_prompt(batch_commenti, lista_etichette, soglia_confidenza)
+    
+    return _componi_richiesta(prompt_batch, tipo_analisi, ai_provider, prefisso)
+
+
+def _testo_richiesta(richiesta: Union[str, List[Dict[str, str]]]) -> str:
+    if isinstance(richiesta, str):
+        return richiesta
+    return "\n".join(messaggio.get('content', '') for messaggio in richiesta)
+
+
+def _componi_richiesta(prompt_batch: str,
+                       tipo_analisi: str,
+                       ai_provider: str,
+                       prefisso: str = None) -> Union[str, List[Dict[str, str]]]:
+    """
+    Prompt (Ollama) o messaggi chat (OpenRouter) di un batch
+    
+    Con un prefisso statico il contenuto fisso precede sempre i commenti: in
+    testa al prompt per Ollama (i commenti restano in fondo), nel messaggio di
+    sistema per OpenRouter.
+    """
+    
+    if ai_provider.lower() == 'ollama':
+        return f"{prefisso}\n\n{prompt_batch}" if prefisso else prompt_batch
+    
+    sistema = f"Sei un analista esperto che calcola coefficienti di corrispondenza per {tipo_analisi}. Analizza sempre TUTTI i commenti forniti."
+    if prefisso:
+        sistema += f"\n\n{prefisso}"
+    
+    return [
+        {"role": "system", "content": sistema},
+        {"role": "user", "content": prompt_batch}
+    ]
+
+
+def _assegna_risultato(risultati: Dict[str, List], idx: int, risultato: Dict[str, Any] = None) -> None:
+    """Scrive il risultato di un commento all'indice corretto (None = Errore_Batch)"""
+    
+    if risultato is None:
+        risultato = {
+            "principale": "Errore_Batch",
+            "coeff_principale": 0.0,
+            "secondarie": "",
+            "tutti_coefficienti": "{}",
+            "confidenza_generale": 0.0
+        }
+    
+    risultati["etichette_principali"][idx] = risultato["principale"]
+    risultati["coefficienti_principali"][idx] = risultato["coeff_principale"]
+    risultati["etichette_secondarie"][idx] = risultato["secondarie"]
+    risultati["coefficienti_completi"][idx] = risultato["tutti_coefficienti"]
+    risultati["confidenza_media"][idx] = risultato["confidenza_generale"]
+
+
+def _da_riparare(risultato: Dict[str, Any]) -> bool:
+    """
+    True se il commento non ha ricevuto una risposta utilizzabile
+    
+    "Errore_Batch" indica una chiamata fallita; "Incerto" senza coefficienti indica
+    una sezione mancante o non parsata. Un "Incerto" scelto dal modello, con i suoi
+    coefficienti, è una risposta valida e non viene rispedito.
+    """
+    
+    principale = risultato["principale"]
+    if principale == "Errore_Batch":
+        return True
+    return principale == "Incerto" and risultato["tutti_coefficienti"] in ("{}", "", None)
+
+
+def _leggi_risultato(risultati: Dict[str, List], idx: int) -> Dict[str, Any]:
+    """Ricostruisce il risultato di un commento a partire dalle liste dei risultati"""
+    
+    return {
+        "principale": risultati["etichette_principali"][idx],
+        "coeff_principale": risultati["coefficienti_principali"][idx],
+        "secondarie": risultati["etichette_secondarie"][idx],
+        "tutti_coefficienti": risultati["coefficienti_completi"][idx],
+        "confidenza_generale": risultati["confidenza_media"][idx]
+    }
+
+
+def _istruzioni_formato_testo(soglia_confidenza: float) -> str:
+    """Istruzioni e formato di risposta PRINCIPALE/SECONDARIE/TUTTI_COEFFICIENTI"""
     
-    prompt_batch += f"""
-ISTRUZIONI:
+    return f"""ISTRUZIONI:
 1. Per OGNI commento e OGNI etichetta, assegna un coefficiente da 0.0 (nessuna corrispondenza) a 1.0 (perfetta corrispondenza)
 2. Sii preciso nella valutazione - usa l'intera scala 0.0-1.0
 3. Per ogni commento, identifica l'etichetta principale (coefficiente più alto)
@@ -211,59 +954,501 @@ CONFIDENZA_GENERALE: 0.XX
 
 [continua per tutti i commenti...]"""
 
+
+def _elenco_commenti(batch_commenti: List[str]) -> str:
+    return "".join(f"COMMENTO_{i}: \"{commento}\"\n" for i, commento in enumerate(batch_commenti, 1))
+
+
+def create_batch_prompt(batch_commenti: List[str], lista_etichette: str, soglia_confidenza: float) -> str:
+    """Crea il prompt per l'analisi batch di più commenti"""
+    
+    prompt_batch = f"""Analizza questi {len(batch_commenti)} commenti e calcola quanto ognuno si adatta a OGNI etichetta (coefficiente 0.0-1.0).
+
+ETICHETTE DISPONIBILI:
+{lista_etichette}
+
+COMMENTI DA ANALIZZARE:
+"""
+    
+    prompt_batch += _elenco_commenti(batch_commenti)
+    prompt_batch += "\n" + _istruzioni_formato_testo(soglia_confidenza)
+    
     return prompt_batch
 
 
-def parse_batch_response(risposta: str, num_commenti: int, soglia: float) -> List[Dict[str, Any]]:
-    """Parsing specializzato per risposte batch"""
+def _istruzioni_formato_json(soglia_confidenza: float) -> str:
+    """Istruzioni e formato di risposta della modalità JSON"""
     
-    risultati = []
+    return f"""ISTRUZIONI:
+1. Per OGNI commento e OGNI etichetta, assegna un coefficiente da 0.0 (nessuna corrispondenza) a 1.0 (perfetta corrispondenza)
+2. Sii preciso nella valutazione - usa l'intera scala 0.0-1.0
+3. "principale" è l'etichetta con il coefficiente più alto
+4. Le etichette sopra {soglia_confidenza} diverse dalla principale sono considerate secondarie
+
+Rispondi SOLO con JSON in questo formato, un elemento per commento con "id" uguale al numero di COMMENTO_n:
+{{"commenti": [{{"id": 1, "principale": "nome_etichetta", "coefficiente": 0.XX, "coefficienti": {{"etichetta1": 0.XX, "etichetta2": 0.XX}}, "confidenza": 0.XX}}]}}"""
+
+
+def create_batch_prompt_json(batch_commenti: List[str], lista_etichette: str, soglia_confidenza: float) -> str:
+    """Crea il prompt batch per la modalità JSON (risposta vincolata da crea_schema_risposta_batch)"""
     
-    # Dividi la risposta per commenti
-    sezioni_commento = re.split(r'=== COMMENTO_\d+ ===', risposta)
+    prompt_batch = f"""Analizza questi {len(batch_commenti)} commenti e calcola quanto ognuno si adatta a OGNI etichetta (coefficiente 0.0-1.0).
+
+ETICHETTE DISPONIBILI:
+{lista_etichette}
+
+COMMENTI DA ANALIZZARE:
+"""
     
-    # Rimuovi la prima sezione se vuota
-    if sezioni_commento and not sezioni_commento[0].strip():
-        sezioni_commento.pop(0)
+    prompt_batch += _elenco_commenti(batch_commenti)
+    prompt_batch += "\n" + _istruzioni_formato_json(soglia_confidenza)
     
-    for i in range(num_commenti):
-        risultato = {
-            "principale": "Incerto",
-            "coeff_principale": 0.0,
-            "secondarie": "",
-            "tutti_coefficienti": "{}",
-            "confidenza_generale": 0.0
+    return prompt_batch
+
+
+def crea_schema_risposta_batch(nomi_etichette: List[str]) -> Dict[str, Any]:
+    """
+    JSON schema della risposta batch in modalità JSON
+    
+    Usato come `format` da Ollama e come `response_format` da OpenRouter:
+    il modello può generare solo JSON valido con le etichette ammesse.
+    """
+    
+    coefficiente = {"type": "number", "minimum": 0, "maximum": 1}
+    etichette_ammesse = list(nomi_etichette) + ["Incerto"]
+    
+    return {
+        "type": "object",
+        "properties": {
+            "commenti": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "principale": {"type": "string", "enum": etichette_ammesse} if nomi_etichette else {"type": "string"},
+                        "coefficiente": coefficiente,
+                        "coefficienti": {
+                            "type": "object",
+                            "properties": {nome: coefficiente for nome in nomi_etichette},
+                            "required": list(nomi_etichette),
+                            "additionalProperties": False
+                        },
+                        "confidenza": coefficiente
+                    },
+                    "required": ["id", "principale", "coefficiente", "coefficienti", "confidenza"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["commenti"],
+        "additionalProperties": False
+    }
+
+
+def _record_da_json(elemento: Dict[str, Any], soglia: float) -> Dict[str, Any]:
+    """Converte un elemento JSON nel risultato per-commento usato dal resto della pipeline"""
+    
+    coefficienti = {
+        str(nome): float(valore) for nome, valore in (elemento.get("coefficienti") or {}).items()
+        if isinstance(valore, (int, float))
+    }
+    principale = str(elemento.get("principale") or "Incerto").strip()
+    secondarie = sorted(
+        ((nome, valore) for nome, valore in coefficienti.items() if nome != principale and valore >= soglia),
+        key=lambda coppia: coppia[1], reverse=True
+    )
+    
+    return {
+        "principale": principale,
+        "coeff_principale": float(elemento.get("coefficiente") or coefficienti.get(principale, 0.0)),
+        "secondarie": ", ".join(f"{nome} ({valore:.2f})" for nome, valore in secondarie),
+        "tutti_coefficienti": json.dumps(coefficienti, ensure_ascii=False) if coefficienti else "{}",
+        "confidenza_generale": float(elemento.get("confidenza") or 0.0)
+    }
+
+
+def parse_batch_response_json(risposta: str,
+                              num_commenti: int,
+                              soglia: float) -> Tuple[List[Dict[str, Any]], List[int], List[int]]:
+    """
+    Parsing della risposta in modalità JSON con una sola decodifica
+    
+    Stesso contratto di parse_batch_response_per_id; gli elementi sono
+    assegnati per "id". Eventuali recinti ```json attorno alla risposta
+    vengono ignorati.
+    
+    Raises:
+        ValueError: Se la risposta non è JSON valido o non ha la struttura attesa
+                    (il chiamante ripiega sul parser testuale)
+    """
+    
+    inizio, fine = risposta.find('{'), risposta.rfind('}')
+    if inizio < 0 or fine < inizio:
+        raise ValueError("nessun oggetto JSON nella risposta")
+    
+    dati = json.loads(risposta[inizio:fine + 1])
+    elementi = dati.get("commenti") if isinstance(dati, dict) else None
+    if not isinstance(elementi, list):
+        raise ValueError("campo 'commenti' mancante")
+    
+    records: Dict[int, Dict[str, Any]] = {}
+    duplicati = []
+    for elemento in elementi:
+        try:
+            numero = int(elemento["id"])
+            record = _record_da_json(elemento, soglia)
+        except (KeyError, TypeError, ValueError):
+            continue
+        
+        if not 1 <= numero <= num_commenti:
+            continue
+        if numero in records:
+            duplicati.append(numero)
+            continue
+        records[numero] = record
+    
+    risultati = [records.get(n) or _risultato_incerto() for n in range(1, num_commenti + 1)]
+    mancanti = [n - 1 for n in range(1, num_commenti + 1) if n not in records]
+    
+    if duplicati or mancanti:
+        logging.warning(f"Risposta JSON: commenti mancanti {mancanti}, duplicati {sorted(set(duplicati))}")
+    
+    return risultati, mancanti, duplicati
+
+
+def crea_lista_etichette_con_id(etichette_dinamiche: Dict[str, Dict]) -> str:
+    """Elenco etichette per il protocollo compatto: "E1: nome - descrizione" nell'ordine del dizionario"""
+    
+    return "\n".join(
+        f"E{i}: {nome} - {info['descrizione']}"
+        for i, (nome, info) in enumerate(etichette_dinamiche.items(), 1)
+    )
+
+
+def _istruzioni_formato_compatto(top_k: int) -> str:
+    """Istruzioni e formato di risposta del protocollo compatto"""
+    
+    return f"""ISTRUZIONI:
+1. Per ogni commento indica al massimo {top_k} etichette con coefficiente maggiore di 0, dalla più alta
+2. Indica sempre almeno l'etichetta più adatta
+3. Le etichette non indicate valgono 0.0
+4. Dopo "|" indica la confidenza generale
+
+FORMATO RISPOSTA (una riga per commento, niente altro):
+C1: E3=0.85 E7=0.40 | 0.80
+C2: E1=0.90 | 0.85"""
+
+
+def create_batch_prompt_compatto(batch_commenti: List[str], lista_etichette_id: str, top_k: int = 3) -> str:
+    """Crea il prompt batch del protocollo compatto: ID etichetta e solo i top_k coefficienti"""
+    
+    prompt_batch = f"""Analizza questi {len(batch_commenti)} commenti e calcola quanto ognuno si adatta alle etichette (coefficiente 0.0-1.0).
+
+ETICHETTE DISPONIBILI (usa SOLO l'ID):
+{lista_etichette_id}
+
+COMMENTI DA ANALIZZARE:
+"""
+    
+    prompt_batch += _elenco_commenti(batch_commenti)
+    prompt_batch += "\n" + _istruzioni_formato_compatto(top_k)
+    
+    return prompt_batch
+
+
+def create_batch_prompt_cache(batch_commenti: List[str],
+                              lista_etichette: str,
+                              soglia_confidenza: float,
+                              formato: str = 'testo',
+                              top_k: int = 3) -> Tuple[str, str]:
+    """
+    Crea il prompt batch diviso in prefisso statico e parte variabile
+    
+    Il prefisso (etichette, istruzioni, formato di risposta) non dipende dai
+    commenti ed è identico byte per byte in tutti i batch dell'esecuzione:
+    Ollama riusa la KV-cache del prompt e i provider con prefix caching lo
+    fatturano/elaborano una volta sola. Numero e testo dei commenti stanno
+    solo nella parte variabile, in fondo.
+    
+    Args:
+        batch_commenti: Commenti del batch
+        lista_etichette: Elenco etichette (con ID E1, E2, ... per il formato compatto)
+        soglia_confidenza: Soglia per le etichette secondarie
+        formato: 'testo', 'json' o 'compatto'
+        top_k: Coefficienti per commento nel formato compatto
+    
+    Returns:
+        (prefisso_statico, parte_variabile)
+    """
+    
+    if formato == 'json':
+        istruzioni = _istruzioni_formato_json(soglia_confidenza)
+    elif formato == 'compatto':
+        istruzioni = _istruzioni_formato_compatto(top_k)
+    else:
+        istruzioni = _istruzioni_formato_testo(soglia_confidenza)
+    
+    intestazione_etichette = "ETICHETTE DISPONIBILI (usa SOLO l'ID):" if formato == 'compatto' else "ETICHETTE DISPONIBILI:"
+    
+    prefisso = f"""Analizza i commenti indicati alla fine e calcola quanto ognuno si adatta a OGNI etichetta (coefficiente 0.0-1.0).
+
+{intestazione_etichette}
+{lista_etichette}
+
+{istruzioni}"""
+    
+    parte_variabile = f"COMMENTI DA ANALIZZARE ({len(batch_commenti)}):\n" + _elenco_commenti(batch_commenti)
+    
+    return prefisso, parte_variabile
+
+
+_RIGA_COMPATTA = re.compile(r'^\W*C(?:OMMENTO_?)?(\d+)\s*[:)\-]\s*(.*)$', re.IGNORECASE | re.MULTILINE)
+_COPPIA_COMPATTA = re.compile(r'E(\d+)\s*[=:]\s*([\d.]+)', re.IGNORECASE)
+
+
+def parse_batch_response_compatta(risposta: str,
+                                  num_commenti: int,
+                                  soglia: float,
+                                  nomi_etichette: List[str]) -> Tuple[List[Dict[str, Any]], List[int], List[int]]:
+    """
+    Parsing del protocollo compatto con espansione degli ID nei nomi delle etichette
+    
+    Stesso contratto di parse_batch_response_per_id. I coefficienti non
+    indicati valgono 0.0 e non compaiono in tutti_coefficienti.
+    
+    Args:
+        risposta: Testo restituito dal modello
+        num_commenti: Numero di commenti inviati nel batch
+        soglia: Soglia per le etichette secondarie
+        nomi_etichette: Nomi delle etichette nell'ordine usato per gli ID (E1 = primo)
+    """
+    
+    records: Dict[int, Dict[str, Any]] = {}
+    duplicati = []
+    
+    for riga in _RIGA_COMPATTA.finditer(risposta):
+        numero = int(riga.group(1))
+        if not 1 <= numero <= num_commenti:
+            continue
+        
+        corpo, _, confidenza = riga.group(2).partition('|')
+        coefficienti = {}
+        for id_etichetta, valore in _COPPIA_COMPATTA.findall(corpo):
+            posizione = int(id_etichetta) - 1
+            try:
+                if 0 <= posizione < len(nomi_etichette):
+                    coefficienti.setdefault(nomi_etichette[posizione], float(valore))
+            except ValueError:
+                continue
+        
+        # Una riga senza coefficienti leggibili conta come sezione mancante
+        if not coefficienti:
+            continue
+        if numero in records:
+            duplicati.append(numero)
+            continue
+        
+        ordinati = sorted(coefficienti.items(), key=lambda coppia: coppia[1], reverse=True)
+        match_confidenza = re.search(r'[\d.]+', confidenza)
+        try:
+            confidenza_generale = float(match_confidenza.group(0)) if match_confidenza else ordinati[0][1]
+        except ValueError:
+            confidenza_generale = ordinati[0][1]
+        
+        records[numero] = {
+            "principale": ordinati[0][0],
+            "coeff_principale": ordinati[0][1],
+            "secondarie": ", ".join(f"{nome} ({valore:.2f})" for nome, valore in ordinati[1:] if valore >= soglia),
+            "tutti_coefficienti": json.dumps(dict(ordinati), ensure_ascii=False),
+            "confidenza_generale": confidenza_generale
         }
+    
+    risultati = [records.get(n) or _risultato_incerto() for n in range(1, num_commenti + 1)]
+    mancanti = [n - 1 for n in range(1, num_commenti + 1) if n not in records]
+    
+    if duplicati or mancanti:
+        logging.warning(f"Risposta compatta: commenti mancanti {mancanti}, duplicati {sorted(set(duplicati))}")
+    
+    return risultati, mancanti, duplicati
+
+
+# Intestazione di sezione: "=== COMMENTO_3 ===" (tollerante a spazi e numero di "=")
+_INTESTAZIONE_COMMENTO = re.compile(r'=+\s*COMMENTO[_ ]?(\d+)\s*=+', re.IGNORECASE)
+
+
+def _risultato_incerto() -> Dict[str, Any]:
+    return {
+        "principale": "Incerto",
+        "coeff_principale": 0.0,
+        "secondarie": "",
+        "tutti_coefficienti": "{}",
+        "confidenza_generale": 0.0
+    }
+
+
+def _parse_sezione(sezione: str) -> Dict[str, Any]:
+    """Estrae i campi di una singola sezione COMMENTO_n"""
+    
+    risultato = _risultato_incerto()
+    
+    # Estrae etichetta principale
+    match_principale = re.search(r'PRINCIPALE:\s*([^(]+)\s*\(coefficiente:\s*([\d.]+)\)', sezione)
+    if match_principale:
+        risultato["principale"] = match_principale.group(1).strip()
+        risultato["coeff_principale"] = float(match_principale.group(2))
+    
+    # Estrae etichette secondarie
+    match_secondarie = re.search(r'SECONDARIE:\s*(.+)', sezione)
+    if match_secondarie:
+        risultato["secondarie"] = match_secondarie.group(1).strip()
+    
+    # Estrae coefficienti completi
+    match_coefficienti = re.search(r'TUTTI_COEFFICIENTI:\s*(\{.+\})', sezione)
+    if match_coefficienti:
+        risultato["tutti_coefficienti"] = match_coefficienti.group(1)
+    
+    # Estrae confidenza generale
+    match_confidenza = re.search(r'CONFIDENZA_GENERALE:\s*([\d.]+)', sezione)
+    if match_confidenza:
+        risultato["confidenza_generale"] = float(match_confidenza.group(1))
+    
+    return risultato
+
+
+def parse_batch_response_per_id(risposta: str,
+                                num_commenti: int,
+                                soglia: float) -> Tuple[List[Dict[str, Any]], List[int], List[int]]:
+    """
+    Parsing della risposta batch guidato dal numero nell'intestazione
+    
+    Ogni sezione "=== COMMENTO_n ===" viene assegnata al commento n, quindi un
+    commento saltato o riordinato dal modello non sposta le etichette degli altri.
+    
+    Args:
+        risposta: Testo restituito dal modello
+        num_commenti: Numero di commenti inviati nel batch
+        soglia: Soglia di confidenza (mantenuta per compatibilità)
+    
+    Returns:
+        (risultati, mancanti, duplicati): risultati in ordine di input ("Incerto"
+        per i commenti senza sezione), posizioni 0-based dei commenti senza
+        sezione e numeri di commento comparsi più di una volta
+    """
+    
+    intestazioni = list(_INTESTAZIONE_COMMENTO.finditer(risposta))
+    sezioni: Dict[int, str] = {}
+    duplicati = []
+    
+    for i, intestazione in enumerate(intestazioni):
+        numero = int(intestazione.group(1))
+        fine = intestazioni[i + 1].start() if i + 1 < len(intestazioni) else len(risposta)
         
-        if i < len(sezioni_commento):
-            sezione = sezioni_commento[i]
-            
-            # Estrae etichetta principale
-            match_principale = re.search(r'PRINCIPALE:\s*([^(]+)\s*\(coefficiente:\s*([\d.]+)\)', sezione)
-            if match_principale:
-                risultato["principale"] = match_principale.group(1).strip()
-                risultato["coeff_principale"] = float(match_principale.group(2))
-            
-            # Estrae etichette secondarie
-            match_secondarie = re.search(r'SECONDARIE:\s*(.+)', sezione)
-            if match_secondarie:
-                risultato["secondarie"] = match_secondarie.group(1).strip()
-            
-            # Estrae coefficienti completi
-            match_coefficienti = re.search(r'TUTTI_COEFFICIENTI:\s*(\{.+\})', sezione)
-            if match_coefficienti:
-                risultato["tutti_coefficienti"] = match_coefficienti.group(1)
-            
-            # Estrae confidenza generale
-            match_confidenza = re.search(r'CONFIDENZA_GENERALE:\s*([\d.]+)', sezione)
-            if match_confidenza:
-                risultato["confidenza_generale"] = float(match_confidenza.group(1))
+        if not 1 <= numero <= num_commenti:
+            logging.warning(f"Risposta batch: COMMENTO_{numero} fuori intervallo (1-{num_commenti}), ignorato")
+            continue
         
-        risultati.append(risultato)
+        # In caso di duplicato vale la prima sezione
+        if numero in sezioni:
+            duplicati.append(numero)
+            continue
+        
+        sezioni[numero] = risposta[intestazione.end():fine]
+    
+    risultati = [
+        _parse_sezione(sezioni[n]) if n in sezioni else _risultato_incerto()
+        for n in range(1, num_commenti + 1)
+    ]
+    mancanti = [n - 1 for n in range(1, num_commenti + 1) if n not in sezioni]
+    
+    if duplicati:
+        logging.warning(f"Risposta batch: commenti duplicati {sorted(set(duplicati))}")
+    if mancanti:
+        logging.warning(f"Risposta batch: {len(mancanti)}/{num_commenti} commenti senza sezione")
+    
+    return risultati, mancanti, duplicati
+
+
+def parse_batch_response(risposta: str, num_commenti: int, soglia: float) -> List[Dict[str, Any]]:
+    """Parsing specializzato per risposte batch (sezioni assegnate per numero di commento)"""
     
+    risultati, _, _ = parse_batch_response_per_id(risposta, num_commenti, soglia)
     return risultati
 
 
+def misura_ttft(llm: Any, richiesta: Union[str, List[Dict[str, str]]], **kwargs) -> Tuple[float, float]:
+    """
+    Misura il time-to-first-token di una chiamata in streaming
+    
+    Returns:
+        (secondi al primo frammento, secondi totali)
+    """
+    
+    inizio = time.perf_counter()
+    primo = None
+    for _ in llm.stream(richiesta, **kwargs):
+        if primo is None:
+            primo = time.perf_counter() - inizio
+    totale = time.perf_counter() - inizio
+    
+    return (primo if primo is not None else totale), totale
+
+
+def benchmark_cache_prompt(llm: Any,
+                           ai_provider: str,
+                           commenti: List[str],
+                           etichette_dinamiche: Dict[str, Dict],
+                           tipo_analisi: str = 'benchmark',
+                           batch_size: int = 5,
+                           soglia_confidenza: float = 0.3) -> Dict[str, float]:
+    """
+    Confronta il time-to-first-token di un batch a freddo e di uno a caldo
+    
+    Entrambi i batch usano lo stesso prefisso statico (create_batch_prompt_cache),
+    reso unico da un marcatore di sessione: il primo lo elabora da zero, il
+    secondo dovrebbe trovarlo già nella cache del prompt.
+    
+    Args:
+        llm: Client con metodo stream (OllamaLLM o OpenRouterLLM)
+        ai_provider: Provider AI ('ollama' o 'openrouter')
+        commenti: Commenti di esempio (servono almeno 2 * batch_size per batch diversi)
+        etichette_dinamiche: Dizionario delle etichette
+        tipo_analisi: Tipo di analisi per il messaggio di sistema
+        batch_size: Commenti per batch
+        soglia_confidenza: Soglia per le etichette secondarie
+    
+    Returns:
+        Dizionario con ttft_freddo, ttft_caldo, durata_freddo, durata_caldo
+        (secondi) e riduzione_ttft_percentuale
+    """
+    
+    lista_etichette = "\n".join(f"- {nome}: {info['descrizione']}" for nome, info in etichette_dinamiche.items())
+    marcatore = f"Sessione {uuid.uuid4().hex[:12]}"
+    
+    batch_freddo = commenti[:batch_size]
+    batch_caldo = commenti[batch_size:2 * batch_size] or batch_freddo
+    
+    misure = []
+    for batch in (batch_freddo, batch_caldo):
+        prefisso, parte_variabile = create_batch_prompt_cache(batch, lista_etichette, soglia_confidenza)
+        richiesta = _componi_richiesta(parte_variabile, tipo_analisi, ai_provider, f"{marcatore}\n{prefisso}")
+        misure.append(misura_ttft(llm, richiesta))
+    
+    (ttft_freddo, durata_freddo), (ttft_caldo, durata_caldo) = misure
+    risultato = {
+        "ttft_freddo": ttft_freddo,
+        "ttft_caldo": ttft_caldo,
+        "durata_freddo": durata_freddo,
+        "durata_caldo": durata_caldo,
+        "riduzione_ttft_percentuale": (1 - ttft_caldo / ttft_freddo) * 100 if ttft_freddo > 0 else 0.0
+    }
+    
+    print(f"⏱️ TTFT a freddo: {ttft_freddo:.2f}s, a caldo: {ttft_caldo:.2f}s "
+          f"(-{risultato['riduzione_ttft_percentuale']:.0f}%)")
+    
+    return risultato
+
+
 def calculate_performance_stats(batch_size: int, num_comments: int) -> Dict[str, float]:
     """Calcola statistiche di performance per il batch processing"""
     
@@ -303,7 +1488,9 @@ def process_comments_batch(comments: List[str],
                          prompt: str, 
                          llm: Any, 
                          batch_size: int = 5,
-                         progress_callback=None) -> List[str]:
+                         progress_callback=None,
+                         deduplica: bool = True,
+                         con_statistiche: bool = False) -> Union[List[str], Tuple[List[str], Dict[str, int]]]:
     """
     Processa una lista di commenti usando batch processing
     
@@ -313,19 +1500,42 @@ def process_comments_batch(comments: List[str],
         llm: Modello di linguaggio
         batch_size: Dimensione dei batch
         progress_callback: Funzione per aggiornare il progresso
+        deduplica: Analizza una sola volta i commenti identici dopo la normalizzazione
+        con_statistiche: Restituisce anche le statistiche di deduplicazione
     
     Returns:
-        Lista dei risultati dell'analisi
+        Lista dei risultati dell'analisi; con con_statistiche la coppia
+        (risultati, statistiche_deduplica) con le stesse chiavi di etichetta_con_coefficiente_batch
     """
     
     if not comments:
-        return []
+        return ([], {"commenti_validi": 0, "commenti_unici": 0, "duplicati_collassati": 0,
+                     "chiamate_risparmiate": 0}) if con_statistiche else []
+    
+    # Solo i rappresentanti dei gruppi di duplicati vengono inviati al modello
+    if deduplica:
+        rappresentanti, gruppi = raggruppa_duplicati(dict(enumerate(comments)))
+    else:
+        rappresentanti, gruppi = dict(enumerate(comments)), {i: [i] for i in range(len(comments))}
+    
+    indici_unici = list(rappresentanti.keys())
+    commenti_unici = list(rappresentanti.values())
+    
+    chiamate_risparmiate = (len(comments) + batch_size - 1) // batch_size - (len(commenti_unici) + batch_size - 1) // batch_size
+    statistiche_deduplica = {
+        "commenti_validi": len(comments),
+        "commenti_unici": len(commenti_unici),
+        "duplicati_collassati": len(comments) - len(commenti_unici),
+        "chiamate_risparmiate": chiamate_risparmiate
+    }
+    if chiamate_risparmiate > 0:
+        logging.info(f"Deduplicazione: {len(comments)} → {len(commenti_unici)} commenti unici, {chiamate_risparmiate} chiamate risparmiate")
     
     risultati = []
-    total_batches = (len(comments) + batch_size - 1) // batch_size
+    total_batches = (len(commenti_unici) + batch_size - 1) // batch_size
     
-    for i in range(0, len(comments), batch_size):
-        batch = comments[i:i + batch_size]
+    for i in range(0, len(commenti_unici), batch_size):
+        batch = commenti_unici[i:i + batch_size]
         batch_num = (i // batch_size) + 1
         
         # Crea prompt per il batch
@@ -342,16 +1552,21 @@ def process_comments_batch(comments: List[str],
             # Aggiorna progresso se callback fornito
             if progress_callback:
                 progress_callback(batch_num, total_batches)
-            
-            # Pausa tra batch per evitare rate limiting
-            time.sleep(0.5)
-            
+        
         except Exception as e:
             logging.error(f"Errore processing batch {batch_num}: {e}")
             # Aggiungi risultati di fallback
             risultati.extend([f"Errore: {str(e)[:50]}" for _ in batch])
     
-    return risultati
+    # Ridistribuisci ogni risultato a tutte le posizioni originali del gruppo
+    risultati_completi = [None] * len(comments)
+    for idx, risultato in zip(indici_unici, risultati):
+        for posizione in gruppi[idx]:
+            risultati_completi[posizione] = risultato
+    
+    if con_statistiche:
+        return risultati_completi, statistiche_deduplica
+    return risultati_completi
 
 
 def create_batch_prompt_simple(comments: List[str], base_prompt: str) -> str:
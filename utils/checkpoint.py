@@ -0,0 +1,140 @@
+"""
+🧷 Checkpoint Module
+Journal append-only per riprendere le etichettature interrotte
+"""
+
+import os
+import glob
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+
+def calcola_fingerprint(file_path: Optional[str],
+                        colonna_riferimento: str,
+                        etichette_dinamiche: Dict[str, Dict],
+                        modello: str) -> str:
+    """
+    Calcola l'impronta di un'etichettatura
+    
+    Due esecuzioni con lo stesso file, colonna, set di etichette e modello
+    hanno la stessa impronta e possono condividere il journal.
+    
+    Args:
+        file_path: Percorso del file Excel di input
+        colonna_riferimento: Colonna analizzata
+        etichette_dinamiche: Dizionario delle etichette usate
+        modello: Nome del modello AI
+    
+    Returns:
+        Hash SHA-256 esadecimale
+    """
+    
+    hasher = hashlib.sha256()
+    
+    # Il contenuto del file conta più del nome: un export aggiornato è un input diverso
+    if file_path and os.path.exists(file_path):
+        with open(file_path, 'rb') as f:
+            for blocco in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(blocco)
+    else:
+        hasher.update(str(file_path).encode('utf-8'))
+    
+    hasher.update(json.dumps({
+        "colonna": colonna_riferimento,
+        "etichette": etichette_dinamiche,
+        "modello": modello
+    }, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    
+    return hasher.hexdigest()
+
+
+class CheckpointJournal:
+    """Journal JSONL: una riga per batch completato, scritta e sincronizzata su disco"""
+    
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def nome_file(fingerprint: str) -> str:
+        """Nome del file journal per una data impronta"""
+        return f"checkpoint_{fingerprint[:16]}.jsonl"
+    
+    @classmethod
+    def apri(cls, output_dir: str, fingerprint: str, base_path: str = None) -> 'CheckpointJournal':
+        """
+        Apre il journal per l'impronta indicata
+        
+        Cerca prima un journal con la stessa impronta nelle cartelle di output
+        precedenti (sorelle di output_dir) e lo riutilizza; altrimenti ne crea
+        uno nuovo in output_dir.
+        
+        Args:
+            output_dir: Cartella di output dell'esecuzione corrente
+            fingerprint: Impronta calcolata con calcola_fingerprint
+            base_path: Cartella in cui cercare i journal precedenti
+                       (default: cartella padre di output_dir)
+        
+        Returns:
+            Istanza di CheckpointJournal
+        """
+        
+        base_path = base_path or os.path.dirname(os.path.abspath(output_dir))
+        esistenti = glob.glob(os.path.join(base_path, '*', cls.nome_file(fingerprint)))
+        
+        if esistenti:
+            path = max(esistenti, key=os.path.getmtime)
+            logging.info(f"Checkpoint trovato, ripresa da: {path}")
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+            path = os.path.join(output_dir, cls.nome_file(fingerprint))
+        
+        return cls(path, fingerprint)
+    
+    def carica(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Legge i risultati già completati
+        
+        Returns:
+            Dizionario indice riga → risultato parsato. Un'eventuale ultima
+            riga troncata da un crash viene ignorata.
+        """
+        
+        completati = {}
+        if not os.path.exists(self.path):
+            return completati
+        
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for numero, linea in enumerate(f, 1):
+                try:
+                    record = json.loads(linea)
+                except json.JSONDecodeError:
+                    logging.warning(f"Checkpoint: riga {numero} illeggibile ignorata ({self.path})")
+                    continue
+                
+                if record.get("fingerprint") != self.fingerprint:
+                    continue
+                
+                for idx, risultato in zip(record["indici"], record["risultati"]):
+                    completati[idx] = risultato
+        
+        return completati
+    
+    def registra_batch(self, indici: List[int], risultati: List[Dict[str, Any]]) -> None:
+        """Aggiunge un batch completato al journal e lo forza su disco"""
+        
+        record = json.dumps({
+            "fingerprint": self.fingerprint,
+            "indici": [int(i) for i in indici],
+            "risultati": risultati
+        }, ensure_ascii=False)
+        
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(record + "\n")
+                f.flush()
+                os.fsync(f.fileno())
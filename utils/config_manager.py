@@ -23,6 +23,22 @@ class AnalysisConfig:
     # Parametri batch processing
     batch_mode: bool = True
     batch_size: int = 5
+    max_workers: int = 1
+    deduplica_commenti: bool = True
+    batch_per_token: bool = False
+    max_tentativi_riparazione: int = 2
+    formato_json: bool = False
+    protocollo_compatto: bool = False
+    top_k_coefficienti: int = 3
+    prefisso_statico: bool = True
+    hedging: bool = False
+    percentile_hedge: float = 0.95
+    budget_hedge: float = 0.05
+    modello_leggero: str = ''
+    soglia_escalation: float = 0.6
+    preclassificazione_embedding: bool = False
+    similarita_minima_embedding: float = 0.6
+    margine_minimo_embedding: float = 0.1
     
     # Parametri AI
     ai_provider: str = 'ollama'
@@ -32,7 +48,9 @@ class AnalysisConfig:
     # Parametri avanzati
     pause_between_requests: float = 1.0
     max_retries: int = 3
+    backoff_base_seconds: float = 1.0
     timeout_seconds: int = 30
+    run_deadline_seconds: int = 0
     
     def validate(self) -> Tuple[bool, str]:
         """Valida la configurazione"""
@@ -54,6 +72,43 @@ class AnalysisConfig:
         if not 1 <= self.batch_size <= 20:
             return False, "Batch size deve essere tra 1 e 20"
         
+        if not 1 <= self.max_workers <= 16:
+            return False, "Max workers deve essere tra 1 e 16"
+        
+        if not 0 <= self.max_tentativi_riparazione <= 5:
+            return False, "Tentativi di riparazione devono essere tra 0 e 5"
+        
+        if not 1 <= self.top_k_coefficienti <= 10:
+            return False, "Top-k coefficienti deve essere tra 1 e 10"
+        
+        if not 0.5 <= self.percentile_hedge < 1.0:
+            return False, "Percentile hedging deve essere tra 0.5 e 0.99"
+        
+        if not 0.0 <= self.budget_hedge <= 0.5:
+            return False, "Budget hedging deve essere tra 0 e 0.5"
+        
+        if not 0.0 <= self.soglia_escalation <= 1.0:
+            return False, "Soglia escalation deve essere tra 0 e 1"
+        
+        if not 0.0 <= self.similarita_minima_embedding <= 1.0:
+            return False, "Similarità minima embedding deve essere tra 0 e 1"
+        
+        if not 0.0 <= self.margine_minimo_embedding <= 1.0:
+            return False, "Margine minimo embedding deve essere tra 0 e 1"
+        
+        # Validazioni trasporto
+        if self.timeout_seconds <= 0:
+            return False, "Timeout deve essere maggiore di 0"
+        
+        if not 0 <= self.max_retries <= 10:
+            return False, "Max retries deve essere tra 0 e 10"
+        
+        if self.backoff_base_seconds <= 0:
+            return False, "Base del backoff deve essere maggiore di 0"
+        
+        if self.run_deadline_seconds < 0:
+            return False, "Durata massima esecuzione non può essere negativa (0 = nessun limite)"
+        
         # Validazioni AI
         if self.ai_provider not in ['ollama', 'openrouter']:
             return False, "Provider AI deve essere 'ollama' o 'openrouter'"
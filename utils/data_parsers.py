@@ -6,6 +6,7 @@ Funzioni per il parsing e l'elaborazione dei dati
 import re
 import json
 import os
+import unicodedata
 import pandas as pd
 from typing import Dict, List, Any, Tuple
 import os
@@ -151,6 +152,61 @@ def clean_text_data(df: pd.DataFrame, colonna_riferimento: str) -> pd.DataFrame:
     return df_cleaned
 
 
+def normalizza_commento(testo: Any) -> str:
+    """
+    Normalizza un commento per il confronto tra duplicati
+    
+    Applica normalizzazione Unicode (NFKC), minuscole, rimozione della
+    punteggiatura e compattazione degli spazi: "Non saprei." e " non  SAPREI"
+    diventano la stessa chiave. Emoji e simboli restano ("👍" e "👎" sono
+    chiavi diverse); un commento fatto di sola punteggiatura, come le
+    emoticon ":)" e ":(", la conserva.
+    
+    Args:
+        testo: Commento originale
+    
+    Returns:
+        Chiave normalizzata (vuota solo per commenti di soli spazi)
+    """
+    
+    testo = ' '.join(unicodedata.normalize('NFKC', str(testo)).casefold().split())
+    senza_punteggiatura = ' '.join(''.join(
+        ' ' if unicodedata.category(c)[0] == 'P' else c
+        for c in testo
+    ).split())
+    return senza_punteggiatura or testo
+
+
+def raggruppa_duplicati(commenti: Dict[Any, Any]) -> Tuple[Dict[Any, Any], Dict[Any, List[Any]]]:
+    """
+    Raggruppa i commenti identici dopo la normalizzazione
+    
+    I commenti con chiave vuota non vengono mai uniti: ognuno forma un gruppo a sé.
+    
+    Args:
+        commenti: Dizionario indice riga → testo del commento
+    
+    Returns:
+        (rappresentanti: indice → testo del primo commento di ogni gruppo,
+         gruppi: indice rappresentante → tutti gli indici del gruppo)
+    """
+    
+    rappresentanti = {}
+    gruppi = {}
+    indice_per_chiave = {}
+    
+    for idx, testo in commenti.items():
+        chiave = normalizza_commento(testo)
+        if chiave and chiave in indice_per_chiave:
+            gruppi[indice_per_chiave[chiave]].append(idx)
+        else:
+            indice_per_chiave[chiave] = idx
+            rappresentanti[idx] = testo
+            gruppi[idx] = [idx]
+    
+    return rappresentanti, gruppi
+
+
 def extract_sample_data(df: pd.DataFrame, colonna_riferimento: str, n_samples: int = 10) -> List[str]:
     """
     Estrae campioni di dati per anteprima
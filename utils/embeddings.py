@@ -0,0 +1,239 @@
+"""
+🧭 Embeddings Module
+Pre-classificazione dei commenti con gli embedding locali di Ollama (cache su disco)
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from langchain_ollama import OllamaEmbeddings
+
+
+DEFAULT_EMBEDDING_CACHE_PATH = os.path.join('.cache', 'embeddings.sqlite')
+DEFAULT_EMBEDDING_MODEL = 'nomic-embed-text'
+
+# Testi inviati per chiamata all'endpoint degli embedding
+_TESTI_PER_CHIAMATA = 64
+
+
+def chiave_embedding(model: str, testo: str) -> str:
+    """Hash SHA-256 di modello e testo: chiave della cache degli embedding"""
+    return hashlib.sha256(f"{model}\n{testo}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Cache SQLite dei vettori di embedding (float32), indicizzata per hash del testo"""
+    
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('EMBEDDING_CACHE_PATH', DEFAULT_EMBEDDING_CACHE_PATH)
+        self._lock = threading.Lock()
+        
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embedding (chiave TEXT PRIMARY KEY, vettore BLOB NOT NULL)")
+        self._conn.commit()
+    
+    def get_many(self, chiavi: List[str]) -> Dict[str, np.ndarray]:
+        """Vettori in cache per le chiavi indicate (le chiavi assenti non compaiono)"""
+        
+        trovati = {}
+        with self._lock:
+            for inizio in range(0, len(chiavi), 500):
+                parte = chiavi[inizio:inizio + 500]
+                righe = self._conn.execute(
+                    f"SELECT chiave, vettore FROM embedding WHERE chiave IN ({','.join('?' * len(parte))})", parte
+                ).fetchall()
+                for chiave, vettore in righe:
+                    trovati[chiave] = np.frombuffer(vettore, dtype=np.float32)
+        return trovati
+    
+    def set_many(self, vettori: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding (chiave, vettore) VALUES (?, ?)",
+                [(chiave, np.asarray(vettore, dtype=np.float32).tobytes()) for chiave, vettore in vettori.items()]
+            )
+            self._conn.commit()
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class OllamaEmbedder:
+    """Calcola embedding normalizzati con Ollama, ricalcolando solo i testi non in cache"""
+    
+    def __init__(self, model: str = None, base_url: str = None, cache: EmbeddingCache = None, client: Any = None):
+        self.model = model or os.getenv('OLLAMA_EMBED_MODEL', DEFAULT_EMBEDDING_MODEL)
+        self.cache = cache or EmbeddingCache()
+        self.client = client or OllamaEmbeddings(
+            model=self.model,
+            base_url=base_url or os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
+        )
+        self.calcolati = 0
+        self.da_cache = 0
+    
+    def embed(self, testi: List[str]) -> np.ndarray:
+        """
+        Embedding dei testi, normalizzati a norma 1
+        
+        Returns:
+            Matrice (len(testi), dimensione) in float32: il prodotto scalare è la similarità coseno
+        """
+        
+        chiavi = [chiave_embedding(self.model, testo) for testo in testi]
+        vettori = self.cache.get_many(list(set(chiavi)))
+        self.da_cache += sum(1 for chiave in chiavi if chiave in vettori)
+        
+        mancanti = {}
+        for chiave, testo in zip(chiavi, testi):
+            if chiave not in vettori:
+                mancanti[chiave] = testo
+        
+        if mancanti:
+            nuovi = {}
+            elementi = list(mancanti.items())
+            for inizio in range(0, len(elementi), _TESTI_PER_CHIAMATA):
+                parte = elementi[inizio:inizio + _TESTI_PER_CHIAMATA]
+                risposta = self.client.embed_documents([testo for _, testo in parte])
+                for (chiave, _), vettore in zip(parte, risposta):
+                    nuovi[chiave] = np.asarray(vettore, dtype=np.float32)
+            self.cache.set_many(nuovi)
+            vettori.update(nuovi)
+            self.calcolati += len(nuovi)
+        
+        if not testi:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        matrice = np.vstack([vettori[chiave] for chiave in chiavi])
+        norme = np.linalg.norm(matrice, axis=1, keepdims=True)
+        return matrice / np.where(norme == 0, 1.0, norme)
+
+
+def _testi_etichetta(nome: str, info: Dict[str, str]) -> List[str]:
+    """Descrizione ed esempi di un'etichetta, come testi separati da incorporare"""
+    
+    testi = [f"{nome}: {info.get('descrizione', '')}".strip()]
+    esempi = info.get('esempi', '') or ''
+    for esempio in esempi.replace('"', '').replace(';', ',').split(','):
+        if esempio.strip():
+            testi.append(esempio.strip())
+    return testi
+
+
+class PreClassificatoreEmbedding:
+    """
+    Assegna direttamente i commenti chiaramente vicini a una sola etichetta
+    
+    Ogni etichetta è rappresentata dal centroide degli embedding di descrizione
+    ed esempi; un solo prodotto matrice commenti × etichette dà tutte le
+    similarità. Un commento viene assegnato se la similarità migliore supera
+    similarita_minima e stacca la seconda di almeno margine_minimo; gli altri
+    vanno all'etichettatura generativa.
+    
+    Le similarità coseno grezze non sono sulla scala dei coefficienti del
+    modello (con testi dello stesso dominio stanno quasi tutte tra 0.5 e 0.8):
+    i coefficienti salvati sono un softmax sulle etichette del commento, con
+    somma 1, e le secondarie si scelgono su questa scala.
+    """
+    
+    def __init__(self,
+                 embedder: OllamaEmbedder,
+                 similarita_minima: float = 0.6,
+                 margine_minimo: float = 0.1,
+                 temperatura: float = 0.05):
+        """
+        Args:
+            embedder: OllamaEmbedder con cache
+            similarita_minima: Similarità coseno minima dell'etichetta migliore
+            margine_minimo: Distacco minimo in similarità coseno dalla seconda etichetta
+            temperatura: Temperatura del softmax che porta le similarità a coefficienti
+                         (più bassa = coefficienti più concentrati sulla migliore)
+        """
+        self.embedder = embedder
+        self.similarita_minima = similarita_minima
+        self.margine_minimo = margine_minimo
+        self.temperatura = temperatura
+    
+    def coefficienti(self, similarita: np.ndarray) -> np.ndarray:
+        """Softmax per riga delle similarità coseno: coefficienti 0-1 con somma 1 su ogni commento"""
+        
+        esponenziali = np.exp((similarita - similarita.max(axis=1, keepdims=True)) / self.temperatura)
+        return esponenziali / esponenziali.sum(axis=1, keepdims=True)
+    
+    def matrice_etichette(self, etichette_dinamiche: Dict[str, Dict]) -> np.ndarray:
+        """Centroidi normalizzati delle etichette, una riga per etichetta"""
+        
+        testi, proprietari = [], []
+        for posizione, (nome, info) in enumerate(etichette_dinamiche.items()):
+            for testo in _testi_etichetta(nome, info):
+                testi.append(testo)
+                proprietari.append(posizione)
+        
+        vettori = self.embedder.embed(testi)
+        proprietari = np.array(proprietari)
+        centroidi = np.vstack([vettori[proprietari == i].mean(axis=0) for i in range(len(etichette_dinamiche))])
+        return centroidi / np.linalg.norm(centroidi, axis=1, keepdims=True)
+    
+    def classifica(self,
+                   commenti: Dict[Any, str],
+                   etichette_dinamiche: Dict[str, Dict],
+                   soglia_confidenza: float = 0.3) -> Tuple[Dict[Any, Dict[str, Any]], List[Any]]:
+        """
+        Separa i commenti netti da quelli ambigui
+        
+        Args:
+            commenti: Dizionario indice → testo del commento
+            etichette_dinamiche: Etichette da parse_etichette_dinamiche
+            soglia_confidenza: Coefficiente minimo (dopo il softmax) per le etichette secondarie
+        
+        Returns:
+            (risultati per i commenti assegnati, nel formato dell'etichettatura batch;
+             indici dei commenti ambigui)
+        """
+        
+        if not commenti or len(etichette_dinamiche) < 2:
+            return {}, list(commenti)
+        
+        nomi = list(etichette_dinamiche.keys())
+        indici = list(commenti.keys())
+        similarita = self.embedder.embed([str(commenti[idx]) for idx in indici]) @ self.matrice_etichette(etichette_dinamiche).T
+        
+        ordine = np.argsort(-similarita, axis=1)
+        righe = np.arange(len(indici))
+        migliore = similarita[righe, ordine[:, 0]]
+        margine = migliore - similarita[righe, ordine[:, 1]]
+        netti = (migliore >= self.similarita_minima) & (margine >= self.margine_minimo)
+        scalati = self.coefficienti(similarita)
+        
+        assegnati, ambigui = {}, []
+        for riga, idx in enumerate(indici):
+            if not netti[riga]:
+                ambigui.append(idx)
+                continue
+            
+            coefficienti = {nome: round(float(c), 2) for nome, c in zip(nomi, scalati[riga])}
+            principale = nomi[ordine[riga, 0]]
+            secondarie = sorted(
+                ((nome, valore) for nome, valore in coefficienti.items() if nome != principale and valore >= soglia_confidenza),
+                key=lambda coppia: coppia[1], reverse=True
+            )
+            assegnati[idx] = {
+                "principale": principale,
+                "coeff_principale": coefficienti[principale],
+                "secondarie": ", ".join(f"{nome} ({valore:.2f})" for nome, valore in secondarie),
+                "tutti_coefficienti": json.dumps(coefficienti, ensure_ascii=False),
+                "confidenza_generale": coefficienti[principale]
+            }
+        
+        logging.info(f"Pre-classificazione embedding: {len(assegnati)} assegnati, {len(ambigui)} ambigui")
+        return assegnati, ambigui
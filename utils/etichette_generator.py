@@ -0,0 +1,678 @@
+"""
+🗂️ Etichette Generator Module
+Generazione delle etichette dinamiche da un campione rappresentativo (cluster + campionamento)
+"""
+
+import re
+import math
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .ai_clients import estimate_tokens
+    from .batch_processor import calcola_budget_token
+    from .data_parsers import parse_etichette_dinamiche, normalizza_commento
+    from .llm_cache import calcola_chiave_cache, get_cache
+    from .label_store import LabelStore
+except ImportError:
+    from ai_clients import estimate_tokens
+    from batch_processor import calcola_budget_token
+    from data_parsers import parse_etichette_dinamiche, normalizza_commento
+    from llm_cache import calcola_chiave_cache, get_cache
+    from label_store import LabelStore
+
+
+# Vocabolario TF-IDF: parole più frequenti tenute (limita la memoria della matrice densa)
+MAX_VOCABOLARIO = 2000
+MAX_CLUSTER = 30
+
+# Quota del budget di input riservata ai commenti campione (il resto va a istruzioni e template)
+_QUOTA_CAMPIONE = 0.8
+
+_PAROLA = re.compile(r"\w{3,}", re.UNICODE)
+
+
+def vettorizza_tfidf(testi: List[str], max_vocabolario: int = MAX_VOCABOLARIO) -> np.ndarray:
+    """
+    Matrice TF-IDF dei testi, righe normalizzate a norma 1
+    
+    Args:
+        testi: Commenti da vettorizzare
+        max_vocabolario: Numero massimo di parole (le più diffuse tra i documenti)
+    
+    Returns:
+        Matrice (len(testi), vocabolario) in float32
+    """
+    
+    documenti = [_PAROLA.findall(testo.lower()) for testo in testi]
+    frequenza_documenti = Counter(parola for parole in documenti for parola in set(parole))
+    vocabolario = {
+        parola: colonna
+        for colonna, (parola, _) in enumerate(frequenza_documenti.most_common(max_vocabolario))
+    }
+    
+    matrice = np.zeros((len(testi), max(1, len(vocabolario))), dtype=np.float32)
+    for riga, parole in enumerate(documenti):
+        for parola, conteggio in Counter(parole).items():
+            colonna = vocabolario.get(parola)
+            if colonna is not None:
+                matrice[riga, colonna] = conteggio
+    
+    idf = np.ones(matrice.shape[1], dtype=np.float32)
+    for parola, colonna in vocabolario.items():
+        idf[colonna] = math.log((1 + len(testi)) / (1 + frequenza_documenti[parola])) + 1
+    matrice *= idf
+    
+    norme = np.linalg.norm(matrice, axis=1, keepdims=True)
+    return matrice / np.where(norme == 0, 1.0, norme)
+
+
+def kmeans(vettori: np.ndarray, k: int, iterazioni: int = 50, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    K-means sferico (similarità coseno) con inizializzazione k-means++
+    
+    Args:
+        vettori: Matrice con righe normalizzate
+        k: Numero di cluster
+        iterazioni: Iterazioni massime
+        seed: Seme per risultati riproducibili
+    
+    Returns:
+        (cluster di ogni riga, centroidi normalizzati)
+    """
+    
+    generatore = np.random.default_rng(seed)
+    n = len(vettori)
+    k = max(1, min(k, n))
+    
+    # k-means++: ogni nuovo centro è scelto con probabilità proporzionale alla distanza dai precedenti
+    centri = [int(generatore.integers(n))]
+    distanze = np.clip(1.0 - vettori @ vettori[centri[0]], 0.0, None)
+    for _ in range(1, k):
+        if distanze.sum() <= 0:
+            break
+        centri.append(int(generatore.choice(n, p=distanze / distanze.sum())))
+        distanze = np.minimum(distanze, np.clip(1.0 - vettori @ vettori[centri[-1]], 0.0, None))
+    centroidi = vettori[centri].copy()
+    
+    assegnazioni = np.full(n, -1)
+    for _ in range(iterazioni):
+        nuove = np.argmax(vettori @ centroidi.T, axis=1)
+        if np.array_equal(nuove, assegnazioni):
+            break
+        assegnazioni = nuove
+        for cluster in range(len(centroidi)):
+            membri = vettori[assegnazioni == cluster]
+            if len(membri):
+                centroide = membri.sum(axis=0)
+                centroidi[cluster] = centroide / max(np.linalg.norm(centroide), 1e-12)
+    
+    return assegnazioni, centroidi
+
+
+def numero_cluster_default(num_commenti: int) -> int:
+    """Regola empirica √(n/2), tra 2 e MAX_CLUSTER"""
+    return max(2, min(MAX_CLUSTER, int(math.sqrt(num_commenti / 2))))
+
+
+def campiona_rappresentanti(testi: List[str],
+                            assegnazioni: np.ndarray,
+                            vettori: np.ndarray,
+                            centroidi: np.ndarray,
+                            max_token: int,
+                            model: str = None) -> Dict[int, List[str]]:
+    """
+    Sceglie i commenti più vicini al centroide di ogni cluster entro un budget di token
+    
+    I rappresentanti si prendono a turno dai cluster, dal più grande al più
+    piccolo, così anche i temi minoritari compaiono nel campione.
+    
+    Returns:
+        Dizionario cluster → commenti rappresentativi (in ordine di vicinanza al centroide)
+    """
+    
+    ordinati = {}
+    for cluster in range(len(centroidi)):
+        membri = np.where(assegnazioni == cluster)[0]
+        if len(membri):
+            vicinanza = vettori[membri] @ centroidi[cluster]
+            ordinati[cluster] = [int(i) for i in membri[np.argsort(-vicinanza)]]
+    
+    cluster_per_dimensione = sorted(ordinati, key=lambda c: len(ordinati[c]), reverse=True)
+    campione = {cluster: [] for cluster in cluster_per_dimensione}
+    token_usati = 0
+    
+    for turno in range(max(len(membri) for membri in ordinati.values())):
+        aggiunti = 0
+        for cluster in cluster_per_dimensione:
+            if turno >= len(ordinati[cluster]):
+                continue
+            testo = testi[ordinati[cluster][turno]]
+            token = estimate_tokens(testo, model) + 2
+            if token_usati + token > max_token:
+                continue
+            campione[cluster].append(testo)
+            token_usati += token
+            aggiunti += 1
+        if not aggiunti:
+            break
+    
+    return {cluster: commenti for cluster, commenti in campione.items() if commenti}
+
+
+def crea_prompt_etichette_campione(campione: Dict[int, List[str]],
+                                   dimensioni: Dict[int, int],
+                                   totale_commenti: int,
+                                   prompt_personalizzato: str,
+                                   max_etichette: int = 25) -> str:
+    """Prompt di generazione etichette con i commenti raggruppati per cluster e il peso di ogni gruppo"""
+    
+    gruppi = []
+    for numero, (cluster, commenti) in enumerate(campione.items(), 1):
+        quota = dimensioni[cluster] / totale_commenti * 100
+        righe = "\n".join(f"- {commento}" for commento in commenti)
+        gruppi.append(f"GRUPPO {numero} ({dimensioni[cluster]} commenti, {quota:.0f}% del totale):\n{righe}")
+    
+    return f"""Analizza il seguente campione rappresentativo di {totale_commenti} commenti (il contesto è nel TEMPLATE ANALISI).
+I commenti sono stati raggruppati per somiglianza: per ogni gruppo sono riportati i commenti più tipici e la sua dimensione reale.
+
+OBIETTIVO: Genera un dizionario completo di etichette dinamiche basate sui contenuti REALI di questi commenti.
+
+ISTRUZIONI:
+1. Leggi tutti i gruppi per identificare temi, pattern e concetti ricorrenti
+2. Crea etichette specifiche e pertinenti al contenuto effettivo
+3. Ogni etichetta deve rappresentare un concetto distintivo presente nei dati
+4. Fornisci una descrizione dettagliata per ogni etichetta
+5. Includi anche etichette per concetti minoritari ma significativi (gruppi piccoli)
+
+FORMATO RICHIESTO:
+Per ogni etichetta, scrivi:
+ETICHETTA: [nome_breve]
+DESCRIZIONE: [spiegazione dettagliata di cosa rappresenta]
+ESEMPI: [parole chiave o frasi tipiche]
+---
+
+TEMPLATE ANALISI:
+{prompt_personalizzato}
+
+CAMPIONE DA ANALIZZARE:
+{chr(10).join(gruppi)}
+
+Genera massimo {max_etichette} etichette dinamiche basate sui contenuti reali."""
+
+
+def _invoca_generazione(llm: Any, ai_provider: str, tipo_analisi: str, prompt: str) -> str:
+    """Invia un prompt di generazione etichette (stringa per Ollama, messaggi chat per OpenRouter)"""
+    
+    if ai_provider.lower() == 'ollama':
+        return llm.invoke(prompt)
+    
+    messages = [
+        {"role": "system", "content": f"Sei un esperto analista che genera etichette dinamiche per {tipo_analisi} di progetti educativi."},
+        {"role": "user", "content": prompt}
+    ]
+    return llm.invoke(messages)
+
+
+def genera_etichette_da_campione(df: pd.DataFrame,
+                                 colonna_riferimento: str,
+                                 prompt_personalizzato: str,
+                                 tipo_analisi: str,
+                                 llm: Any,
+                                 ai_provider: str,
+                                 num_cluster: int = None,
+                                 max_token_campione: int = None,
+                                 embedder: Any = None,
+                                 max_etichette: int = 25) -> Dict[str, Any]:
+    """
+    Genera le etichette dinamiche da un campione rappresentativo invece che dall'intera colonna
+    
+    I commenti unici vengono raggruppati con k-means (su TF-IDF o, se indicato,
+    sugli embedding di Ollama); dai cluster si prendono i commenti più tipici
+    fino al budget di token e il modello genera le etichette da quelli. La
+    risposta è nel formato ETICHETTA:/DESCRIZIONE:/ESEMPI: letto da
+    parse_etichette_dinamiche.
+    
+    Args:
+        df: DataFrame con i dati
+        colonna_riferimento: Colonna da analizzare
+        prompt_personalizzato: Template di analisi
+        tipo_analisi: Tipo di analisi da eseguire
+        llm: Modello di linguaggio
+        ai_provider: 'ollama' o 'openrouter'
+        num_cluster: Numero di cluster (default: √(n/2), massimo MAX_CLUSTER)
+        max_token_campione: Token massimi per i commenti campione (default: dal contesto del modello)
+        embedder: OllamaEmbedder da usare al posto di TF-IDF (opzionale, vedi embeddings)
+        max_etichette: Numero massimo di etichette richieste
+    
+    Returns:
+        Dizionario con etichette_dinamiche, statistiche_colonna, analisi_completa
+        e statistiche_campionamento
+    """
+    
+    commenti_validi = df[colonna_riferimento].dropna().astype(str).tolist()
+    if not commenti_validi:
+        raise ValueError("❌ Nessun commento valido trovato nella colonna")
+    
+    testi = list(dict.fromkeys(c.strip() for c in commenti_validi if c.strip()))
+    # Colonna di soli spazi o stringhe vuote: niente da raggruppare
+    if not testi:
+        raise ValueError("❌ Nessun commento valido trovato nella colonna")
+    modello = getattr(llm, 'model', None)
+    
+    if max_token_campione is None:
+        max_token_input, _ = calcola_budget_token(modello, ai_provider)
+        max_token_campione = int(max_token_input * _QUOTA_CAMPIONE)
+    
+    vettori = embedder.embed(testi) if embedder is not None else vettorizza_tfidf(testi)
+    assegnazioni, centroidi = kmeans(vettori, num_cluster or numero_cluster_default(len(testi)))
+    
+    # Le dimensioni dei cluster contano anche i duplicati: pesano quanto nella colonna
+    frequenze = Counter(c.strip() for c in commenti_validi)
+    dimensioni = Counter()
+    for testo, cluster in zip(testi, assegnazioni):
+        dimensioni[int(cluster)] += frequenze[testo]
+    
+    campione = campiona_rappresentanti(testi, assegnazioni, vettori, centroidi, max_token_campione, modello)
+    commenti_campione = sum(len(commenti) for commenti in campione.values())
+    print(f"🗂️ Campionamento: {len(testi)} commenti unici in {len(campione)} cluster, "
+          f"{commenti_campione} rappresentanti nel prompt")
+    
+    prompt_etichette = crea_prompt_etichette_campione(
+        campione, dimensioni, len(commenti_validi), prompt_personalizzato, max_etichette
+    )
+    
+    risposta_etichette = _invoca_generazione(llm, ai_provider, tipo_analisi, prompt_etichette)
+    etichette_dinamiche = parse_etichette_dinamiche(str(risposta_etichette))
+    logging.info(f"Etichette da campione: {len(etichette_dinamiche)} etichette da {commenti_campione} rappresentanti")
+    
+    return {
+        "etichette_dinamiche": etichette_dinamiche,
+        "statistiche_colonna": {
+            "totale_commenti": len(commenti_validi),
+            "lunghezza_media": sum(len(c) for c in commenti_validi) / len(commenti_validi),
+            "commenti_vuoti": len(df) - len(commenti_validi)
+        },
+        "analisi_completa": risposta_etichette,
+        "statistiche_campionamento": {
+            "commenti_unici": len(testi),
+            "cluster": len(campione),
+            "commenti_campione": commenti_campione,
+            "token_campione_stimati": sum(estimate_tokens(c, modello) + 2 for cs in campione.values() for c in cs)
+        }
+    }
+
+
+def dividi_in_chunk(testi: List[str], max_token: int, model: str = None) -> List[List[str]]:
+    """Divide i commenti in blocchi consecutivi che restano entro max_token ciascuno"""
+    
+    chunk, corrente, token_correnti = [], [], 0
+    for testo in testi:
+        token = estimate_tokens(testo, model) + 2
+        if corrente and token_correnti + token > max_token:
+            chunk.append(corrente)
+            corrente, token_correnti = [], 0
+        corrente.append(testo)
+        token_correnti += token
+    if corrente:
+        chunk.append(corrente)
+    return chunk
+
+
+def crea_prompt_etichette_chunk(commenti: List[str],
+                                prompt_personalizzato: str,
+                                max_candidate: int) -> str:
+    """Prompt della fase map: etichette candidate per un solo blocco di commenti"""
+    
+    elenco = "\n".join(f"- {commento}" for commento in commenti)
+    
+    return f"""Analizza questo blocco di {len(commenti)} commenti, parte di una raccolta più ampia di un progetto scolastico.
+
+OBIETTIVO: Proponi etichette candidate per i temi presenti in QUESTO blocco; verranno poi unite a quelle degli altri blocchi.
+
+FORMATO RICHIESTO:
+Per ogni etichetta, scrivi:
+ETICHETTA: [nome_breve]
+DESCRIZIONE: [spiegazione dettagliata di cosa rappresenta]
+ESEMPI: [parole chiave o frasi tipiche]
+---
+
+TEMPLATE ANALISI:
+{prompt_personalizzato}
+
+COMMENTI DEL BLOCCO:
+{elenco}
+
+Genera massimo {max_candidate} etichette candidate."""
+
+
+def unisci_candidate(liste: List[Dict[str, Dict[str, str]]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Unisce le etichette candidate dei vari blocchi, collassando i nomi uguali dopo normalizzazione
+    
+    Returns:
+        Dizionario nome → {descrizione, esempi, blocchi}, dove blocchi conta in quanti blocchi è comparsa
+    """
+    
+    unite: Dict[str, Dict[str, Any]] = {}
+    nomi: Dict[str, str] = {}
+    for etichette in liste:
+        for nome, info in etichette.items():
+            chiave = normalizza_commento(nome).replace(' ', '_')
+            if chiave not in nomi:
+                nomi[chiave] = nome
+                unite[nome] = {"descrizione": info.get('descrizione', ''), "esempi": info.get('esempi', ''), "blocchi": 0}
+            voce = unite[nomi[chiave]]
+            voce["blocchi"] += 1
+            if len(info.get('descrizione', '')) > len(voce["descrizione"]):
+                voce["descrizione"] = info['descrizione']
+            if info.get('esempi') and info['esempi'] not in voce["esempi"]:
+                voce["esempi"] = f"{voce['esempi']}, {info['esempi']}".strip(', ')
+    return unite
+
+
+def crea_prompt_riduzione(candidate: Dict[str, Dict[str, Any]],
+                          totale_blocchi: int,
+                          prompt_personalizzato: str,
+                          max_etichette: int) -> str:
+    """Prompt della fase reduce: unione di candidate simili nel set finale"""
+    
+    elenco = "\n".join(
+        f"- {nome} (in {info['blocchi']}/{totale_blocchi} blocchi): {info['descrizione']} | Esempi: {info['esempi']}"
+        for nome, info in sorted(candidate.items(), key=lambda voce: voce[1]["blocchi"], reverse=True)
+    )
+    
+    return f"""Queste sono le etichette candidate proposte analizzando separatamente {totale_blocchi} blocchi di commenti.
+
+OBIETTIVO: Produci il set finale di etichette dinamiche.
+
+ISTRUZIONI:
+1. Unisci le candidate che indicano lo stesso concetto (sinonimi, varianti, sovrapposizioni)
+2. Privilegia i temi presenti in più blocchi, ma mantieni i concetti minoritari significativi
+3. Ogni etichetta finale deve rappresentare un concetto distintivo
+4. Fornisci una descrizione dettagliata ed esempi per ogni etichetta
+
+FORMATO RICHIESTO:
+Per ogni etichetta, scrivi:
+ETICHETTA: [nome_breve]
+DESCRIZIONE: [spiegazione dettagliata di cosa rappresenta]
+ESEMPI: [parole chiave o frasi tipiche]
+---
+
+TEMPLATE ANALISI:
+{prompt_personalizzato}
+
+ETICHETTE CANDIDATE:
+{elenco}
+
+Genera massimo {max_etichette} etichette finali."""
+
+
+def genera_etichette_map_reduce(df: pd.DataFrame,
+                                colonna_riferimento: str,
+                                prompt_personalizzato: str,
+                                tipo_analisi: str,
+                                llm: Any,
+                                ai_provider: str,
+                                max_etichette: int = 20,
+                                max_token_chunk: int = None,
+                                max_workers: int = None,
+                                cache: Any = None) -> Dict[str, Any]:
+    """
+    Genera le etichette dinamiche con una pipeline map-reduce sull'intera colonna
+    
+    Map: la colonna viene divisa in blocchi entro il budget di token e ogni
+    blocco produce etichette candidate, in parallelo (con un pool di endpoint
+    i blocchi si distribuiscono sui server). Reduce: le candidate vengono unite
+    e deduplicate, a più livelli se non entrano in un solo prompt, fino al set
+    finale di al massimo max_etichette. Le risposte di ogni blocco restano
+    nella cache delle risposte LLM: un'esecuzione interrotta riparte dai
+    blocchi mancanti.
+    
+    Args:
+        df: DataFrame con i dati
+        colonna_riferimento: Colonna da analizzare
+        prompt_personalizzato: Template di analisi
+        tipo_analisi: Tipo di analisi da eseguire
+        llm: Modello di linguaggio (client singolo o LLMPool)
+        ai_provider: 'ollama' o 'openrouter'
+        max_etichette: Numero massimo di etichette finali (max_etichette_dinamiche)
+        max_token_chunk: Token massimi di commenti per blocco (default: dal contesto del modello)
+        max_workers: Blocchi elaborati in parallelo (default: capacità del pool, altrimenti 4)
+        cache: LLMResponseCache per le risposte dei blocchi (default: cache condivisa)
+    
+    Returns:
+        Dizionario con etichette_dinamiche, statistiche_colonna, analisi_completa
+        e statistiche_map_reduce
+    """
+    
+    commenti_validi = df[colonna_riferimento].dropna().astype(str).tolist()
+    if not commenti_validi:
+        raise ValueError("❌ Nessun commento valido trovato nella colonna")
+    
+    testi = list(dict.fromkeys(c.strip() for c in commenti_validi if c.strip()))
+    # Colonna di soli spazi o stringhe vuote: niente da raggruppare
+    if not testi:
+        raise ValueError("❌ Nessun commento valido trovato nella colonna")
+    modello = getattr(llm, 'model', None)
+    temperatura = getattr(llm, 'temperature', None)
+    cache = cache or get_cache()
+    max_workers = max_workers or getattr(llm, 'capacita_totale', 4)
+    
+    max_token_input, _ = calcola_budget_token(modello, ai_provider)
+    max_token_chunk = max_token_chunk or int(max_token_input * _QUOTA_CAMPIONE)
+    
+    chiamate = {"da_cache": 0, "eseguite": 0}
+    lock = threading.Lock()
+    
+    def genera(prompt: str) -> str:
+        # Ogni blocco è indipendente: la sua risposta in cache sopravvive a un'interruzione
+        chiave = calcola_chiave_cache(ai_provider, modello, temperatura, prompt, fase='etichette_map_reduce')
+        risposta = cache.get(chiave)
+        if risposta is not None:
+            with lock:
+                chiamate["da_cache"] += 1
+            return risposta
+        risposta = str(_invoca_generazione(llm, ai_provider, tipo_analisi, prompt))
+        cache.set(chiave, risposta)
+        with lock:
+            chiamate["eseguite"] += 1
+        return risposta
+    
+    # Map: etichette candidate per blocco
+    blocchi = dividi_in_chunk(testi, max_token_chunk, modello)
+    print(f"🗺️ Map: {len(testi)} commenti unici in {len(blocchi)} blocchi, {max_workers} in parallelo")
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(blocchi)))) as executor:
+        risposte = list(executor.map(
+            lambda blocco: genera(crea_prompt_etichette_chunk(blocco, prompt_personalizzato, max_etichette)), blocchi
+        ))
+    candidate = unisci_candidate([parse_etichette_dinamiche(risposta) for risposta in risposte])
+    totale_blocchi = len(blocchi)
+    
+    # Reduce: a più livelli finché le candidate non entrano in un solo prompt
+    livelli = 0
+    while True:
+        livelli += 1
+        prompt_finale = crea_prompt_riduzione(candidate, totale_blocchi, prompt_personalizzato, max_etichette)
+        if estimate_tokens(prompt_finale, modello) <= max_token_input or len(candidate) <= max_etichette:
+            break
+        
+        nomi = list(candidate)
+        gruppi = max(2, math.ceil(estimate_tokens(prompt_finale, modello) / max_token_chunk))
+        parti = [{nome: candidate[nome] for nome in nomi[i::gruppi]} for i in range(gruppi)]
+        print(f"🔁 Reduce livello {livelli}: {len(candidate)} candidate in {gruppi} gruppi")
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, gruppi))) as executor:
+            risposte_parziali = list(executor.map(
+                lambda parte: genera(crea_prompt_riduzione(parte, totale_blocchi, prompt_personalizzato, max_etichette)),
+                parti
+            ))
+        ridotte = unisci_candidate([parse_etichette_dinamiche(risposta) for risposta in risposte_parziali])
+        if len(ridotte) >= len(candidate):
+            break
+        candidate = ridotte
+    
+    risposta_etichette = genera(prompt_finale)
+    etichette_dinamiche = dict(list(parse_etichette_dinamiche(risposta_etichette).items())[:max_etichette])
+    
+    print(f"🧩 Reduce: {len(candidate)} candidate → {len(etichette_dinamiche)} etichette finali")
+    logging.info(f"Etichette map-reduce: {len(blocchi)} blocchi, {chiamate['eseguite']} chiamate, "
+                 f"{chiamate['da_cache']} risposte dalla cache")
+    
+    return {
+        "etichette_dinamiche": etichette_dinamiche,
+        "statistiche_colonna": {
+            "totale_commenti": len(commenti_validi),
+            "lunghezza_media": sum(len(c) for c in commenti_validi) / len(commenti_validi),
+            "commenti_vuoti": len(df) - len(commenti_validi)
+        },
+        "analisi_completa": risposta_etichette,
+        "statistiche_map_reduce": {
+            "blocchi": len(blocchi),
+            "etichette_candidate": len(candidate),
+            "livelli_reduce": livelli,
+            "chiamate_eseguite": chiamate["eseguite"],
+            "risposte_da_cache": chiamate["da_cache"]
+        }
+    }
+
+
+def crea_prompt_estensione(etichette_esistenti: Dict[str, Dict],
+                           commenti_nuovi: List[str],
+                           prompt_personalizzato: str,
+                           max_nuove: int) -> str:
+    """Prompt di warm start: etichette già note più i soli commenti nuovi"""
+    
+    elenco_etichette = "\n".join(
+        f"- {nome}: {info.get('descrizione', '')}" for nome, info in etichette_esistenti.items()
+    )
+    elenco_commenti = "\n".join(f"- {commento}" for commento in commenti_nuovi)
+    
+    return f"""Per questa raccolta di commenti esiste già un dizionario di etichette. Sono arrivati {len(commenti_nuovi)} commenti nuovi.
+
+ETICHETTE ESISTENTI:
+{elenco_etichette}
+
+OBIETTIVO: Proponi SOLO le etichette necessarie per concetti dei commenti nuovi che nessuna etichetta esistente copre.
+Se le etichette esistenti bastano, non scrivere nessuna etichetta.
+
+FORMATO RICHIESTO:
+Per ogni etichetta nuova, scrivi:
+ETICHETTA: [nome_breve]
+DESCRIZIONE: [spiegazione dettagliata di cosa rappresenta]
+ESEMPI: [parole chiave o frasi tipiche]
+---
+
+TEMPLATE ANALISI:
+{prompt_personalizzato}
+
+COMMENTI NUOVI:
+{elenco_commenti}
+
+Genera massimo {max_nuove} etichette nuove."""
+
+
+def genera_etichette_con_archivio(df: pd.DataFrame,
+                                  colonna_riferimento: str,
+                                  prompt_personalizzato: str,
+                                  tipo_analisi: str,
+                                  llm: Any,
+                                  ai_provider: str,
+                                  store: LabelStore = None,
+                                  max_etichette: int = 25,
+                                  genera=None,
+                                  max_token_chunk: int = None,
+                                  **opzioni) -> Dict[str, Any]:
+    """
+    Riusa le etichette dinamiche salvate per gli stessi dati e lo stesso prompt
+    
+    Con un'impronta identica le etichette vengono ricaricate dall'archivio
+    senza chiamare il modello. Se la colonna è solo cresciuta di poco si parte
+    dalle etichette della voce più vicina e il modello vede solo i commenti
+    nuovi, a blocchi che entrano nel contesto: ogni blocco vede anche le
+    etichette aggiunte dai precedenti. Altrimenti le etichette vengono
+    generate da zero con genera.
+    
+    Args:
+        df, colonna_riferimento, prompt_personalizzato, tipo_analisi, llm, ai_provider:
+            Come in genera_etichette_da_campione
+        store: Archivio delle etichette (default: LabelStore())
+        max_etichette: Numero massimo di etichette
+        genera: Funzione di generazione completa (default: genera_etichette_da_campione)
+        max_token_chunk: Token massimi dei commenti nuovi per chiamata (default: dal contesto del modello)
+        **opzioni: Parametri aggiuntivi per genera
+    
+    Returns:
+        Dizionario come genera_etichette_da_campione, con 'origine_etichette'
+        ('archivio', 'warm_start' o 'generate')
+    """
+    
+    store = store or LabelStore()
+    genera = genera or genera_etichette_da_campione
+    commenti_validi = df[colonna_riferimento].dropna().astype(str).tolist()
+    statistiche_colonna = {
+        "totale_commenti": len(commenti_validi),
+        "lunghezza_media": sum(len(c) for c in commenti_validi) / len(commenti_validi) if commenti_validi else 0,
+        "commenti_vuoti": len(df) - len(commenti_validi)
+    }
+    
+    trovata = store.cerca(commenti_validi, prompt_personalizzato, tipo_analisi)
+    
+    if trovata and trovata["corrispondenza"] == "esatta":
+        print(f"🗃️ Etichette riutilizzate dall'archivio: {len(trovata['etichette_dinamiche'])} ({trovata['path']})")
+        return {
+            "etichette_dinamiche": trovata["etichette_dinamiche"],
+            "statistiche_colonna": statistiche_colonna,
+            "analisi_completa": "",
+            "origine_etichette": "archivio"
+        }
+    
+    if trovata:
+        etichette = dict(trovata["etichette_dinamiche"])
+        commenti_nuovi = trovata["commenti_nuovi"]
+        print(f"🗃️ Warm start dall'archivio: {len(etichette)} etichette, {len(commenti_nuovi)} commenti nuovi")
+        
+        risposte = []
+        if commenti_nuovi:
+            modello = getattr(llm, 'model', None)
+            if max_token_chunk is None:
+                max_token_input, _ = calcola_budget_token(modello, ai_provider)
+                max_token_chunk = int(max_token_input * _QUOTA_CAMPIONE)
+            
+            # Tutti i commenti nuovi passano dal modello, un blocco per chiamata
+            chunk = dividi_in_chunk(commenti_nuovi, max_token_chunk, modello)
+            for numero, blocco in enumerate(chunk):
+                posti_liberi = max_etichette - len(etichette)
+                if posti_liberi <= 0:
+                    esclusi = sum(len(b) for b in chunk[numero:])
+                    logging.warning(f"Warm start: limite di {max_etichette} etichette raggiunto, "
+                                    f"{esclusi} commenti nuovi non esaminati")
+                    break
+                risposta = str(_invoca_generazione(
+                    llm, ai_provider, tipo_analisi,
+                    crea_prompt_estensione(etichette, blocco, prompt_personalizzato, posti_liberi)
+                ))
+                risposte.append(risposta)
+                for nome, info in list(parse_etichette_dinamiche(risposta).items())[:posti_liberi]:
+                    etichette.setdefault(nome, info)
+        
+        risultato = {
+            "etichette_dinamiche": etichette,
+            "statistiche_colonna": statistiche_colonna,
+            "analisi_completa": "\n".join(risposte),
+            "origine_etichette": "warm_start"
+        }
+    else:
+        risultato = genera(df, colonna_riferimento, prompt_personalizzato, tipo_analisi, llm, ai_provider,
+                           max_etichette=max_etichette, **opzioni)
+        risultato["origine_etichette"] = "generate"
+    
+    if risultato["etichette_dinamiche"]:
+        store.salva(commenti_validi, prompt_personalizzato, tipo_analisi, risultato["etichette_dinamiche"])
+    return risultato
@@ -0,0 +1,130 @@
+"""
+🪁 Hedging Module
+Richieste duplicate per i batch più lenti del percentile di latenza osservato
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Optional
+
+
+# Latenze considerate per il percentile e campioni minimi prima di attivare l'hedging
+_FINESTRA_LATENZE = 200
+_MIN_CAMPIONI = 10
+
+
+class HedgeController:
+    """
+    Decide quando duplicare una chiamata lenta e tiene il conto del budget
+    
+    Una chiamata che supera il percentile mobile della latenza (es. p95) viene
+    duplicata con la funzione secondaria (altro endpoint o provider): vince la
+    prima risposta valida. Le chiamate HTTP sincrone non si possono
+    interrompere: la perdente viene annullata se non è ancora partita,
+    altrimenti la sua risposta viene scartata. I duplicati non superano
+    budget × chiamate totali.
+    """
+    
+    def __init__(self, percentile: float = 0.95, budget: float = 0.05, max_thread: int = 8):
+        self.percentile = percentile
+        self.budget = budget
+        self._latenze = deque(maxlen=_FINESTRA_LATENZE)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_thread, thread_name_prefix='hedge')
+        
+        self.chiamate = 0
+        self.duplicati = 0
+        self.vinti_dal_duplicato = 0
+    
+    def soglia(self) -> Optional[float]:
+        """Latenza oltre la quale si duplica la chiamata (None finché i campioni sono pochi)"""
+        
+        with self._lock:
+            if len(self._latenze) < _MIN_CAMPIONI:
+                return None
+            ordinate = sorted(self._latenze)
+        return ordinate[min(len(ordinate) - 1, int(self.percentile * len(ordinate)))]
+    
+    def _registra(self, secondi: float) -> None:
+        with self._lock:
+            self._latenze.append(secondi)
+    
+    def _prenota_duplicato(self) -> bool:
+        with self._lock:
+            if self.duplicati + 1 > self.budget * self.chiamate:
+                return False
+            self.duplicati += 1
+            return True
+    
+    def esegui(self,
+               primaria: Callable[[], Any],
+               secondaria: Callable[[], Any],
+               valida: Callable[[Any], bool] = None) -> Any:
+        """
+        Esegue primaria, duplicandola con secondaria se supera la soglia
+        
+        Args:
+            primaria: Chiamata originale
+            secondaria: Chiamata duplicata (stessa richiesta su un altro endpoint o provider)
+            valida: Verifica del risultato; uno non valido non vince e si attende l'altro
+        
+        Returns:
+            Il primo risultato valido, o quello della primaria se nessuno lo è
+        """
+        
+        valida = valida or (lambda risultato: True)
+        with self._lock:
+            self.chiamate += 1
+        
+        inizio = time.monotonic()
+        soglia = self.soglia()
+        if soglia is None:
+            risultato = primaria()
+            self._registra(time.monotonic() - inizio)
+            return risultato
+        
+        future_primaria = self._executor.submit(primaria)
+        wait([future_primaria], timeout=soglia)
+        
+        if future_primaria.done() or not self._prenota_duplicato():
+            risultato = future_primaria.result()
+            self._registra(time.monotonic() - inizio)
+            return risultato
+        
+        logging.info(f"Hedging: chiamata oltre {soglia:.1f}s (p{self.percentile * 100:.0f}), invio un duplicato")
+        future_duplicato = self._executor.submit(secondaria)
+        in_corso = {future_primaria, future_duplicato}
+        
+        while in_corso:
+            completati, in_corso = wait(in_corso, return_when=FIRST_COMPLETED)
+            for future in completati:
+                if future.exception() is None and valida(future.result()):
+                    for perdente in in_corso:
+                        perdente.cancel()
+                    if future is future_duplicato:
+                        with self._lock:
+                            self.vinti_dal_duplicato += 1
+                    self._registra(time.monotonic() - inizio)
+                    return future.result()
+        
+        # Nessuna risposta valida: vale l'esito della chiamata originale
+        self._registra(time.monotonic() - inizio)
+        return future_primaria.result()
+    
+    def chiudi(self) -> None:
+        """Libera i thread senza attendere le chiamate perdenti ancora in corso"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Chiamate totali, duplicati inviati e duplicati vincenti"""
+        
+        soglia = self.soglia()
+        return {
+            "chiamate": self.chiamate,
+            "duplicati": self.duplicati,
+            "vinti_dal_duplicato": self.vinti_dal_duplicato,
+            "soglia_secondi": round(soglia, 2) if soglia is not None else None
+        }
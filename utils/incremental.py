@@ -0,0 +1,202 @@
+"""
+🔁 Incremental Module
+Etichettatura delle sole righe nuove o modificate di un export che cresce nel tempo
+"""
+
+import os
+import glob
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+try:
+    from .batch_processor import etichetta_con_coefficiente_batch, _assegna_risultato, _da_riparare, _statistiche_confidenza
+    from .data_parsers import normalizza_commento
+except ImportError:
+    from batch_processor import etichetta_con_coefficiente_batch, _assegna_risultato, _da_riparare, _statistiche_confidenza
+    from data_parsers import normalizza_commento
+
+
+# Colonne del report avanzato → chiavi del risultato per commento
+COLONNE_REPORT = {
+    'Etichetta_Principale': 'principale',
+    'Coefficiente_Principale': 'coeff_principale',
+    'Etichette_Secondarie': 'secondarie',
+    'Confidenza_Generale': 'confidenza_generale',
+    'Coefficienti_Completi': 'tutti_coefficienti'
+}
+
+
+def hash_commento(testo: Any) -> str:
+    """Hash del testo normalizzato di un commento: cambia solo se cambia il contenuto"""
+    return hashlib.sha256(normalizza_commento(testo).encode('utf-8')).hexdigest()
+
+
+def trova_report_precedente(base_path: str, tipo_analisi: str) -> Optional[str]:
+    """
+    Cerca il report avanzato più recente per il tipo di analisi
+    
+    Args:
+        base_path: Cartella che contiene le cartelle di output delle esecuzioni
+        tipo_analisi: Tipo di analisi (suffisso di report_avanzato_<tipo>.xlsx)
+    
+    Returns:
+        Percorso del report più recente o None
+    """
+    
+    report = glob.glob(os.path.join(base_path, '*', f'report_avanzato_{tipo_analisi}.xlsx'))
+    return max(report, key=os.path.getmtime) if report else None
+
+
+def carica_risultati_precedenti(report_path: str, colonna_riferimento: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Legge un report_avanzato_<tipo>.xlsx come archivio hash del commento → risultato
+    
+    Le righe vuote, in errore o non parsate non vengono riutilizzate.
+    
+    Returns:
+        Dizionario hash → risultato per commento
+    """
+    
+    df_report = pd.read_excel(report_path)
+    mancanti = [c for c in [colonna_riferimento, *COLONNE_REPORT] if c not in df_report.columns]
+    if mancanti:
+        raise ValueError(f"❌ Report precedente senza le colonne: {', '.join(mancanti)}")
+    
+    precedenti = {}
+    for _, riga in df_report.iterrows():
+        if pd.isna(riga[colonna_riferimento]):
+            continue
+        risultato = {
+            chiave: ("" if pd.isna(riga[colonna]) else riga[colonna])
+            for colonna, chiave in COLONNE_REPORT.items()
+        }
+        risultato["coeff_principale"] = float(risultato["coeff_principale"] or 0.0)
+        risultato["confidenza_generale"] = float(risultato["confidenza_generale"] or 0.0)
+        risultato["tutti_coefficienti"] = str(risultato["tutti_coefficienti"] or "{}")
+        if risultato["principale"] == "Vuota" or _da_riparare(risultato):
+            continue
+        precedenti[hash_commento(riga[colonna_riferimento])] = risultato
+    
+    return precedenti
+
+
+def etichetta_incrementale(df: pd.DataFrame,
+                           etichette_dinamiche: Dict[str, Dict],
+                           colonna_riferimento: str,
+                           tipo_analisi: str,
+                           llm: Any,
+                           ai_provider: str,
+                           report_precedente: str = None,
+                           risultati_precedenti: Dict[str, Dict[str, Any]] = None,
+                           **opzioni) -> Dict[str, Any]:
+    """
+    Etichetta solo le righe nuove o modificate rispetto a un'esecuzione precedente
+    
+    Le righe il cui commento (normalizzato) compare già nel report precedente
+    mantengono etichette, coefficienti e confidenza di allora; solo le altre
+    vanno al modello. Il costo di un aggiornamento è proporzionale alle
+    risposte nuove, non al totale.
+    
+    Args:
+        df, etichette_dinamiche, colonna_riferimento, tipo_analisi, llm, ai_provider:
+            Come in etichetta_con_coefficiente_batch
+        report_precedente: Percorso di report_avanzato_<tipo>.xlsx (opzionale)
+        risultati_precedenti: Archivio hash → risultato già caricato (alternativa al report)
+        **opzioni: Altri parametri di etichetta_con_coefficiente_batch
+    
+    Returns:
+        Risultati come etichetta_con_coefficiente_batch, più "statistiche_incrementali"
+    """
+    
+    precedenti = dict(risultati_precedenti or {})
+    if report_precedente:
+        precedenti.update(carica_risultati_precedenti(report_precedente, colonna_riferimento))
+    
+    # Le etichette di allora devono esistere ancora, altrimenti il report mescola due dizionari
+    etichette_sparite = {r["principale"] for r in precedenti.values()} - set(etichette_dinamiche) - {"Incerto"}
+    if etichette_sparite:
+        logging.warning(f"Etichettatura incrementale: etichette del report precedente non più nel dizionario: "
+                        f"{', '.join(sorted(etichette_sparite))}")
+    
+    riutilizzate, da_etichettare = {}, []
+    for idx in df.index:
+        commento = df.loc[idx, colonna_riferimento]
+        if pd.isna(commento):
+            continue
+        risultato = precedenti.get(hash_commento(commento))
+        if risultato is not None:
+            riutilizzate[idx] = risultato
+        else:
+            da_etichettare.append(idx)
+    
+    print(f"🔁 Etichettatura incrementale: {len(riutilizzate)} righe già etichettate, "
+          f"{len(da_etichettare)} nuove o modificate")
+    
+    df_nuove = df.loc[da_etichettare].reset_index(drop=True)
+    if da_etichettare:
+        risultati_nuovi = etichetta_con_coefficiente_batch(
+            df_nuove, etichette_dinamiche, colonna_riferimento, tipo_analisi, llm, ai_provider, **opzioni
+        )
+    else:
+        risultati_nuovi = {}
+    
+    risultati = {
+        "etichette_principali": [None] * len(df),
+        "coefficienti_principali": [None] * len(df),
+        "etichette_secondarie": [None] * len(df),
+        "coefficienti_completi": [None] * len(df),
+        "confidenza_media": [None] * len(df)
+    }
+    vuota = {"principale": "Vuota", "coeff_principale": 0.0, "secondarie": "",
+             "tutti_coefficienti": "{}", "confidenza_generale": 0.0}
+    
+    posizioni_nuove = {idx: posizione for posizione, idx in enumerate(da_etichettare)}
+    for riga, idx in enumerate(df.index):
+        if idx in riutilizzate:
+            _assegna_risultato(risultati, riga, riutilizzate[idx])
+        elif idx in posizioni_nuove:
+            posizione = posizioni_nuove[idx]
+            for chiave in risultati:
+                risultati[chiave][riga] = risultati_nuovi[chiave][posizione]
+        else:
+            _assegna_risultato(risultati, riga, vuota)
+    
+    for chiave, valore in risultati_nuovi.items():
+        if chiave.startswith("statistiche_") and chiave != "statistiche_confidenza":
+            risultati[chiave] = valore
+    risultati["statistiche_confidenza"] = _statistiche_confidenza(risultati["coefficienti_principali"])
+    risultati["statistiche_incrementali"] = {
+        "righe_riutilizzate": len(riutilizzate),
+        "righe_etichettate": len(da_etichettare)
+    }
+    
+    return risultati
+
+
+def salva_report_incrementale(df: pd.DataFrame,
+                              risultati: Dict[str, Any],
+                              output_dir: str,
+                              tipo_analisi: str) -> str:
+    """
+    Scrive il report avanzato unito (righe vecchie e nuove) nello stesso formato del notebook
+    
+    Returns:
+        Percorso di report_avanzato_<tipo>.xlsx
+    """
+    
+    df_risultati = df.copy()
+    df_risultati['Etichetta_Principale'] = risultati["etichette_principali"]
+    df_risultati['Coefficiente_Principale'] = risultati["coefficienti_principali"]
+    df_risultati['Etichette_Secondarie'] = risultati["etichette_secondarie"]
+    df_risultati['Confidenza_Generale'] = risultati["confidenza_media"]
+    df_risultati['Coefficienti_Completi'] = risultati["coefficienti_completi"]
+    
+    os.makedirs(output_dir, exist_ok=True)
+    excel_path = os.path.join(output_dir, f'report_avanzato_{tipo_analisi}.xlsx')
+    df_risultati.to_excel(excel_path, index=False)
+    
+    logging.info(f"Report incrementale salvato in {excel_path}")
+    return excel_path
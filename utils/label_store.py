@@ -0,0 +1,147 @@
+"""
+🗃️ Label Store Module
+Archivio dei dizionari di etichette dinamiche, riutilizzabili tra esecuzioni sugli stessi dati
+"""
+
+import os
+import glob
+import json
+import time
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+try:
+    from .data_parsers import normalizza_commento
+except ImportError:
+    from data_parsers import normalizza_commento
+
+
+DEFAULT_LABEL_STORE_PATH = os.path.join('.cache', 'etichette')
+
+# Near-match: quasi tutti i commenti salvati ancora presenti e pochi commenti nuovi
+SOGLIA_COMMENTI_CONSERVATI = 0.95
+SOGLIA_COMMENTI_NUOVI = 0.2
+
+
+def _hash(testo: str) -> str:
+    return hashlib.sha256(testo.encode('utf-8')).hexdigest()
+
+
+def fingerprint_prompt(prompt_personalizzato: str, tipo_analisi: str) -> str:
+    """Impronta del prompt di analisi e del tipo di analisi"""
+    return _hash(json.dumps({"prompt": prompt_personalizzato, "tipo": tipo_analisi}, ensure_ascii=False))
+
+
+def hash_commenti(commenti: List[str]) -> List[str]:
+    """Hash brevi e ordinati dei commenti unici normalizzati: l'ordine delle righe non conta"""
+    return sorted({_hash(normalizza_commento(c))[:12] for c in commenti if normalizza_commento(c)})
+
+
+class LabelStore:
+    """
+    Archivio JSON delle etichette dinamiche, indicizzato per contenuto della colonna e prompt
+    
+    Ogni voce contiene le etichette nello stesso formato di
+    etichette_dinamiche_<tipo>.json e gli hash dei commenti da cui sono state
+    generate. Il file ha come prefisso l'impronta del prompt, così la ricerca
+    di una voce vicina legge solo le voci dello stesso prompt.
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('LABEL_STORE_PATH', DEFAULT_LABEL_STORE_PATH)
+        os.makedirs(self.path, exist_ok=True)
+    
+    def _file(self, impronta_prompt: str, impronta: str) -> str:
+        return os.path.join(self.path, f"{impronta_prompt[:12]}_{impronta[:16]}.json")
+    
+    @staticmethod
+    def fingerprint(hash_colonna: List[str], impronta_prompt: str) -> str:
+        """Impronta combinata di contenuto della colonna e prompt"""
+        return _hash(impronta_prompt + "".join(hash_colonna))
+    
+    def salva(self,
+              commenti: List[str],
+              prompt_personalizzato: str,
+              tipo_analisi: str,
+              etichette_dinamiche: Dict[str, Dict]) -> str:
+        """
+        Salva un dizionario di etichette per la colonna e il prompt indicati
+        
+        Returns:
+            Percorso del file salvato
+        """
+        
+        impronta_prompt = fingerprint_prompt(prompt_personalizzato, tipo_analisi)
+        hash_colonna = hash_commenti(commenti)
+        impronta = self.fingerprint(hash_colonna, impronta_prompt)
+        
+        path = self._file(impronta_prompt, impronta)
+        temporaneo = f"{path}.tmp"
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            json.dump({
+                "fingerprint": impronta,
+                "fingerprint_prompt": impronta_prompt,
+                "tipo_analisi": tipo_analisi,
+                "creato": time.strftime('%Y-%m-%d %H:%M:%S'),
+                "hash_commenti": hash_colonna,
+                "etichette_dinamiche": etichette_dinamiche
+            }, f, ensure_ascii=False)
+        os.replace(temporaneo, path)
+        return path
+    
+    def cerca(self,
+              commenti: List[str],
+              prompt_personalizzato: str,
+              tipo_analisi: str) -> Optional[Dict[str, Any]]:
+        """
+        Cerca un dizionario salvato per la colonna e il prompt indicati
+        
+        Returns:
+            None se non c'è nulla di riutilizzabile, altrimenti un dizionario con
+            'corrispondenza' ('esatta' o 'vicina'), 'etichette_dinamiche', 'path'
+            e, per le voci vicine, 'commenti_nuovi' (commenti non visti alla generazione)
+        """
+        
+        impronta_prompt = fingerprint_prompt(prompt_personalizzato, tipo_analisi)
+        hash_colonna = hash_commenti(commenti)
+        impronta = self.fingerprint(hash_colonna, impronta_prompt)
+        
+        esatto = self._file(impronta_prompt, impronta)
+        if os.path.exists(esatto):
+            voce = self._leggi(esatto)
+            if voce and voce.get("fingerprint") == impronta:
+                return {"corrispondenza": "esatta", "etichette_dinamiche": voce["etichette_dinamiche"], "path": esatto}
+        
+        attuali = set(hash_colonna)
+        migliore, migliore_nuovi = None, None
+        for path in glob.glob(os.path.join(self.path, f"{impronta_prompt[:12]}_*.json")):
+            voce = self._leggi(path)
+            if not voce or voce.get("fingerprint_prompt") != impronta_prompt or not voce.get("hash_commenti"):
+                continue
+            
+            salvati = set(voce["hash_commenti"])
+            conservati = len(salvati & attuali) / len(salvati)
+            nuovi = attuali - salvati
+            if conservati >= SOGLIA_COMMENTI_CONSERVATI and len(nuovi) <= SOGLIA_COMMENTI_NUOVI * len(attuali):
+                if migliore_nuovi is None or len(nuovi) < len(migliore_nuovi):
+                    migliore = {"corrispondenza": "vicina", "etichette_dinamiche": voce["etichette_dinamiche"], "path": path}
+                    migliore_nuovi = nuovi
+        
+        if migliore is None:
+            return None
+        
+        migliore["commenti_nuovi"] = [
+            c for c in dict.fromkeys(commenti)
+            if normalizza_commento(c) and _hash(normalizza_commento(c))[:12] in migliore_nuovi
+        ]
+        return migliore
+    
+    @staticmethod
+    def _leggi(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Archivio etichette: voce illeggibile ignorata ({path}): {e}")
+            return None
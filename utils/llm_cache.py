@@ -0,0 +1,334 @@
+"""
+💾 LLM Cache Module
+Cache persistente su disco delle risposte LLM (SQLite)
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Union
+
+
+DEFAULT_CACHE_PATH = os.path.join('.cache', 'llm_responses.sqlite')
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# Sotto questa soglia la compressione costa più di quanto risparmia
+_SOGLIA_COMPRESSIONE = 256
+
+
+# Flag per thread: le chiamate dentro senza_coalescenza() non si accodano a quelle in volo
+_contesto = threading.local()
+
+
+@contextmanager
+def senza_coalescenza():
+    """
+    Le chiamate del thread corrente non si uniscono a una richiesta identica già in volo
+    
+    Serve ai duplicati dell'hedging: la richiesta è la stessa della primaria
+    lenta e, unita a quella, ne attenderebbe la risposta. La cache resta
+    valida in lettura e scrittura.
+    """
+    
+    precedente = getattr(_contesto, 'senza_coalescenza', False)
+    _contesto.senza_coalescenza = True
+    try:
+        yield
+    finally:
+        _contesto.senza_coalescenza = precedente
+
+
+def calcola_chiave_cache(provider: str,
+                         model: str,
+                         temperature: float,
+                         messages: Union[str, List[Dict[str, str]]],
+                         **kwargs) -> str:
+    """
+    Calcola la chiave di cache di una richiesta
+    
+    Args:
+        provider: 'ollama' o 'openrouter'
+        model: Nome del modello
+        temperature: Temperatura di generazione
+        messages: Prompt o lista completa dei messaggi chat
+        **kwargs: Opzioni aggiuntive della chiamata (es. formato risposta)
+    
+    Returns:
+        Hash SHA-256 esadecimale della richiesta
+    """
+    
+    payload = json.dumps({
+        "provider": (provider or "").lower(),
+        "model": model,
+        "temperature": temperature,
+        "messages": messages,
+        "options": kwargs
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """Cache SQLite con eviction LRU limitata in byte e compressione opzionale"""
+    
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES, compress: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        
+        self._lock = threading.Lock()
+        self._in_volo: Dict[str, Dict[str, Any]] = {}
+        
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS risposte (
+                chiave TEXT PRIMARY KEY,
+                valore BLOB NOT NULL,
+                compresso INTEGER NOT NULL,
+                dimensione INTEGER NOT NULL,
+                ultimo_accesso REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_accesso ON risposte(ultimo_accesso)")
+        self._conn.commit()
+        
+        self._dimensione_totale = self._conn.execute(
+            "SELECT COALESCE(SUM(dimensione), 0) FROM risposte"
+        ).fetchone()[0]
+    
+    def get(self, chiave: str) -> Optional[str]:
+        """Restituisce la risposta in cache (aggiornando l'accesso LRU) o None"""
+        
+        with self._lock:
+            riga = self._conn.execute(
+                "SELECT valore, compresso FROM risposte WHERE chiave = ?", (chiave,)
+            ).fetchone()
+            
+            if riga is None:
+                return None
+            
+            self._conn.execute(
+                "UPDATE risposte SET ultimo_accesso = ? WHERE chiave = ?", (time.time(), chiave)
+            )
+            self._conn.commit()
+        
+        valore, compresso = riga
+        if compresso:
+            valore = zlib.decompress(valore)
+        return valore.decode('utf-8')
+    
+    def set(self, chiave: str, risposta: str) -> None:
+        """Salva una risposta ed esegue l'eviction se si supera max_bytes"""
+        
+        valore = risposta.encode('utf-8')
+        compresso = 0
+        if self.compress and len(valore) > _SOGLIA_COMPRESSIONE:
+            valore = zlib.compress(valore, 6)
+            compresso = 1
+        
+        with self._lock:
+            precedente = self._conn.execute(
+                "SELECT dimensione FROM risposte WHERE chiave = ?", (chiave,)
+            ).fetchone()
+            if precedente:
+                self._dimensione_totale -= precedente[0]
+            
+            self._conn.execute(
+                "INSERT OR REPLACE INTO risposte VALUES (?, ?, ?, ?, ?)",
+                (chiave, valore, compresso, len(valore), time.time())
+            )
+            self._dimensione_totale += len(valore)
+            self._evict()
+            self._conn.commit()
+    
+    def _evict(self) -> None:
+        """Rimuove le voci usate meno di recente finché la cache rientra nel limite"""
+        
+        while self._dimensione_totale > self.max_bytes:
+            riga = self._conn.execute(
+                "SELECT chiave, dimensione FROM risposte ORDER BY ultimo_accesso ASC LIMIT 1"
+            ).fetchone()
+            if riga is None:
+                self._dimensione_totale = 0
+                break
+            
+            self._conn.execute("DELETE FROM risposte WHERE chiave = ?", (riga[0],))
+            self._dimensione_totale -= riga[1]
+            self.evictions += 1
+    
+    def get_or_compute(self, chiave: str, calcola) -> str:
+        """
+        Restituisce la risposta in cache o la calcola una sola volta
+        
+        Se più thread chiedono la stessa chiave contemporaneamente, solo il
+        primo invoca il modello; gli altri attendono e ricevono lo stesso risultato.
+        Dentro senza_coalescenza() la chiamata parte comunque, anche con la
+        stessa chiave in volo.
+        """
+        
+        risposta = self.get(chiave)
+        if risposta is not None:
+            with self._lock:
+                self.hits += 1
+            return risposta
+        
+        if getattr(_contesto, 'senza_coalescenza', False):
+            with self._lock:
+                self.misses += 1
+            risposta = str(calcola())
+            self.set(chiave, risposta)
+            return risposta
+        
+        with self._lock:
+            volo = self._in_volo.get(chiave)
+            leader = volo is None
+            if leader:
+                volo = {"evento": threading.Event(), "risposta": None, "errore": None}
+                self._in_volo[chiave] = volo
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            volo["evento"].wait()
+            if volo["errore"] is not None:
+                raise volo["errore"]
+            return volo["risposta"]
+        
+        try:
+            risposta = str(calcola())
+            self.set(chiave, risposta)
+            volo["risposta"] = risposta
+            return risposta
+        except Exception as e:
+            volo["errore"] = e
+            raise
+        finally:
+            with self._lock:
+                self._in_volo.pop(chiave, None)
+            volo["evento"].set()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Contatori di utilizzo della cache"""
+        
+        with self._lock:
+            voci = self._conn.execute("SELECT COUNT(*) FROM risposte").fetchone()[0]
+            richieste = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.coalesced) / richieste if richieste else 0.0,
+                "chiamate_risparmiate": self.hits + self.coalesced,
+                "voci": voci,
+                "dimensione_bytes": self._dimensione_totale
+            }
+    
+    def clear(self) -> None:
+        """Svuota completamente la cache"""
+        
+        with self._lock:
+            self._conn.execute("DELETE FROM risposte")
+            self._conn.commit()
+            self._dimensione_totale = 0
+    
+    def close(self) -> None:
+        """Chiude la connessione al database"""
+        
+        with self._lock:
+            self._conn.close()
+
+
+_cache_condivise: Dict[str, LLMResponseCache] = {}
+_cache_condivise_lock = threading.Lock()
+
+
+def get_cache(path: str = None, max_bytes: int = DEFAULT_MAX_BYTES, compress: bool = True) -> LLMResponseCache:
+    """Restituisce l'istanza di cache condivisa per il percorso indicato"""
+    
+    path = path or os.getenv('LLM_CACHE_PATH', DEFAULT_CACHE_PATH)
+    
+    with _cache_condivise_lock:
+        cache = _cache_condivise.get(os.path.abspath(path))
+        if cache is None:
+            cache = LLMResponseCache(path, max_bytes=max_bytes, compress=compress)
+            _cache_condivise[os.path.abspath(path)] = cache
+        return cache
+
+
+class CachedLLM:
+    """Wrapper che aggiunge la cache persistente a qualsiasi client con invoke()"""
+    
+    def __init__(self, llm: Any, provider: str, cache: LLMResponseCache = None):
+        self.llm = llm
+        self.provider = provider
+        self.cache = cache or get_cache()
+    
+    def __getattr__(self, nome: str) -> Any:
+        # Espone gli attributi del client originale (model, temperature, ...)
+        return getattr(self.llm, nome)
+    
+    def _chiave(self, messages, **kwargs) -> str:
+        return calcola_chiave_cache(
+            self.provider,
+            getattr(self.llm, 'model', None),
+            getattr(self.llm, 'temperature', None),
+            messages,
+            **kwargs
+        )
+    
+    def invoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        """Invoca il modello solo se la richiesta non è già in cache"""
+        
+        return self.cache.get_or_compute(
+            self._chiave(messages, **kwargs),
+            lambda: self.llm.invoke(messages, **kwargs)
+        )
+    
+    async def ainvoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        """Versione asincrona di invoke (nessun coalescing tra coroutine)"""
+        
+        chiave = self._chiave(messages, **kwargs)
+        risposta = self.cache.get(chiave)
+        if risposta is not None:
+            with self.cache._lock:
+                self.cache.hits += 1
+            return risposta
+        
+        with self.cache._lock:
+            self.cache.misses += 1
+        risposta = str(await self.llm.ainvoke(messages, **kwargs))
+        self.cache.set(chiave, risposta)
+        return risposta
+    
+    def stats(self) -> Dict[str, Any]:
+        """Contatori hit/miss della cache sottostante"""
+        return self.cache.stats()
+
+
+def log_cache_stats(llm: Any) -> None:
+    """Stampa i risparmi ottenuti dalla cache, se il client ne ha una"""
+    
+    if not isinstance(llm, CachedLLM):
+        return
+    
+    stats = llm.stats()
+    logging.info(f"Cache LLM: {stats}")
+    print(f"💾 Cache LLM: {stats['hits']} hit, {stats['misses']} miss, "
+          f"{stats['coalesced']} unite ({stats['hit_rate']:.0%} risparmiate)")
@@ -0,0 +1,280 @@
+"""
+🌐 LLM Pool Module
+Pool di endpoint (più server Ollama e/o modelli OpenRouter) con scheduling least-loaded
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    from .ai_clients import create_llm
+    from .transport import TransportPolicy, CircuitOpenError, DeadlineExceededError, e_ritentabile
+except ImportError:
+    from ai_clients import create_llm
+    from transport import TransportPolicy, CircuitOpenError, DeadlineExceededError, e_ritentabile
+
+
+# Peso della nuova misura nella media mobile esponenziale della latenza
+_ALFA_LATENZA = 0.3
+
+
+class EndpointState:
+    """Stato di un endpoint del pool: client, richieste in volo e latenza misurata"""
+    
+    def __init__(self, config: Dict[str, Any], client: Any):
+        self.provider = config['provider'].lower()
+        self.base_url = config.get('base_url')
+        self.model = config['model']
+        self.max_concurrency = max(1, int(config.get('max_concurrency', 1)))
+        self.nome = f"{self.provider}:{self.base_url or 'default'}/{self.model}"
+        self.client = client
+        
+        self.in_volo = 0
+        self.latenza_media: Optional[float] = None
+        self.completate = 0
+        self.errori = 0
+    
+    @property
+    def disponibile(self) -> bool:
+        """False se il circuit breaker dell'endpoint è aperto (endpoint fuori rotazione)"""
+        circuito = getattr(self.client, 'circuito', None)
+        return circuito is None or circuito.stato != 'aperto'
+    
+    def throughput(self, latenza_default: float) -> float:
+        """Richieste al secondo stimate a piena concorrenza"""
+        return self.max_concurrency / (self.latenza_media or latenza_default)
+    
+    def registra_latenza(self, secondi: float) -> None:
+        self.completate += 1
+        if self.latenza_media is None:
+            self.latenza_media = secondi
+        else:
+            self.latenza_media = _ALFA_LATENZA * secondi + (1 - _ALFA_LATENZA) * self.latenza_media
+
+
+def _adatta_richiesta(provider: str,
+                      messages: Union[str, List[Dict[str, str]]],
+                      kwargs: Dict[str, Any]) -> tuple:
+    """
+    Adatta prompt e opzioni al provider dell'endpoint scelto
+    
+    Il chiamante costruisce la richiesta per un solo provider: i messaggi chat
+    diventano un prompt unico per Ollama e lo schema JSON passa da `format`
+    (Ollama) a `response_format` (OpenRouter) e viceversa.
+    """
+    
+    opzioni = dict(kwargs)
+    
+    if provider == 'ollama':
+        if not isinstance(messages, str):
+            messages = "\n\n".join(m.get('content', '') for m in messages)
+        formato = opzioni.pop('response_format', None)
+        if formato and 'format' not in opzioni:
+            opzioni['format'] = formato.get('json_schema', {}).get('schema', 'json')
+    else:
+        schema = opzioni.pop('format', None)
+        if schema and 'response_format' not in opzioni:
+            opzioni['response_format'] = (
+                {"type": "json_schema", "json_schema": {"name": "risposta", "strict": True, "schema": schema}}
+                if isinstance(schema, dict) else {"type": "json_object"}
+            )
+    
+    return messages, opzioni
+
+
+class LLMPool:
+    """
+    Distribuisce le chiamate tra più endpoint
+    
+    Ogni chiamata va all'endpoint disponibile con il minor tempo di attesa
+    stimato, (richieste in volo + 1) / throughput misurato, rispettando la
+    max_concurrency di ciascuno. Un endpoint con il circuit breaker aperto
+    esce dalla rotazione finché non supera la chiamata di prova; in caso di
+    errore la richiesta viene ripetuta su un altro endpoint. Quando un giro
+    su tutti gli endpoint fallisce con errori transitori, il pool attende il
+    backoff della TransportPolicy e ricomincia, fino a max_retries giri: anche
+    un pool con uno o due endpoint regge un 5xx o un timeout isolato.
+    """
+    
+    def __init__(self, endpoints: List[EndpointState], policy: TransportPolicy = None):
+        if not endpoints:
+            raise ValueError("Il pool richiede almeno un endpoint")
+        
+        self.endpoints = endpoints
+        self.policy = policy or TransportPolicy()
+        self.giri_ripetuti = 0
+        self._condizione = threading.Condition()
+        
+        modelli = sorted({e.model for e in endpoints})
+        self.model = modelli[0] if len(modelli) == 1 else "+".join(modelli)
+        self.temperature = getattr(endpoints[0].client, 'temperature', None)
+    
+    @property
+    def capacita_totale(self) -> int:
+        """Somma delle max_concurrency: numero di batch utilmente eseguibili in parallelo"""
+        return sum(e.max_concurrency for e in self.endpoints)
+    
+    def _latenza_default(self) -> float:
+        # Gli endpoint non ancora misurati valgono come la media degli altri: vengono provati subito
+        misurate = [e.latenza_media for e in self.endpoints if e.latenza_media]
+        return sum(misurate) / len(misurate) if misurate else 1.0
+    
+    def _scegli(self, esclusi: set) -> Optional[EndpointState]:
+        """Attende un endpoint con capacità libera e lo prenota (None se non ne restano)"""
+        
+        with self._condizione:
+            while True:
+                candidati = [e for e in self.endpoints if e.nome not in esclusi and e.disponibile]
+                if not candidati:
+                    return None
+                
+                liberi = [e for e in candidati if e.in_volo < e.max_concurrency]
+                if liberi:
+                    latenza_default = self._latenza_default()
+                    scelto = min(liberi, key=lambda e: (e.in_volo + 1) / e.throughput(latenza_default))
+                    scelto.in_volo += 1
+                    return scelto
+                
+                self._condizione.wait(timeout=1.0)
+    
+    def _rilascia(self, endpoint: EndpointState, durata: float = None) -> None:
+        with self._condizione:
+            endpoint.in_volo -= 1
+            if durata is None:
+                endpoint.errori += 1
+            else:
+                endpoint.registra_latenza(durata)
+            self._condizione.notify()
+    
+    def invoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        """Invoca il modello sull'endpoint meno carico, ripiegando sugli altri in caso di errore"""
+        
+        ultimo_errore = None
+        
+        for giro in range(self.policy.max_retries + 1):
+            esclusi = set()
+            errore_giro = None
+            
+            while True:
+                endpoint = self._scegli(esclusi)
+                if endpoint is None:
+                    break
+                
+                richiesta, opzioni = _adatta_richiesta(endpoint.provider, messages, kwargs)
+                inizio = time.monotonic()
+                try:
+                    risposta = endpoint.client.invoke(richiesta, **opzioni)
+                except Exception as e:
+                    self._rilascia(endpoint)
+                    logging.warning(f"Pool: errore su {endpoint.nome} ({e}), provo un altro endpoint")
+                    if isinstance(e, DeadlineExceededError) or (not e_ritentabile(e) and not isinstance(e, CircuitOpenError)):
+                        raise
+                    esclusi.add(endpoint.nome)
+                    errore_giro = e
+                    continue
+                
+                self._rilascia(endpoint, time.monotonic() - inizio)
+                return risposta
+            
+            # Nessun endpoint provato in questo giro: tutti fuori rotazione
+            if errore_giro is None:
+                break
+            ultimo_errore = errore_giro
+            
+            if giro < self.policy.max_retries:
+                attesa = self.policy.attesa_backoff(giro, getattr(errore_giro, 'retry_after', None))
+                logging.warning(f"Pool: tutti gli endpoint hanno fallito (giro {giro + 1}), nuovo giro tra {attesa:.1f}s")
+                with self._condizione:
+                    self.giri_ripetuti += 1
+                time.sleep(attesa)
+        
+        raise ultimo_errore or CircuitOpenError("Nessun endpoint del pool disponibile")
+    
+    async def ainvoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        """Versione asincrona di invoke (la prenotazione dell'endpoint può bloccare: gira in un thread)"""
+        return await asyncio.to_thread(self.invoke, messages, **kwargs)
+    
+    def avvia_run(self) -> None:
+        """Fa partire la durata massima dell'esecuzione su tutti gli endpoint"""
+        for endpoint in self.endpoints:
+            if hasattr(endpoint.client, 'avvia_run'):
+                endpoint.client.avvia_run()
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """Stato di ogni endpoint: richieste completate, errori, latenza, disponibilità"""
+        
+        with self._condizione:
+            return [
+                {
+                    "endpoint": e.nome,
+                    "completate": e.completate,
+                    "errori": e.errori,
+                    "in_volo": e.in_volo,
+                    "latenza_media": round(e.latenza_media, 3) if e.latenza_media else None,
+                    "disponibile": e.disponibile
+                }
+                for e in self.endpoints
+            ]
+
+
+def carica_endpoints(config: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """
+    Legge la lista degli endpoint da config['endpoints'] o dalla variabile LLM_ENDPOINTS (JSON)
+    
+    Returns:
+        Lista di dizionari {provider, base_url, model, max_concurrency} (vuota se non configurata)
+    """
+    
+    endpoints = (config or {}).get('endpoints')
+    if endpoints is None and os.getenv('LLM_ENDPOINTS'):
+        endpoints = json.loads(os.getenv('LLM_ENDPOINTS'))
+    return list(endpoints or [])
+
+
+def create_llm_pool(endpoints: List[Dict[str, Any]],
+                    temperature: float = 0.7,
+                    policy: TransportPolicy = None,
+                    rate_limits: Dict[str, Any] = None,
+                    cache: Union[bool, str] = False) -> LLMPool:
+    """
+    Crea un pool a partire dalla configurazione degli endpoint
+    
+    Ogni endpoint ha il proprio client con un solo tentativo per chiamata:
+    i nuovi tentativi li fa il pool, prima su un endpoint diverso e poi, dopo
+    il backoff della policy, con un nuovo giro su tutti (max_retries giri).
+    
+    Args:
+        endpoints: Lista di {provider, base_url, model, max_concurrency}
+        temperature: Temperatura per la generazione
+        policy: Politica di trasporto di base (timeout, circuit breaker)
+        rate_limits: Limiti per provider, come in create_llm
+        cache: Cache delle risposte per ogni endpoint, come in create_llm
+    
+    Returns:
+        Istanza di LLMPool
+    """
+    
+    policy = policy or TransportPolicy()
+    policy_endpoint = TransportPolicy(
+        timeout_seconds=policy.timeout_seconds,
+        max_retries=0,
+        run_deadline_seconds=policy.run_deadline_seconds,
+        soglia_circuito=policy.soglia_circuito,
+        reset_circuito_secondi=policy.reset_circuito_secondi
+    )
+    
+    stati = []
+    for config in endpoints:
+        client = create_llm(
+            config['provider'], config['model'], temperature,
+            cache=cache, rate_limits=rate_limits, policy=policy_endpoint, base_url=config.get('base_url')
+        )
+        stati.append(EndpointState(config, client))
+    
+    print(f"🌐 Pool LLM: {len(stati)} endpoint, capacità {sum(s.max_concurrency for s in stati)} richieste in parallelo")
+    return LLMPool(stati, policy)
@@ -0,0 +1,300 @@
+"""
+🧮 Multi-Column Module
+Analisi di più colonne aperte in un solo job, con uno scheduler condiviso delle chiamate LLM
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+import pandas as pd
+
+try:
+    from .batch_processor import etichetta_con_coefficiente_batch
+    from .config_manager import get_template_prompts
+    from .etichette_generator import genera_etichette_da_campione
+except ImportError:
+    from batch_processor import etichetta_con_coefficiente_batch
+    from config_manager import get_template_prompts
+    from etichette_generator import genera_etichette_da_campione
+
+
+# Chiamate in volo quando il client non dichiara una capacità (vedi LLMPool.capacita_totale)
+CAPACITA_DEFAULT = 4
+
+
+class SchedulerCondiviso:
+    """
+    Coda FIFO globale delle chiamate LLM di tutte le colonne di un job
+    
+    Le chiamate in volo non superano la capacità (di default quella del pool
+    di endpoint); chi arriva prima parte prima, qualunque sia la colonna, così
+    i batch delle colonne si alternano e gli endpoint restano sempre pieni
+    anche mentre una colonna sta ancora generando le etichette.
+    """
+    
+    def __init__(self, llm: Any, capacita: int = None):
+        self.llm = llm
+        self.capacita = max(1, capacita or getattr(llm, 'capacita_totale', None) or CAPACITA_DEFAULT)
+        self._condizione = threading.Condition()
+        self._coda = deque()
+        self._in_volo = 0
+        
+        self.in_volo_massimo = 0
+        self.chiamate: Dict[str, int] = {}
+        self.secondi_attesa: Dict[str, float] = {}
+    
+    def esegui(self, nome: str, funzione: Callable[[], Any]) -> Any:
+        """Esegue funzione quando è il suo turno e c'è uno slot libero"""
+        
+        turno = object()
+        inizio = time.monotonic()
+        with self._condizione:
+            self._coda.append(turno)
+            self._condizione.wait_for(lambda: self._coda[0] is turno and self._in_volo < self.capacita)
+            self._coda.popleft()
+            self._in_volo += 1
+            self.in_volo_massimo = max(self.in_volo_massimo, self._in_volo)
+            self.chiamate[nome] = self.chiamate.get(nome, 0) + 1
+            self.secondi_attesa[nome] = self.secondi_attesa.get(nome, 0.0) + time.monotonic() - inizio
+            self._condizione.notify_all()
+        
+        try:
+            return funzione()
+        finally:
+            with self._condizione:
+                self._in_volo -= 1
+                self._condizione.notify_all()
+    
+    def client(self, nome: str) -> 'ClientSchedulato':
+        """Client con invoke() le cui chiamate passano dallo scheduler a nome della colonna"""
+        return ClientSchedulato(self, nome)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Capacità, picco di chiamate in volo, chiamate e attesa per colonna"""
+        
+        with self._condizione:
+            return {
+                "capacita": self.capacita,
+                "in_volo_massimo": self.in_volo_massimo,
+                "chiamate": dict(self.chiamate),
+                "secondi_attesa": {nome: round(s, 2) for nome, s in self.secondi_attesa.items()}
+            }
+
+
+class ClientSchedulato:
+    """Vista di una colonna sul client condiviso: stessa interfaccia, turni dallo scheduler"""
+    
+    def __init__(self, scheduler: SchedulerCondiviso, nome: str):
+        self.scheduler = scheduler
+        self.nome = nome
+        self.capacita_totale = scheduler.capacita
+    
+    def __getattr__(self, nome: str) -> Any:
+        return getattr(self.scheduler.llm, nome)
+    
+    def invoke(self, messages: Any, **kwargs) -> Any:
+        return self.scheduler.esegui(self.nome, lambda: self.scheduler.llm.invoke(messages, **kwargs))
+    
+    def avvia_run(self) -> None:
+        # La durata massima parte una volta per tutto il job, non a ogni colonna
+        pass
+
+
+def prompt_da_template(template: str) -> str:
+    """Testo del prompt per una chiave di get_template_prompts (altrimenti il testo stesso)"""
+    
+    templates = get_template_prompts()
+    return templates[template]['prompt'] if template in templates else template
+
+
+def nome_breve(colonna: str, max_caratteri: int = 30) -> str:
+    """Suffisso leggibile per le colonne del report combinato (es. domande lunghe del questionario)"""
+    
+    breve = re.sub(r'\W+', '_', str(colonna)).strip('_')
+    return breve[:max_caratteri].rstrip('_') or 'colonna'
+
+
+def suffissi_colonne(colonne: List[str]) -> Dict[str, str]:
+    """
+    Suffissi univoci per le colonne del report combinato
+    
+    Le domande che condividono i primi caratteri danno lo stesso nome_breve:
+    in quel caso al suffisso si aggiunge la posizione della colonna nel job
+    (la stessa N del foglio 'Colonne' e di 'Etichette_<n>').
+    
+    Args:
+        colonne: Colonne nell'ordine del job
+    
+    Returns:
+        Dizionario colonna → suffisso
+    """
+    
+    brevi = [nome_breve(colonna) for colonna in colonne]
+    suffissi = {
+        colonna: breve if brevi.count(breve) == 1 else f"{breve}_{n}"
+        for n, (colonna, breve) in enumerate(zip(colonne, brevi), start=1)
+    }
+    
+    if len(set(suffissi.values())) < len(suffissi):
+        raise ValueError(f"❌ Suffissi di colonna non univoci: {', '.join(suffissi.values())}")
+    return suffissi
+
+
+def analizza_colonne(df: pd.DataFrame,
+                     colonne: Dict[str, str],
+                     llm: Any,
+                     ai_provider: str,
+                     capacita: int = None,
+                     genera: Callable[..., Dict[str, Any]] = None,
+                     opzioni_generazione: Dict[str, Any] = None,
+                     **opzioni) -> Dict[str, Any]:
+    """
+    Genera le etichette ed etichetta più colonne aperte in un solo job
+    
+    Ogni colonna percorre in un proprio thread generazione delle etichette ed
+    etichettatura batch; tutte le chiamate LLM passano da un unico
+    SchedulerCondiviso, così generazione e batch delle diverse colonne si
+    alternano sugli stessi endpoint senza pause tra una colonna e l'altra.
+    
+    Args:
+        df: DataFrame con i dati
+        colonne: Dizionario colonna → chiave di get_template_prompts (o testo del prompt);
+                 la chiave del template è anche il tipo di analisi della colonna
+                 ('personalizzata' per un prompt libero)
+        llm: Modello di linguaggio (o LLMPool) condiviso da tutte le colonne
+        ai_provider: 'ollama' o 'openrouter'
+        capacita: Chiamate LLM in volo nel job (default: capacita_totale del client o CAPACITA_DEFAULT)
+        genera: Funzione di generazione delle etichette (default: genera_etichette_da_campione,
+                es. genera_etichette_con_archivio per riusare l'archivio)
+        opzioni_generazione: Parametri aggiuntivi per genera
+        **opzioni: Parametri di etichetta_con_coefficiente_batch comuni a tutte le colonne
+    
+    Returns:
+        Dizionario con 'colonne' (per colonna: template, generazione, risultati
+        ed errore) e 'statistiche_scheduler'. Una colonna fallita non ferma le
+        altre: ha generazione e risultati None e il messaggio in errore.
+    """
+    
+    mancanti = [colonna for colonna in colonne if colonna not in df.columns]
+    if mancanti:
+        raise ValueError(f"❌ Colonne non presenti nel file: {', '.join(mancanti)}")
+    
+    genera = genera or genera_etichette_da_campione
+    opzioni_generazione = opzioni_generazione or {}
+    # Widget e journal sono di una sola colonna: nel job condiviso non si usano
+    for chiave in ('fase_label', 'progress_bar', 'checkpoint'):
+        if opzioni.pop(chiave, None) is not None:
+            logging.warning(f"Analisi multi-colonna: '{chiave}' ignorato")
+    
+    scheduler = SchedulerCondiviso(llm, capacita)
+    if hasattr(llm, 'avvia_run'):
+        llm.avvia_run()
+    
+    print(f"🧮 Analisi di {len(colonne)} colonne con {scheduler.capacita} chiamate LLM in parallelo")
+    inizio = time.time()
+    
+    def pipeline(colonna: str, template: str) -> Dict[str, Any]:
+        client = scheduler.client(colonna)
+        tipo_analisi = template if template in get_template_prompts() else 'personalizzata'
+        generazione = genera(df, colonna, prompt_da_template(template), tipo_analisi, client, ai_provider,
+                             **opzioni_generazione)
+        etichette = generazione["etichette_dinamiche"]
+        if not etichette:
+            raise ValueError(f"❌ Nessuna etichetta generata per la colonna '{colonna}'")
+        print(f"🏷️ {colonna}: {len(etichette)} etichette, inizio etichettatura")
+        
+        risultati = etichetta_con_coefficiente_batch(
+            df, etichette, colonna, tipo_analisi, client, ai_provider, **opzioni
+        )
+        return {"template": template, "generazione": generazione, "risultati": risultati, "errore": None}
+    
+    with ThreadPoolExecutor(max_workers=len(colonne), thread_name_prefix='colonna') as executor:
+        futures = {colonna: executor.submit(pipeline, colonna, template) for colonna, template in colonne.items()}
+        risultati_colonne = {}
+        for colonna, future in futures.items():
+            try:
+                risultati_colonne[colonna] = future.result()
+            except Exception as e:
+                # Le colonne già completate restano valide anche se una fallisce
+                logging.error(f"Analisi multi-colonna: colonna '{colonna}' fallita: {e}")
+                print(f"❌ {colonna}: {e}")
+                risultati_colonne[colonna] = {"template": colonne[colonna], "generazione": None,
+                                              "risultati": None, "errore": str(e)}
+    
+    statistiche = scheduler.stats()
+    statistiche["colonne_fallite"] = [colonna for colonna, esito in risultati_colonne.items() if esito["errore"]]
+    statistiche["secondi_totali"] = round(time.time() - inizio, 2)
+    logging.info(f"Analisi multi-colonna completata: {statistiche}")
+    
+    return {"colonne": risultati_colonne, "statistiche_scheduler": statistiche}
+
+
+def salva_report_multi_colonna(df: pd.DataFrame,
+                               risultati_job: Dict[str, Any],
+                               output_dir: str,
+                               nome_report: str = 'multi_colonna') -> str:
+    """
+    Scrive un unico report Excel per tutte le colonne del job
+    
+    Il foglio 'Risultati' contiene i dati con, per ogni colonna analizzata,
+    Etichetta_Principale_<colonna>, Coefficiente_Principale_<colonna>,
+    Etichette_Secondarie_<colonna>, Confidenza_Generale_<colonna> e
+    Coefficienti_Completi_<colonna> (suffissi da suffissi_colonne); il foglio
+    'Colonne' riassume il job e un foglio 'Etichette_<n>' per colonna elenca
+    le etichette generate. Le colonne fallite compaiono solo nel foglio
+    'Colonne', con il messaggio nella colonna Errore.
+    
+    Returns:
+        Percorso del report
+    """
+    
+    df_risultati = df.copy()
+    riepilogo: List[Dict[str, Any]] = []
+    fogli_etichette: Dict[str, pd.DataFrame] = {}
+    suffissi = suffissi_colonne(list(risultati_job["colonne"]))
+    
+    for n, (colonna, esito) in enumerate(risultati_job["colonne"].items(), start=1):
+        suffisso = suffissi[colonna]
+        if esito.get("errore"):
+            riepilogo.append({"N": n, "Colonna": colonna, "Suffisso": suffisso, "Template": esito["template"],
+                              "Etichette": 0, "Confidenza_Media": None, "Errore": esito["errore"]})
+            continue
+        
+        risultati = esito["risultati"]
+        df_risultati[f'Etichetta_Principale_{suffisso}'] = risultati["etichette_principali"]
+        df_risultati[f'Coefficiente_Principale_{suffisso}'] = risultati["coefficienti_principali"]
+        df_risultati[f'Etichette_Secondarie_{suffisso}'] = risultati["etichette_secondarie"]
+        df_risultati[f'Confidenza_Generale_{suffisso}'] = risultati["confidenza_media"]
+        df_risultati[f'Coefficienti_Completi_{suffisso}'] = risultati["coefficienti_completi"]
+        
+        etichette = esito["generazione"]["etichette_dinamiche"]
+        riepilogo.append({
+            "N": n,
+            "Colonna": colonna,
+            "Suffisso": suffisso,
+            "Template": esito["template"],
+            "Etichette": len(etichette),
+            "Confidenza_Media": risultati.get("statistiche_confidenza", {}).get("media_coefficienti", 0.0),
+            "Errore": ""
+        })
+        fogli_etichette[f'Etichette_{n}'] = pd.DataFrame([
+            {"Etichetta": nome, "Descrizione": info.get('descrizione', ''), "Esempi": info.get('esempi', '')}
+            for nome, info in etichette.items()
+        ])
+    
+    os.makedirs(output_dir, exist_ok=True)
+    excel_path = os.path.join(output_dir, f'report_{nome_report}.xlsx')
+    with pd.ExcelWriter(excel_path) as writer:
+        df_risultati.to_excel(writer, sheet_name='Risultati', index=False)
+        pd.DataFrame(riepilogo).to_excel(writer, sheet_name='Colonne', index=False)
+        for foglio, df_etichette in fogli_etichette.items():
+            df_etichette.to_excel(writer, sheet_name=foglio, index=False)
+    
+    logging.info(f"Report multi-colonna salvato in {excel_path}")
+    return excel_path
@@ -0,0 +1,261 @@
+"""
+🧩 Multi-Task Module
+Più tipi di analisi sulla stessa colonna con una sola chiamata LLM per batch
+"""
+
+import re
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+try:
+    from .batch_processor import (_INTESTAZIONE_COMMENTO, _assegna_risultato, _componi_richiesta, _da_riparare,
+                                  _elenco_commenti, _leggi_risultato, _parse_sezione, _risultato_incerto,
+                                  _statistiche_confidenza)
+    from .data_parsers import raggruppa_duplicati
+except ImportError:
+    from batch_processor import (_INTESTAZIONE_COMMENTO, _assegna_risultato, _componi_richiesta, _da_riparare,
+                                 _elenco_commenti, _leggi_risultato, _parse_sezione, _risultato_incerto,
+                                 _statistiche_confidenza)
+    from data_parsers import raggruppa_duplicati
+
+
+_INTESTAZIONE_TASK = re.compile(r'-{2,}\s*TASK\s*:?\s*([^\n]+?)\s*-{2,}', re.IGNORECASE)
+
+
+def create_batch_prompt_multitask(batch_commenti: List[str],
+                                  etichette_per_task: Dict[str, Dict[str, Dict]],
+                                  soglia_confidenza: float) -> str:
+    """
+    Prompt batch con un dizionario di etichette per task: i commenti compaiono una volta sola
+    
+    Args:
+        batch_commenti: Commenti del batch
+        etichette_per_task: Dizionario task → etichette dinamiche
+        soglia_confidenza: Soglia per le etichette secondarie
+    
+    Returns:
+        Prompt con un blocco "--- TASK: <nome> ---" per ogni task in ogni commento
+    """
+    
+    tasks = list(etichette_per_task)
+    dizionari = "\n".join(
+        f"TASK {task}:\n" + "\n".join(f"- {nome}: {info['descrizione']}" for nome, info in etichette.items()) + "\n"
+        for task, etichette in etichette_per_task.items()
+    )
+    blocchi = "\n".join(
+        f"""--- TASK: {task} ---
+PRINCIPALE: [etichetta del task {task}] (coefficiente: 0.XX)
+SECONDARIE: [etichetta1] (0.XX), [etichetta2] (0.XX)
+TUTTI_COEFFICIENTI: {{"etichetta1": 0.XX, "etichetta2": 0.XX, ...}}
+CONFIDENZA_GENERALE: 0.XX"""
+        for task in tasks
+    )
+    
+    return f"""Analizza questi {len(batch_commenti)} commenti per {len(tasks)} task distinti ({', '.join(tasks)}).
+Per ogni task usa SOLO le etichette di quel task e calcola quanto ogni commento si adatta a ciascuna (coefficiente 0.0-1.0).
+
+ETICHETTE PER TASK:
+{dizionari}
+COMMENTI DA ANALIZZARE:
+{_elenco_commenti(batch_commenti)}
+ISTRUZIONI:
+1. Per OGNI commento scrivi un blocco per OGNI task, nell'ordine indicato
+2. In ogni blocco assegna a ogni etichetta del task un coefficiente da 0.0 a 1.0 e indica la principale
+3. Indica anche etichette secondarie significative (sopra {soglia_confidenza})
+
+FORMATO RISPOSTA (ripeti per ogni commento):
+=== COMMENTO_1 ===
+{blocchi}
+
+[continua per tutti i commenti...]"""
+
+
+def parse_batch_response_multitask(risposta: str,
+                                   num_commenti: int,
+                                   tasks: List[str]) -> Tuple[Dict[str, List[Dict[str, Any]]], List[int]]:
+    """
+    Divide la risposta per commento (intestazione COMMENTO_n) e poi per task
+    
+    Returns:
+        (risultati: task → risultati in ordine di input, "Incerto" per i blocchi mancanti;
+         posizioni 0-based dei commenti con almeno un blocco mancante o non parsato)
+    """
+    
+    per_nome = {task.lower(): task for task in tasks}
+    risultati = {task: [_risultato_incerto() for _ in range(num_commenti)] for task in tasks}
+    trovati = set()
+    
+    intestazioni = list(_INTESTAZIONE_COMMENTO.finditer(risposta))
+    for i, intestazione in enumerate(intestazioni):
+        numero = int(intestazione.group(1))
+        fine = intestazioni[i + 1].start() if i + 1 < len(intestazioni) else len(risposta)
+        # In caso di duplicato vale la prima sezione
+        if not 1 <= numero <= num_commenti or numero in trovati:
+            continue
+        trovati.add(numero)
+        
+        sezione = risposta[intestazione.end():fine]
+        blocchi = list(_INTESTAZIONE_TASK.finditer(sezione))
+        for j, blocco in enumerate(blocchi):
+            task = per_nome.get(blocco.group(1).strip().lower())
+            if task is None:
+                continue
+            fine_blocco = blocchi[j + 1].start() if j + 1 < len(blocchi) else len(sezione)
+            risultati[task][numero - 1] = _parse_sezione(sezione[blocco.end():fine_blocco])
+    
+    da_riparare = [
+        posizione for posizione in range(num_commenti)
+        if any(_da_riparare(risultati[task][posizione]) for task in tasks)
+    ]
+    if da_riparare:
+        logging.warning(f"Risposta multi-task: {len(da_riparare)}/{num_commenti} commenti con blocchi mancanti")
+    
+    return risultati, da_riparare
+
+
+def etichetta_multitask_batch(df: pd.DataFrame,
+                              etichette_per_task: Dict[str, Dict[str, Dict]],
+                              colonna_riferimento: str,
+                              llm: Any,
+                              ai_provider: str,
+                              soglia_confidenza: float = 0.3,
+                              batch_size: int = 5,
+                              max_workers: int = 1,
+                              deduplica: bool = True,
+                              max_tentativi_riparazione: int = 1) -> Dict[str, Any]:
+    """
+    Etichetta una colonna per più task (es. feedback_studenti e sentiment) in una sola passata
+    
+    Ogni batch porta tutti i dizionari di etichette e il modello risponde con un
+    blocco per task per ogni commento: il testo dei commenti e il costo fisso
+    della chiamata si pagano una volta invece che una per task. Il batch_size va
+    scelto tenendo conto che l'output per commento cresce con il numero di task.
+    
+    Args:
+        df: DataFrame con i dati
+        etichette_per_task: Dizionario task → etichette dinamiche del task
+        colonna_riferimento: Nome della colonna da analizzare
+        llm: Modello di linguaggio da utilizzare
+        ai_provider: Provider AI ('ollama' o 'openrouter')
+        soglia_confidenza: Soglia minima per le etichette secondarie
+        batch_size: Numero di commenti per chiamata
+        max_workers: Batch in esecuzione contemporaneamente
+        deduplica: Etichetta una sola volta i commenti identici dopo la normalizzazione
+        max_tentativi_riparazione: Passaggi in cui i commenti con blocchi mancanti vengono
+                                   rispediti in batch più piccoli (0 = nessuno)
+    
+    Returns:
+        Dizionario con "risultati_per_task" (task → risultati nel formato di
+        etichetta_con_coefficiente_batch) e "statistiche_multitask"
+    """
+    
+    tasks = list(etichette_per_task)
+    if not tasks:
+        raise ValueError("❌ Nessun task indicato")
+    
+    print(f"🧩 MODALITÀ MULTI-TASK: {len(tasks)} task ({', '.join(tasks)}) in ogni chiamata")
+    inizio = time.time()
+    
+    risultati_per_task = {
+        task: {chiave: [None] * len(df) for chiave in
+               ("etichette_principali", "coefficienti_principali", "etichette_secondarie",
+                "coefficienti_completi", "confidenza_media")}
+        for task in tasks
+    }
+    vuota = {"principale": "Vuota", "coeff_principale": 0.0, "secondarie": "",
+             "tutti_coefficienti": "{}", "confidenza_generale": 0.0}
+    
+    commenti = {}
+    for posizione, idx in enumerate(df.index):
+        if pd.isna(df.loc[idx, colonna_riferimento]):
+            for task in tasks:
+                _assegna_risultato(risultati_per_task[task], posizione, vuota)
+        else:
+            commenti[posizione] = df.loc[idx, colonna_riferimento]
+    
+    if deduplica:
+        rappresentanti, gruppi = raggruppa_duplicati(commenti)
+    else:
+        rappresentanti, gruppi = commenti, {posizione: [posizione] for posizione in commenti}
+    
+    chiamate = 0
+    max_workers = max(max_workers, getattr(llm, 'capacita_totale', 1))
+    
+    def esegui_batch(posizioni: List[int]) -> Tuple[List[int], Dict[str, List[Dict[str, Any]]]]:
+        prompt = create_batch_prompt_multitask([str(rappresentanti[p]) for p in posizioni],
+                                               etichette_per_task, soglia_confidenza)
+        try:
+            risposta = llm.invoke(_componi_richiesta(prompt, ", ".join(tasks), ai_provider))
+            parsati, _ = parse_batch_response_multitask(str(risposta), len(posizioni), tasks)
+        except Exception as e:
+            logging.error(f"Errore nel batch multi-task: {e}")
+            parsati = {task: [None] * len(posizioni) for task in tasks}
+        return posizioni, parsati
+    
+    def esegui_passaggio(posizioni: List[int], dimensione: int, solo_da_riparare: bool) -> None:
+        nonlocal chiamate
+        batches = [posizioni[i:i + dimensione] for i in range(0, len(posizioni), dimensione)]
+        chiamate += len(batches)
+        workers = max(1, min(max_workers, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in as_completed([executor.submit(esegui_batch, batch) for batch in batches]):
+                batch, parsati = future.result()
+                for task in tasks:
+                    for posizione, risultato in zip(batch, parsati[task]):
+                        # Nella riparazione un blocco ancora mancante non sovrascrive quello buono
+                        if solo_da_riparare and (risultato is None or _da_riparare(risultato)):
+                            if not _da_riparare(_leggi_risultato(risultati_per_task[task], posizione)):
+                                continue
+                        for riga in gruppi[posizione]:
+                            _assegna_risultato(risultati_per_task[task], riga, risultato)
+    
+    esegui_passaggio(list(rappresentanti), batch_size, solo_da_riparare=False)
+    
+    dimensione = batch_size
+    for tentativo in range(max_tentativi_riparazione):
+        da_riparare = [
+            posizione for posizione in rappresentanti
+            if any(_da_riparare(_leggi_risultato(risultati_per_task[task], posizione)) for task in tasks)
+        ]
+        if not da_riparare:
+            break
+        dimensione = max(1, dimensione // 2)
+        print(f"🔧 Riparazione multi-task {tentativo + 1}: {len(da_riparare)} commenti in batch da {dimensione}")
+        esegui_passaggio(da_riparare, dimensione, solo_da_riparare=True)
+    
+    for task in tasks:
+        risultati_per_task[task]["statistiche_confidenza"] = _statistiche_confidenza(
+            risultati_per_task[task]["coefficienti_principali"]
+        )
+    
+    statistiche = {
+        "task": tasks,
+        "commenti_unici": len(rappresentanti),
+        "chiamate_api": chiamate,
+        "chiamate_risparmiate": chiamate * (len(tasks) - 1),
+        "secondi": round(time.time() - inizio, 2)
+    }
+    print(f"✅ Multi-task completato: {chiamate} chiamate invece di {chiamate * len(tasks)}")
+    logging.info(f"Etichettatura multi-task completata: {statistiche}")
+    
+    return {"risultati_per_task": risultati_per_task, "statistiche_multitask": statistiche}
+
+
+def aggiungi_colonne_multitask(df: pd.DataFrame, risultati: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Copia del DataFrame con le colonne Etichetta_Principale_<task>, Coefficiente_Principale_<task>,
+    Etichette_Secondarie_<task>, Confidenza_Generale_<task> e Coefficienti_Completi_<task>
+    """
+    
+    df_risultati = df.copy()
+    for task, risultati_task in risultati["risultati_per_task"].items():
+        df_risultati[f'Etichetta_Principale_{task}'] = risultati_task["etichette_principali"]
+        df_risultati[f'Coefficiente_Principale_{task}'] = risultati_task["coefficienti_principali"]
+        df_risultati[f'Etichette_Secondarie_{task}'] = risultati_task["etichette_secondarie"]
+        df_risultati[f'Confidenza_Generale_{task}'] = risultati_task["confidenza_media"]
+        df_risultati[f'Coefficienti_Completi_{task}'] = risultati_task["coefficienti_completi"]
+    return df_risultati
@@ -0,0 +1,275 @@
+"""
+🚦 Rate Limiter Module
+Limitatore condiviso (richieste/secondo e token/minuto) per tutte le chiamate LLM
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Mapping, Optional, Union
+
+
+# Limiti di default per provider, sovrascrivibili da .env (es. OPENROUTER_RPS, OLLAMA_TPM)
+DEFAULT_RATE_LIMITS = {
+    'ollama': {'richieste_al_secondo': 10.0, 'token_al_minuto': None},
+    'openrouter': {'richieste_al_secondo': 1.0, 'token_al_minuto': None},
+}
+
+# Pausa applicata a un 429 senza Retry-After
+_PAUSA_429_DEFAULT = 5.0
+
+# Dopo un 429 il ritmo scende al 50%, poi risale del 5% a ogni richiesta riuscita
+_FATTORE_RIDUZIONE = 0.5
+_FATTORE_RECUPERO = 1.05
+_RITMO_MINIMO = 0.05
+
+
+class RateLimitError(Exception):
+    """Il provider ha risposto 429: la richiesta può essere ripetuta dopo retry_after secondi"""
+    
+    def __init__(self, messaggio: str, retry_after: float = None):
+        super().__init__(messaggio)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Secchio che si riempie a velocità costante fino alla capacità massima"""
+    
+    def __init__(self, capacita: float, ricarica_al_secondo: float):
+        self.capacita = capacita
+        self.ricarica_al_secondo = ricarica_al_secondo
+        self.disponibili = capacita
+        self._ultimo = time.monotonic()
+    
+    def _ricarica(self, adesso: float) -> None:
+        self.disponibili = min(self.capacita, self.disponibili + (adesso - self._ultimo) * self.ricarica_al_secondo)
+        self._ultimo = adesso
+    
+    def attesa(self, quantita: float, adesso: float) -> float:
+        """Secondi da attendere prima di poter consumare quantita (0 = subito)"""
+        
+        self._ricarica(adesso)
+        # Una richiesta più grande del secchio passa quando il secchio è pieno
+        quantita = min(quantita, self.capacita)
+        if self.disponibili >= quantita:
+            return 0.0
+        return (quantita - self.disponibili) / self.ricarica_al_secondo
+    
+    def consuma(self, quantita: float) -> None:
+        self.disponibili -= min(quantita, self.capacita)
+
+
+def _secondi_retry_after(valore: str) -> Optional[float]:
+    """Interpreta Retry-After come secondi o come data HTTP"""
+    
+    try:
+        return max(0.0, float(valore))
+    except (TypeError, ValueError):
+        pass
+    
+    try:
+        return max(0.0, parsedate_to_datetime(valore).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class RateLimiter:
+    """
+    Limitatore a due secchi: richieste al secondo e token al minuto
+    
+    Il ritmo delle richieste si adatta alla quota reale: si dimezza a ogni
+    429 e risale gradualmente verso il limite configurato con le risposte
+    riuscite. Retry-After e gli header X-RateLimit-* sospendono tutte le
+    richieste fino al reset indicato dal provider.
+    """
+    
+    def __init__(self, richieste_al_secondo: float = 1.0, token_al_minuto: int = None, nome: str = ''):
+        self.nome = nome
+        self.ritmo_massimo = richieste_al_secondo
+        self.ritmo = richieste_al_secondo
+        self._richieste = TokenBucket(max(1.0, richieste_al_secondo), richieste_al_secondo)
+        self._token = TokenBucket(token_al_minuto, token_al_minuto / 60.0) if token_al_minuto else None
+        self._pausa_fino = 0.0
+        self._lock = threading.Lock()
+        
+        self.attese_totali = 0.0
+        self.risposte_429 = 0
+    
+    def _prenota(self, token_stimati: int) -> float:
+        """Consuma i permessi se disponibili, altrimenti restituisce l'attesa necessaria"""
+        
+        with self._lock:
+            adesso = time.monotonic()
+            attesa = max(
+                self._pausa_fino - adesso,
+                self._richieste.attesa(1, adesso),
+                self._token.attesa(token_stimati, adesso) if self._token else 0.0
+            )
+            if attesa <= 0:
+                self._richieste.consuma(1)
+                if self._token:
+                    self._token.consuma(token_stimati)
+            return attesa
+    
+    def acquisisci(self, token_stimati: int = 0) -> None:
+        """Blocca finché la richiesta non rientra nei limiti"""
+        
+        while True:
+            attesa = self._prenota(token_stimati)
+            if attesa <= 0:
+                return
+            self.attese_totali += attesa
+            time.sleep(attesa)
+    
+    async def aacquisisci(self, token_stimati: int = 0) -> None:
+        """Versione asincrona di acquisisci"""
+        
+        while True:
+            attesa = self._prenota(token_stimati)
+            if attesa <= 0:
+                return
+            self.attese_totali += attesa
+            await asyncio.sleep(attesa)
+    
+    def _imposta_ritmo(self, ritmo: float) -> None:
+        self.ritmo = max(_RITMO_MINIMO, min(self.ritmo_massimo, ritmo))
+        self._richieste.ricarica_al_secondo = self.ritmo
+    
+    def _sospendi(self, secondi: float) -> None:
+        self._pausa_fino = max(self._pausa_fino, time.monotonic() + secondi)
+    
+    def segnala_successo(self) -> None:
+        """Richiesta riuscita: il ritmo risale verso il limite configurato"""
+        
+        with self._lock:
+            if self.ritmo < self.ritmo_massimo:
+                self._imposta_ritmo(self.ritmo * _FATTORE_RECUPERO)
+    
+    def segnala_429(self, retry_after: float = None) -> None:
+        """Il provider ha rifiutato per rate limit: pausa globale e ritmo dimezzato"""
+        
+        with self._lock:
+            self.risposte_429 += 1
+            self._sospendi(retry_after if retry_after is not None else _PAUSA_429_DEFAULT)
+            self._imposta_ritmo(self.ritmo * _FATTORE_RIDUZIONE)
+        
+        logging.warning(f"Rate limit {self.nome}: 429 ricevuto, pausa {retry_after or _PAUSA_429_DEFAULT:.1f}s, "
+                        f"ritmo ridotto a {self.ritmo:.2f} richieste/s")
+    
+    def aggiorna_da_headers(self, headers: Mapping[str, str]) -> Optional[float]:
+        """
+        Applica Retry-After e X-RateLimit-Remaining/Reset inviati dal provider
+        
+        Returns:
+            Secondi di Retry-After, se presenti
+        """
+        
+        retry_after = None
+        if headers.get('Retry-After') is not None:
+            retry_after = _secondi_retry_after(headers.get('Retry-After'))
+        
+        rimanenti = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        
+        with self._lock:
+            if retry_after:
+                self._sospendi(retry_after)
+            
+            # Quota esaurita: nessuna richiesta fino al reset (timestamp in ms o s)
+            if rimanenti is not None and reset is not None:
+                try:
+                    if int(float(rimanenti)) <= 0:
+                        istante = float(reset)
+                        istante = istante / 1000.0 if istante > 1e11 else istante
+                        self._sospendi(max(0.0, istante - time.time()))
+                except ValueError:
+                    pass
+        
+        return retry_after
+    
+    def stats(self) -> Dict[str, Any]:
+        """Statistiche del limitatore"""
+        
+        return {
+            "ritmo_attuale": self.ritmo,
+            "ritmo_massimo": self.ritmo_massimo,
+            "risposte_429": self.risposte_429,
+            "secondi_in_attesa": round(self.attese_totali, 2)
+        }
+
+
+_limitatori: Dict[str, RateLimiter] = {}
+_limitatori_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str,
+                     richieste_al_secondo: float = None,
+                     token_al_minuto: int = None,
+                     chiave: str = None) -> RateLimiter:
+    """
+    Restituisce il limitatore condiviso del provider (o del singolo server)
+    
+    I limiti arrivano, in ordine di priorità, dagli argomenti, dal file .env
+    (<PROVIDER>_RPS, <PROVIDER>_TPM) e da DEFAULT_RATE_LIMITS.
+    
+    Args:
+        provider: 'ollama' o 'openrouter'
+        richieste_al_secondo: Limite di richieste al secondo (opzionale)
+        token_al_minuto: Limite di token al minuto (opzionale)
+        chiave: Chiave del limitatore (default: provider); es. "ollama:<url>" per
+                dare a ogni server Ollama il proprio limitatore
+    
+    Returns:
+        Istanza di RateLimiter condivisa tra tutti i client con la stessa chiave
+    """
+    
+    provider = provider.lower()
+    default = DEFAULT_RATE_LIMITS.get(provider, {'richieste_al_secondo': 1.0, 'token_al_minuto': None})
+    
+    chiave = chiave or provider
+    
+    with _limitatori_lock:
+        limitatore = _limitatori.get(chiave)
+        if limitatore is None:
+            rps = richieste_al_secondo or float(os.getenv(f'{provider.upper()}_RPS', default['richieste_al_secondo']))
+            tpm = token_al_minuto or os.getenv(f'{provider.upper()}_TPM') or default['token_al_minuto']
+            limitatore = RateLimiter(rps, int(tpm) if tpm else None, nome=chiave)
+            _limitatori[chiave] = limitatore
+        return limitatore
+
+
+def _testo_messaggi(messages: Union[str, List[Dict[str, str]]]) -> str:
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(m.get('content', '') for m in messages)
+
+
+class RateLimitedLLM:
+    """Wrapper che fa passare ogni chiamata di un client (es. OllamaLLM) dal limitatore"""
+    
+    def __init__(self, llm: Any, rate_limiter: RateLimiter, stima_token=None):
+        self.llm = llm
+        self.rate_limiter = rate_limiter
+        self._stima_token = stima_token or (lambda testo: len(testo) // 4)
+    
+    def __getattr__(self, nome: str) -> Any:
+        return getattr(self.llm, nome)
+    
+    def invoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        self.rate_limiter.acquisisci(self._stima_token(_testo_messaggi(messages)))
+        risposta = self.llm.invoke(messages, **kwargs)
+        self.rate_limiter.segnala_successo()
+        return risposta
+    
+    async def ainvoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        await self.rate_limiter.aacquisisci(self._stima_token(_testo_messaggi(messages)))
+        risposta = await self.llm.ainvoke(messages, **kwargs)
+        self.rate_limiter.segnala_successo()
+        return risposta
+    
+    def stream(self, messages: Union[str, List[Dict[str, str]]], **kwargs):
+        self.rate_limiter.acquisisci(self._stima_token(_testo_messaggi(messages)))
+        yield from self.llm.stream(messages, **kwargs)
@@ -0,0 +1,180 @@
+"""
+📏 Token Calibration Module
+Stima dei token calibrata sui conteggi reali restituiti dai provider
+"""
+
+import os
+import json
+import atexit
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+DEFAULT_CALIBRATION_PATH = os.path.join('.cache', 'token_calibration.json')
+
+# Campioni minimi prima di fidarsi del rapporto caratteri/token e della regressione
+MIN_CAMPIONI_RAPPORTO = 3
+MIN_CAMPIONI_REGRESSIONE = 20
+
+# Regolarizzazione ridge: evita coefficienti instabili con pochi campioni simili
+_LAMBDA_RIDGE = 1e-3
+
+# Salvataggio su disco ogni N nuovi campioni (e comunque all'uscita)
+_SALVA_OGNI = 25
+
+
+def estrai_feature(testo: str) -> List[float]:
+    """
+    Feature testuali usate dalla regressione
+    
+    L'italiano con accenti ed emoji si tokenizza peggio dell'ASCII puro,
+    quindi caratteri ASCII e non ASCII hanno pesi separati.
+    
+    Returns:
+        [caratteri ASCII, caratteri non ASCII, parole, intercetta]
+    """
+    
+    non_ascii = sum(1 for c in testo if ord(c) > 127)
+    return [float(len(testo) - non_ascii), float(non_ascii), float(len(testo.split())), 1.0]
+
+
+class TokenCalibrator:
+    """Modello per-modello token ≈ f(testo), aggiornato con i conteggi dei provider"""
+    
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('TOKEN_CALIBRATION_PATH', DEFAULT_CALIBRATION_PATH)
+        self._lock = threading.Lock()
+        self._lock_salvataggio = threading.Lock()
+        self._modelli: Dict[str, Dict[str, Any]] = {}
+        self._coefficienti: Dict[str, np.ndarray] = {}
+        self._non_salvati = 0
+        self.carica()
+    
+    def _stato(self, model: str) -> Dict[str, Any]:
+        stato = self._modelli.get(model)
+        if stato is None:
+            stato = {
+                "campioni": 0,
+                "caratteri": 0,
+                "token": 0,
+                "xtx": [[0.0] * 4 for _ in range(4)],
+                "xty": [0.0] * 4
+            }
+            self._modelli[model] = stato
+        return stato
+    
+    def registra(self, model: str, testo: str, token_reali: int) -> None:
+        """
+        Aggiunge un campione (testo, token contati dal provider)
+        
+        Args:
+            model: Nome del modello che ha tokenizzato il testo
+            testo: Testo inviato o ricevuto
+            token_reali: Token riportati dal provider per quel testo
+        """
+        
+        if not model or not testo or not token_reali or token_reali <= 0:
+            return
+        
+        x = np.array(estrai_feature(testo))
+        
+        with self._lock:
+            stato = self._stato(model)
+            stato["campioni"] += 1
+            stato["caratteri"] += len(testo)
+            stato["token"] += int(token_reali)
+            stato["xtx"] = (np.array(stato["xtx"]) + np.outer(x, x)).tolist()
+            stato["xty"] = (np.array(stato["xty"]) + x * token_reali).tolist()
+            self._coefficienti.pop(model, None)
+            self._non_salvati += 1
+            da_salvare = self._non_salvati >= _SALVA_OGNI
+        
+        if da_salvare:
+            self.salva()
+    
+    def stima(self, model: str, testo: str) -> Optional[int]:
+        """
+        Stima i token di un testo per il modello indicato
+        
+        Returns:
+            Numero stimato di token, o None se non ci sono dati sufficienti
+        """
+        
+        with self._lock:
+            stato = self._modelli.get(model)
+            if not stato or stato["campioni"] < MIN_CAMPIONI_RAPPORTO:
+                return None
+            
+            if stato["campioni"] >= MIN_CAMPIONI_REGRESSIONE:
+                coefficienti = self._coefficienti.get(model)
+                if coefficienti is None:
+                    xtx = np.array(stato["xtx"]) + _LAMBDA_RIDGE * np.eye(4)
+                    coefficienti = np.linalg.solve(xtx, np.array(stato["xty"]))
+                    self._coefficienti[model] = coefficienti
+                return max(1, int(round(float(np.dot(coefficienti, estrai_feature(testo))))))
+            
+            rapporto = stato["caratteri"] / stato["token"]
+        
+        return max(1, int(round(len(testo) / rapporto)))
+    
+    def caratteri_per_token(self, model: str) -> Optional[float]:
+        """Rapporto medio caratteri/token osservato per il modello"""
+        
+        with self._lock:
+            stato = self._modelli.get(model)
+            if not stato or not stato["token"]:
+                return None
+            return stato["caratteri"] / stato["token"]
+    
+    def carica(self) -> None:
+        """Carica la calibrazione salvata nelle sessioni precedenti"""
+        
+        if not os.path.exists(self.path):
+            return
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                dati = json.load(f)
+            with self._lock:
+                self._modelli.update(dati.get("modelli", {}))
+                self._coefficienti.clear()
+        except Exception as e:
+            logging.warning(f"Calibrazione token non caricata ({self.path}): {e}")
+    
+    def salva(self) -> None:
+        """Salva la calibrazione su disco (scrittura atomica)"""
+        
+        with self._lock:
+            if not self._modelli:
+                return
+            dati = json.dumps({"modelli": self._modelli}, ensure_ascii=False)
+            self._non_salvati = 0
+        
+        try:
+            with self._lock_salvataggio:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                temporaneo = f"{self.path}.tmp"
+                with open(temporaneo, 'w', encoding='utf-8') as f:
+                    f.write(dati)
+                os.replace(temporaneo, self.path)
+        except Exception as e:
+            logging.warning(f"Calibrazione token non salvata ({self.path}): {e}")
+
+
+_calibratore = None
+_calibratore_lock = threading.Lock()
+
+
+def get_calibrator() -> TokenCalibrator:
+    """Restituisce il calibratore condiviso (salvato automaticamente all'uscita)"""
+    
+    global _calibratore
+    with _calibratore_lock:
+        if _calibratore is None:
+            _calibratore = TokenCalibrator()
+            atexit.register(_calibratore.salva)
+        return _calibratore
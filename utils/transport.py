@@ -0,0 +1,316 @@
+"""
+🛡️ Transport Module
+Timeout, retry con backoff, circuit breaker e scadenza dell'esecuzione per le chiamate LLM
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+import httpx
+import requests
+
+try:
+    from .config_manager import AnalysisConfig
+    from .rate_limiter import RateLimitError
+except ImportError:
+    from config_manager import AnalysisConfig
+    from rate_limiter import RateLimitError
+
+
+class CircuitOpenError(Exception):
+    """L'endpoint ha fallito troppe volte di seguito: le chiamate vengono rifiutate subito"""
+
+
+class DeadlineExceededError(Exception):
+    """È stata superata la durata massima dell'esecuzione"""
+
+
+@dataclass
+class TransportPolicy:
+    """Politica di trasporto comune a tutti i provider"""
+    
+    timeout_seconds: float = 30.0
+    max_retries: int = 3
+    backoff_base: float = 1.0
+    backoff_max: float = 30.0
+    run_deadline_seconds: float = 0.0
+    soglia_circuito: int = 5
+    reset_circuito_secondi: float = 30.0
+    
+    @classmethod
+    def from_config(cls, config: Union[AnalysisConfig, Dict[str, Any]] = None) -> 'TransportPolicy':
+        """
+        Costruisce la politica dai parametri avanzati di AnalysisConfig
+        
+        Args:
+            config: AnalysisConfig o dizionario con timeout_seconds, max_retries,
+                    backoff_base_seconds e run_deadline_seconds
+        
+        Returns:
+            Istanza di TransportPolicy
+        """
+        
+        default = AnalysisConfig()
+        if config is None:
+            config = {}
+        elif isinstance(config, AnalysisConfig):
+            config = config.to_dict()
+        
+        return cls(
+            timeout_seconds=float(config.get('timeout_seconds', default.timeout_seconds)),
+            max_retries=int(config.get('max_retries', default.max_retries)),
+            backoff_base=float(config.get('backoff_base_seconds', default.backoff_base_seconds)),
+            run_deadline_seconds=float(config.get('run_deadline_seconds', default.run_deadline_seconds) or 0)
+        )
+    
+    def attesa_backoff(self, tentativo: int, retry_after: float = None) -> float:
+        """
+        Attesa prima del tentativo successivo: backoff esponenziale con full jitter
+        
+        Args:
+            tentativo: Numero del tentativo fallito (0 = primo)
+            retry_after: Attesa minima indicata dal provider (opzionale)
+        """
+        
+        attesa = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** tentativo)))
+        if retry_after is not None:
+            attesa = max(attesa, retry_after)
+        return attesa
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker per endpoint: chiuso → aperto dopo N errori consecutivi →
+    semi-aperto dopo il periodo di reset (una sola chiamata di prova)
+    """
+    
+    def __init__(self, nome: str, soglia: int = 5, reset_secondi: float = 30.0):
+        self.nome = nome
+        self.soglia = soglia
+        self.reset_secondi = reset_secondi
+        self.errori_consecutivi = 0
+        self.aperto_dal: Optional[float] = None
+        self._prova_in_corso = False
+        self._lock = threading.Lock()
+    
+    @property
+    def stato(self) -> str:
+        with self._lock:
+            return self._stato(time.monotonic())
+    
+    def _stato(self, adesso: float) -> str:
+        if self.aperto_dal is None:
+            return 'chiuso'
+        if adesso - self.aperto_dal >= self.reset_secondi:
+            return 'semi-aperto'
+        return 'aperto'
+    
+    def consenti(self) -> None:
+        """Solleva CircuitOpenError se l'endpoint è considerato non disponibile"""
+        
+        with self._lock:
+            stato = self._stato(time.monotonic())
+            if stato == 'chiuso':
+                return
+            if stato == 'semi-aperto' and not self._prova_in_corso:
+                self._prova_in_corso = True
+                return
+            attesa = self.reset_secondi - (time.monotonic() - self.aperto_dal)
+        
+        raise CircuitOpenError(f"Endpoint {self.nome} non disponibile (nuovo tentativo tra {max(0.0, attesa):.0f}s)")
+    
+    def registra_successo(self) -> None:
+        with self._lock:
+            self.errori_consecutivi = 0
+            self.aperto_dal = None
+            self._prova_in_corso = False
+    
+    def rilascia_prova(self) -> None:
+        """Errore che non dice nulla sulla salute dell'endpoint: libera la chiamata di prova senza contarlo"""
+        with self._lock:
+            self._prova_in_corso = False
+    
+    def registra_errore(self) -> None:
+        with self._lock:
+            self.errori_consecutivi += 1
+            riapri = self._prova_in_corso
+            self._prova_in_corso = False
+            if riapri or self.errori_consecutivi >= self.soglia:
+                if self.aperto_dal is None or riapri:
+                    logging.warning(f"Circuit breaker {self.nome}: aperto dopo {self.errori_consecutivi} errori consecutivi")
+                self.aperto_dal = time.monotonic()
+
+
+_circuiti: Dict[str, CircuitBreaker] = {}
+_circuiti_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: str, soglia: int = 5, reset_secondi: float = 30.0) -> CircuitBreaker:
+    """Restituisce il circuit breaker condiviso dell'endpoint"""
+    
+    with _circuiti_lock:
+        circuito = _circuiti.get(endpoint)
+        if circuito is None:
+            circuito = CircuitBreaker(endpoint, soglia, reset_secondi)
+            _circuiti[endpoint] = circuito
+        return circuito
+
+
+def e_ritentabile(errore: BaseException) -> bool:
+    """
+    Decide se un errore è transitorio
+    
+    Timeout, errori di connessione, 5xx e 429 si ritentano; gli altri 4xx
+    (chiave non valida, modello inesistente, richiesta malformata) no.
+    Viene esaminata l'intera catena di cause, perché i client rilanciano
+    gli errori HTTP come Exception generiche.
+    """
+    
+    while errore is not None:
+        if isinstance(errore, (RateLimitError, requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                               httpx.TimeoutException, httpx.TransportError, TimeoutError, ConnectionError)):
+            return True
+        
+        risposta = getattr(errore, 'response', None)
+        status_code = getattr(errore, 'status_code', None) or getattr(risposta, 'status_code', None)
+        if isinstance(status_code, int):
+            return status_code >= 500 or status_code in (408, 429)
+        
+        errore = errore.__cause__ or errore.__context__
+    
+    return True
+
+
+class ResilientLLM:
+    """
+    Wrapper che applica TransportPolicy e circuit breaker a qualsiasi client con invoke()
+    
+    Sono coperti invoke, ainvoke e stream; gli altri attributi passano al client.
+    """
+    
+    def __init__(self, llm: Any, policy: TransportPolicy = None, endpoint: str = None):
+        self.llm = llm
+        self.policy = policy or TransportPolicy()
+        self.endpoint = endpoint or str(getattr(llm, 'base_url', 'llm'))
+        self.circuito = get_circuit_breaker(
+            self.endpoint, self.policy.soglia_circuito, self.policy.reset_circuito_secondi
+        )
+        self._scadenza: Optional[float] = None
+        self.tentativi_ripetuti = 0
+    
+    def __getattr__(self, nome: str) -> Any:
+        return getattr(self.llm, nome)
+    
+    def avvia_run(self) -> None:
+        """Fa partire (o ripartire) il conteggio della durata massima dell'esecuzione"""
+        
+        if self.policy.run_deadline_seconds:
+            self._scadenza = time.monotonic() + self.policy.run_deadline_seconds
+    
+    def _tempo_rimanente(self) -> Optional[float]:
+        if not self.policy.run_deadline_seconds:
+            return None
+        if self._scadenza is None:
+            self.avvia_run()
+        rimanente = self._scadenza - time.monotonic()
+        if rimanente <= 0:
+            raise DeadlineExceededError(
+                f"Durata massima dell'esecuzione superata ({self.policy.run_deadline_seconds:.0f}s)"
+            )
+        return rimanente
+    
+    def _registra_errore(self, errore: Exception) -> bool:
+        """Aggiorna il circuit breaker; restituisce se l'errore è ritentabile"""
+        
+        ritentabile = e_ritentabile(errore)
+        # Contano solo i guasti dell'endpoint (5xx, timeout, rete): i 429 indicano un provider vivo
+        # e gli altri 4xx sono errori del chiamante (chiave, schema), non dell'endpoint
+        if ritentabile and not isinstance(errore, RateLimitError):
+            self.circuito.registra_errore()
+        else:
+            self.circuito.rilascia_prova()
+        return ritentabile
+    
+    def _gestisci_errore(self, errore: Exception, tentativo: int) -> float:
+        """Registra l'errore e restituisce l'attesa prima del nuovo tentativo (o rilancia)"""
+        
+        if not self._registra_errore(errore) or tentativo >= self.policy.max_retries:
+            raise errore
+        
+        attesa = self.policy.attesa_backoff(tentativo, getattr(errore, 'retry_after', None))
+        rimanente = self._tempo_rimanente()
+        if rimanente is not None and attesa >= rimanente:
+            raise DeadlineExceededError("Tempo rimanente insufficiente per un nuovo tentativo") from errore
+        
+        self.tentativi_ripetuti += 1
+        logging.warning(f"{self.endpoint}: tentativo {tentativo + 1} fallito ({errore}), nuovo tentativo tra {attesa:.1f}s")
+        return attesa
+    
+    def invoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        for tentativo in range(self.policy.max_retries + 1):
+            self._tempo_rimanente()
+            self.circuito.consenti()
+            try:
+                risposta = self.llm.invoke(messages, **kwargs)
+            except Exception as e:
+                time.sleep(self._gestisci_errore(e, tentativo))
+                continue
+            self.circuito.registra_successo()
+            return risposta
+    
+    def stream(self, messages: Union[str, List[Dict[str, str]]], **kwargs):
+        """
+        Streaming con la stessa policy di invoke
+        
+        Si ritenta solo se l'errore arriva prima del primo pezzo: dopo, un nuovo
+        tentativo ripeterebbe testo già consegnato e l'errore viene rilanciato.
+        La durata massima dell'esecuzione è verificata a ogni pezzo.
+        """
+        
+        for tentativo in range(self.policy.max_retries + 1):
+            self._tempo_rimanente()
+            self.circuito.consenti()
+            ricevuto = False
+            try:
+                for pezzo in self.llm.stream(messages, **kwargs):
+                    ricevuto = True
+                    yield pezzo
+                    self._tempo_rimanente()
+            except DeadlineExceededError:
+                raise
+            except Exception as e:
+                if ricevuto:
+                    self._registra_errore(e)
+                    raise
+                time.sleep(self._gestisci_errore(e, tentativo))
+                continue
+            self.circuito.registra_successo()
+            return
+    
+    async def ainvoke(self, messages: Union[str, List[Dict[str, str]]], **kwargs) -> str:
+        for tentativo in range(self.policy.max_retries + 1):
+            rimanente = self._tempo_rimanente()
+            self.circuito.consenti()
+            try:
+                risposta = await asyncio.wait_for(self.llm.ainvoke(messages, **kwargs), rimanente)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and rimanente is not None and time.monotonic() >= self._scadenza:
+                    raise DeadlineExceededError("Durata massima dell'esecuzione superata") from e
+                await asyncio.sleep(self._gestisci_errore(e, tentativo))
+                continue
+            self.circuito.registra_successo()
+            return risposta
+    
+    def stats(self) -> Dict[str, Any]:
+        """Stato del circuit breaker e tentativi ripetuti"""
+        
+        return {
+            "endpoint": self.endpoint,
+            "circuito": self.circuito.stato,
+            "tentativi_ripetuti": self.tentativi_ripetuti
+        }
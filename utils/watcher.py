@@ -0,0 +1,307 @@
+"""
+👀 Watcher Module
+Sorveglianza di una cartella di export: etichetta in background le sole righe nuove
+"""
+
+import os
+import glob
+import json
+import time
+import logging
+import threading
+import zipfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    from .batch_processor import etichetta_con_coefficiente_batch
+    from .incremental import hash_commento, carica_risultati_precedenti
+except ImportError:
+    from batch_processor import etichetta_con_coefficiente_batch
+    from incremental import hash_commento, carica_risultati_precedenti
+
+
+class CartellaOsservata:
+    """
+    Demone a polling che etichetta le risposte nuove man mano che arrivano gli export
+    
+    A ogni scansione cerca i file .xlsx nuovi o modificati nella cartella. Un
+    file viene letto solo quando dimensione e data di modifica sono rimaste
+    ferme per almeno debounce_secondi (export ancora in scrittura o in
+    sincronizzazione vengono ignorati fino alla scansione successiva). Delle
+    righe lette vanno al modello solo quelle il cui commento normalizzato non è
+    già nel report continuo; il report continuo
+    (report_continuo_<tipo>.xlsx) cresce con le righe nuove e lo stato dei file
+    già elaborati sopravvive ai riavvii. Le righe in errore o non parsate
+    restano nel report finché non vengono rietichettate: il file non viene
+    segnato come elaborato e le stesse righe tornano al modello, con attesa
+    che raddoppia a ogni tentativo, sostituendo quelle fallite. Dopo
+    max_tentativi una riga viene abbandonata e resta in errore nel report;
+    i tentativi per commento sono salvati nello stato del watcher.
+    """
+    
+    def __init__(self,
+                 cartella: str,
+                 etichette_dinamiche: Dict[str, Dict],
+                 colonna_riferimento: str,
+                 tipo_analisi: str,
+                 llm: Any,
+                 ai_provider: str,
+                 output_dir: str,
+                 intervallo_secondi: float = 30.0,
+                 debounce_secondi: float = 10.0,
+                 max_tentativi: int = 3,
+                 attesa_tentativi_secondi: float = 60.0,
+                 **opzioni):
+        """
+        Args:
+            cartella: Cartella degli export (es. dati/)
+            etichette_dinamiche, colonna_riferimento, tipo_analisi, llm, ai_provider:
+                Come in etichetta_con_coefficiente_batch
+            output_dir: Cartella del report continuo e dello stato del watcher
+            intervallo_secondi: Pausa tra due scansioni
+            debounce_secondi: Tempo per cui un file deve restare invariato prima di essere letto
+            max_tentativi: Tentativi di etichettatura per commento prima di abbandonarlo
+            attesa_tentativi_secondi: Attesa dopo il primo tentativo fallito, raddoppiata a ogni tentativo
+            **opzioni: Altri parametri di etichetta_con_coefficiente_batch
+        """
+        self.cartella = cartella
+        self.etichette_dinamiche = etichette_dinamiche
+        self.colonna_riferimento = colonna_riferimento
+        self.tipo_analisi = tipo_analisi
+        self.llm = llm
+        self.ai_provider = ai_provider
+        self.output_dir = output_dir
+        self.intervallo_secondi = intervallo_secondi
+        self.debounce_secondi = debounce_secondi
+        self.max_tentativi = max_tentativi
+        self.attesa_tentativi_secondi = attesa_tentativi_secondi
+        self.opzioni = opzioni
+        
+        os.makedirs(output_dir, exist_ok=True)
+        self.report_path = os.path.join(output_dir, f'report_continuo_{tipo_analisi}.xlsx')
+        self._stato_path = os.path.join(output_dir, f'stato_watcher_{tipo_analisi}.json')
+        
+        # Stato persistente: firma dei file elaborati e, per hash del commento, [tentativi falliti, prossimo tentativo]
+        self._elaborati, self._tentativi = self._carica_stato()
+        self._in_attesa: Dict[str, Tuple[Tuple[int, float], float]] = {}
+        self._archivio = (carica_risultati_precedenti(self.report_path, colonna_riferimento)
+                          if os.path.exists(self.report_path) else {})
+        
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        
+        self.righe_etichettate = 0
+        self.righe_gia_note = 0
+        self.righe_abbandonate = 0
+        self.file_elaborati = 0
+    
+    def _carica_stato(self) -> Tuple[Dict[str, List], Dict[str, List]]:
+        if not os.path.exists(self._stato_path):
+            return {}, {}
+        try:
+            with open(self._stato_path, 'r', encoding='utf-8') as f:
+                stato = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Watcher: stato illeggibile, tutti i file verranno riletti ({e})")
+            return {}, {}
+        
+        # Formato precedente: solo percorso → firma
+        if not isinstance(stato.get("file"), dict):
+            return stato, {}
+        return stato["file"], stato.get("tentativi", {})
+    
+    def _salva_stato(self) -> None:
+        temporaneo = f"{self._stato_path}.tmp"
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            json.dump({"file": self._elaborati, "tentativi": self._tentativi}, f, ensure_ascii=False)
+        os.replace(temporaneo, self._stato_path)
+    
+    def _registra_tentativi(self, hash_nuove: List[str]) -> None:
+        """Azzera i tentativi delle righe entrate in archivio e aggiorna quelli delle fallite"""
+        
+        adesso = time.time()
+        for chiave in hash_nuove:
+            if chiave in self._archivio:
+                self._tentativi.pop(chiave, None)
+                continue
+            falliti = self._tentativi.get(chiave, [0, 0.0])[0] + 1
+            self._tentativi[chiave] = [falliti, adesso + self.attesa_tentativi_secondi * 2 ** (falliti - 1)]
+            if falliti >= self.max_tentativi:
+                self.righe_abbandonate += 1
+                logging.warning(f"Watcher: commento {chiave[:12]} non etichettato dopo {falliti} tentativi, abbandonato")
+    
+    def file_pronti(self) -> List[str]:
+        """
+        File nuovi o modificati rimasti invariati per almeno debounce_secondi
+        
+        Returns:
+            Percorsi da elaborare, in ordine di modifica
+        """
+        
+        adesso = time.monotonic()
+        pronti = []
+        for path in glob.glob(os.path.join(self.cartella, '*.xlsx')):
+            # File di blocco di Excel e file nascosti
+            if os.path.basename(path).startswith(('~$', '.')):
+                continue
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            
+            firma = (info.st_size, info.st_mtime)
+            if self._elaborati.get(path) == list(firma):
+                self._in_attesa.pop(path, None)
+                continue
+            
+            precedente = self._in_attesa.get(path)
+            if precedente is None or precedente[0] != firma:
+                self._in_attesa[path] = (firma, adesso)
+            elif adesso - precedente[1] >= self.debounce_secondi:
+                pronti.append(path)
+        
+        return sorted(pronti, key=lambda p: self._in_attesa[p][0][1])
+    
+    def elabora_file(self, path: str) -> int:
+        """
+        Etichetta le righe nuove di un export e le aggiunge al report continuo
+        
+        Returns:
+            Numero di righe inviate al modello
+        """
+        
+        firma = self._in_attesa.get(path, (None,))[0]
+        df = pd.read_excel(path)
+        in_sospeso = 0
+        
+        if self.colonna_riferimento not in df.columns:
+            logging.warning(f"Watcher: {os.path.basename(path)} senza la colonna '{self.colonna_riferimento}', ignorato")
+            nuove = pd.DataFrame()
+        else:
+            hash_righe = df[self.colonna_riferimento].map(lambda c: None if pd.isna(c) else hash_commento(c))
+            nuove_mask = hash_righe.notna() & ~hash_righe.isin(list(self._archivio))
+            self.righe_gia_note += int((hash_righe.notna() & ~nuove_mask).sum())
+            # Le risposte ripetute nello stesso export si etichettano una volta sola
+            nuove_mask &= ~hash_righe.duplicated()
+            
+            # Righe già fallite: abbandonate dopo max_tentativi, altrimenti attendono il proprio turno
+            adesso = time.time()
+            tentativi = hash_righe.map(lambda h: self._tentativi.get(h, [0, 0.0]) if h else [0, 0.0])
+            abbandonate = tentativi.map(lambda t: t[0] >= self.max_tentativi).astype(bool)
+            in_attesa = tentativi.map(lambda t: t[0] < self.max_tentativi and t[1] > adesso).astype(bool)
+            in_sospeso = int((nuove_mask & in_attesa).sum())
+            nuove_mask &= ~abbandonate & ~in_attesa
+            nuove = df[nuove_mask].reset_index(drop=True)
+        
+        if len(nuove):
+            print(f"👀 {os.path.basename(path)}: {len(nuove)} righe nuove da etichettare")
+            risultati = etichetta_con_coefficiente_batch(
+                nuove, self.etichette_dinamiche, self.colonna_riferimento,
+                self.tipo_analisi, self.llm, self.ai_provider, **self.opzioni
+            )
+            self._aggiungi_al_report(nuove, risultati, path)
+            
+            hash_nuove = list(nuove[self.colonna_riferimento].map(hash_commento))
+            self.righe_etichettate += sum(1 for chiave in hash_nuove if chiave in self._archivio)
+            self._registra_tentativi(hash_nuove)
+            in_sospeso += sum(1 for chiave in hash_nuove if chiave not in self._archivio
+                              and self._tentativi[chiave][0] < self.max_tentativi)
+            self._salva_stato()
+        
+        if in_sospeso:
+            # Il file resta in attesa: le righe fallite si riprovano quando scade la loro attesa
+            logging.warning(f"Watcher: {in_sospeso} righe di {os.path.basename(path)} non etichettate, "
+                            f"nuovo tentativo più tardi")
+            return len(nuove)
+        
+        if firma is not None:
+            self._elaborati[path] = list(firma)
+            self._in_attesa.pop(path, None)
+            self._salva_stato()
+        self.file_elaborati += 1
+        return len(nuove)
+    
+    def _aggiungi_al_report(self, nuove: pd.DataFrame, risultati: Dict[str, Any], path: str) -> None:
+        df_nuove = nuove.copy()
+        df_nuove['Etichetta_Principale'] = risultati["etichette_principali"]
+        df_nuove['Coefficiente_Principale'] = risultati["coefficienti_principali"]
+        df_nuove['Etichette_Secondarie'] = risultati["etichette_secondarie"]
+        df_nuove['Confidenza_Generale'] = risultati["confidenza_media"]
+        df_nuove['Coefficienti_Completi'] = risultati["coefficienti_completi"]
+        df_nuove['File_Origine'] = os.path.basename(path)
+        df_nuove['Etichettato_Il'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        
+        if os.path.exists(self.report_path):
+            df_report = pd.read_excel(self.report_path)
+            # Le righe nuove non sono in archivio: una riga del report con lo stesso commento è un tentativo fallito
+            hash_nuove = set(df_nuove[self.colonna_riferimento].map(hash_commento))
+            sostituite = df_report[self.colonna_riferimento].map(
+                lambda c: not pd.isna(c) and hash_commento(c) in hash_nuove
+            )
+            df_report = pd.concat([df_report[~sostituite], df_nuove], ignore_index=True)
+        else:
+            df_report = df_nuove
+        
+        temporaneo = os.path.join(self.output_dir, f'.tmp_report_continuo_{self.tipo_analisi}.xlsx')
+        df_report.to_excel(temporaneo, index=False)
+        os.replace(temporaneo, self.report_path)
+        
+        # Le righe in errore restano fuori dall'archivio: verranno riprovate alla prossima scansione
+        nuovo_archivio = carica_risultati_precedenti(self.report_path, self.colonna_riferimento)
+        self._archivio.update(nuovo_archivio)
+    
+    def scansiona(self) -> int:
+        """
+        Una scansione della cartella: elabora i file pronti
+        
+        Returns:
+            Righe inviate al modello in questa scansione
+        """
+        
+        etichettate = 0
+        for path in self.file_pronti():
+            try:
+                etichettate += self.elabora_file(path)
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                # File ancora incompleto o bloccato: si riprova alla scansione successiva
+                logging.warning(f"Watcher: lettura di {os.path.basename(path)} fallita, nuovo tentativo più tardi ({e})")
+                self._in_attesa.pop(path, None)
+        return etichettate
+    
+    def _ciclo(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.scansiona()
+            except Exception as e:
+                logging.error(f"Watcher: errore durante la scansione di {self.cartella}: {e}")
+            self._stop.wait(self.intervallo_secondi)
+    
+    def avvia(self) -> None:
+        """Avvia la sorveglianza in un thread in background"""
+        
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._ciclo, name='watcher-etichette', daemon=True)
+        self._thread.start()
+        print(f"👀 Watcher attivo su {self.cartella} (ogni {self.intervallo_secondi:.0f}s) → {self.report_path}")
+    
+    def ferma(self, timeout: float = None) -> None:
+        """Ferma la sorveglianza al termine della scansione in corso"""
+        
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def stats(self) -> Dict[str, Any]:
+        """File elaborati, righe entrate nel report continuo, righe già presenti e righe abbandonate"""
+        
+        return {
+            "file_elaborati": self.file_elaborati,
+            "righe_etichettate": self.righe_etichettate,
+            "righe_gia_note": self.righe_gia_note,
+            "righe_abbandonate": self.righe_abbandonate,
+            "file_in_attesa": len(self._in_attesa)
+        }